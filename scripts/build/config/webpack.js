@@ -7,6 +7,7 @@ import root from '../utils/root.js';
 import mapWebpackUrlPrefix from '../utils/mapWebpackUrlPrefix.js';
 import DummyOutputPlugin from '../plugins/webpackDummyOutputPlugin.js';
 import StaticManifestPlugin from '../plugins/webpackStaticManifestPlugin.js';
+import CompressPlugin from '../plugins/webpackCompressPlugin.js';
 import FriendlyErrorsPlugin from 'friendly-errors-webpack-plugin';
 import OptimizeCssAssetsPlugin from 'optimize-css-assets-webpack-plugin';
 import ExtractTextPlugin from 'extract-text-webpack-plugin';
@@ -291,6 +292,12 @@ export default function (env = {}) {
           'katex/',
         ],
       }),
+
+      // Pre-compress text assets, so that they are not compressed on serving
+      env.production
+        ? new CompressPlugin({ test: /\.(js|css|map|svg|ttf|eot|json)$/ })
+        : function () {}
+        ,
     ],
   };
 
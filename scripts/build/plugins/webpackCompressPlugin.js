@@ -0,0 +1,44 @@
+const zlib = require('zlib');
+
+// Emits pre-compressed .gz and .br variants of assets, which are served
+// by vj4.handler.static to clients accepting them.
+export default class CompressPlugin {
+  constructor({ test, minSize = 1024 }) {
+    this.test = test;
+    this.minSize = minSize;
+  }
+  apply(compiler) {
+    compiler.plugin('emit', (compilation, callback) => {
+      Object.keys(compilation.assets).forEach((name) => {
+        // Remove the hash in names like xxx?hash
+        const fileName = name.replace(/\?[\s\S]*/, '');
+        if (!this.test.test(fileName)) {
+          return;
+        }
+        let source = compilation.assets[name].source();
+        if (!Buffer.isBuffer(source)) {
+          source = Buffer.from(source);
+        }
+        if (source.length < this.minSize) {
+          return;
+        }
+        const variants = [[`${fileName}.gz`, zlib.gzipSync(source, { level: 9 })]];
+        // Brotli is available since Node.js 11.7
+        if (zlib.brotliCompressSync) {
+          variants.push([`${fileName}.br`, zlib.brotliCompressSync(source, {
+            params: { [zlib.constants.BROTLI_PARAM_QUALITY]: zlib.constants.BROTLI_MAX_QUALITY },
+          })]);
+        }
+        variants.forEach(([variantName, data]) => {
+          if (data.length < source.length) {
+            compilation.assets[variantName] = {
+              source: () => data,
+              size: () => data.length,
+            };
+          }
+        });
+      });
+      callback();
+    });
+  }
+}
@@ -1,5 +1,8 @@
 import asyncio
+import collections
+import contextlib
 import logging
+import time
 from os import path
 
 import sockjs
@@ -7,8 +10,17 @@ from aiohttp import web
 
 from vj4 import db
 from vj4 import error
+from vj4.handler import middleware
+from vj4.handler import static
 from vj4.model import system
+# Aliased, the handler modules of the same names are imported in Application.__init__.
+from vj4.model import domain as domain_model
+from vj4.model.adaptor import contest as contest_model
+from vj4.model.adaptor import problem as problem_model
 from vj4.service import bus
+from vj4.service import fragmentcache
+from vj4.service import pagecache
+from vj4.service import sessioncache
 from vj4.service import smallcache
 from vj4.service import staticmanifest
 from vj4.util import json
@@ -44,40 +56,102 @@ options.define('moss_user_id', default=987654321, help='Stanford Moss User ID')
 
 _logger = logging.getLogger(__name__)
 
+STATIC_PATH = path.join(path.dirname(__file__), '.uibuild')
+TRANSLATION_PATH = path.join(path.dirname(__file__), 'locale')
+
+_preloaded = False
+# Routes declared by the view modules before the application is created, see preload.
+_routes = []
+_connection_routes = []
+_application = None
+
+
+def _load_views():
+  from vj4.handler import contest
+  from vj4.handler import discussion
+  from vj4.handler import domain
+  from vj4.handler import fs
+  from vj4.handler import home
+  from vj4.handler import judge
+  from vj4.handler import misc
+  from vj4.handler import problem
+  from vj4.handler import record
+  from vj4.handler import training
+  from vj4.handler import user
+  from vj4.handler import i18n
+
+
+def preload():
+  """Load the state which does not depend on the event loop, before forking workers."""
+  global _preloaded
+  staticmanifest.init(STATIC_PATH)
+  locale.load_translations(TRANSLATION_PATH)
+  _load_views()
+  _preloaded = True
+
+
+@contextlib.contextmanager
+def _phase(timings, name):
+  start = time.perf_counter()
+  yield
+  timings[name] = time.perf_counter() - start
+
+
+async def _timed(timings, name, coro):
+  with _phase(timings, name):
+    return await coro
+
 
 class Application(web.Application):
   def __init__(self):
-    super(Application, self).__init__(debug=options.debug)
+    super(Application, self).__init__(debug=options.debug,
+                                      middlewares=[middleware.conditional_compress_factory])
+    global _application
+    _application = self
     globals()[self.__class__.__name__] = lambda: self  # singleton
 
-    static_path = path.join(path.dirname(__file__), '.uibuild')
-    translation_path = path.join(path.dirname(__file__), 'locale')
-
     # Initialize components.
-    staticmanifest.init(static_path)
-    locale.load_translations(translation_path)
+    timings = collections.OrderedDict()
+    if not _preloaded:
+      with _phase(timings, 'preload'):
+        preload()
     loop = asyncio.get_event_loop()
-    loop.run_until_complete(db.init())
-    loop.run_until_complete(system.setup())
-    loop.run_until_complete(system.ensure_db_version())
-    loop.run_until_complete(asyncio.gather(tools.ensure_all_indexes(), bus.init()))
-    smallcache.init()
+    loop.run_until_complete(_timed(timings, 'db', db.init()))
+    loop.run_until_complete(_timed(timings, 'setup', system.setup()))
+    loop.run_until_complete(_timed(timings, 'db_version', system.ensure_db_version()))
+    loop.run_until_complete(asyncio.gather(
+        _timed(timings, 'indexes', tools.ensure_all_indexes_if_changed()),
+        _timed(timings, 'bus', bus.init())))
+    with _phase(timings, 'caches'):
+      smallcache.init()
+      fragmentcache.init()
+      pagecache.init()
+      sessioncache.init()
+      domain_model.init()
+      problem_model.init()
+      contest_model.init()
 
     # Load views.
-    from vj4.handler import contest
-    from vj4.handler import discussion
-    from vj4.handler import domain
-    from vj4.handler import fs
-    from vj4.handler import home
-    from vj4.handler import judge
-    from vj4.handler import misc
-    from vj4.handler import problem
-    from vj4.handler import record
-    from vj4.handler import training
-    from vj4.handler import user
-    from vj4.handler import i18n
-    if options.static:
-      self.router.add_static('/', static_path, name='static')
+    with _phase(timings, 'views'):
+      _load_views()
+      for args in _routes:
+        _add_route(self, *args)
+      for args in _connection_routes:
+        _add_connection_route(self, *args)
+      if options.static:
+        resource = self.router.add_resource('/{filename:.+}', name='static')
+        static_handler = static.StaticHandler(STATIC_PATH)
+        resource.add_route('GET', static_handler)
+        resource.add_route('HEAD', static_handler)
+    _logger.info('Application initialized: %s',
+                 ', '.join('{0} {1:.3f}s'.format(name, seconds)
+                           for name, seconds in timings.items()))
+
+
+def _add_route(application, url, name, handler):
+  application.router.add_route('*', url, handler, name=name)
+  application.router.add_route('*', '/d/{domain_id}' + url, handler,
+                               name=name + '_with_domain_id')
 
 
 def route(url, name, global_route=False):
@@ -85,14 +159,24 @@ def route(url, name, global_route=False):
     handler.NAME = handler.NAME or name
     handler.TITLE = handler.TITLE or name
     handler.GLOBAL = global_route
-    Application().router.add_route('*', url, handler, name=name)
-    Application().router.add_route('*', '/d/{domain_id}' + url, handler,
-                                   name=name + '_with_domain_id')
+    if _application:
+      _add_route(_application, url, name, handler)
+    else:
+      _routes.append((url, name, handler))
     return handler
 
   return decorate
 
 
+def _add_connection_route(application, prefix, name, handler, manager_class):
+  loop = asyncio.get_event_loop()
+  sockjs.add_endpoint(application, handler, name=name, prefix=prefix,
+                      manager=manager_class(name, application, handler, loop))
+  sockjs.add_endpoint(
+      application, handler, name=name + '_with_domain_id', prefix='/d/{domain_id}' + prefix,
+      manager=manager_class(name + '_with_domain_id', application, handler, loop))
+
+
 def connection_route(prefix, name, global_route=False):
   def decorate(conn):
     conn.GLOBAL = global_route
@@ -116,12 +200,10 @@ def connection_route(prefix, name, global_route=False):
                                     timeout=self.timeout, loop=self.loop, debug=self.debug))
         return self[id]
 
-    loop = asyncio.get_event_loop()
-    sockjs.add_endpoint(Application(), handler, name=name, prefix=prefix,
-                        manager=Manager(name, Application(), handler, loop))
-    sockjs.add_endpoint(
-        Application(), handler, name=name + '_with_domain_id', prefix='/d/{domain_id}' + prefix,
-        manager=Manager(name + '_with_domain_id', Application(), handler, loop))
+    if _application:
+      _add_connection_route(_application, prefix, name, handler, Manager)
+    else:
+      _connection_routes.append((prefix, name, handler, Manager))
     return conn
 
   return decorate
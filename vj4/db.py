@@ -1,4 +1,5 @@
 import aiomongo
+import asyncio
 import functools
 import logging
 import time
@@ -7,15 +8,28 @@ from vj4.util import options
 
 options.define('db_host', default='localhost', help='Database hostname or IP address.')
 options.define('db_name', default='test', help='Database name.')
+options.define('db_secondary_host', default='',
+               help='Hostname or IP address of a secondary of the replica set, for reads which '
+                    'tolerate staleness. Such reads go to the primary if empty.')
+options.define('db_max_staleness_seconds', default=30,
+               help='Maximum replication lag of reads from the secondary, in seconds.')
+options.define('db_staleness_check_seconds', default=5,
+               help='Interval of checking replication lag of the secondary, in seconds.')
 
 _logger = logging.getLogger(__name__)
 
-async def init():
-  global _client, _db
+_secondary_client = None
+_secondary_db = None
+# Whether the replication lag of the secondary was within bound on the last check.
+_secondary_fresh = False
+_staleness_check_task = None
+
+
+async def _create_client(uri):
   error_count = 0
   while True:
     try:
-      _client = await aiomongo.create_client('mongodb://' + options.db_host)
+      return await aiomongo.create_client(uri)
     except OSError as e:
       if error_count < 10:
         error_count += 1
@@ -24,9 +38,59 @@ async def init():
         time.sleep(5)
       else:
         raise
-    else:
-      break
+
+
+async def init():
+  global _client, _db, _secondary_client, _secondary_db, _staleness_check_task
+  _client = await _create_client('mongodb://' + options.db_host)
   _db = _client.get_database(options.db_name)
+  if options.db_secondary_host:
+    _secondary_client = await _create_client(
+        'mongodb://' + options.db_secondary_host + '/?readPreference=secondaryPreferred')
+    _secondary_db = _secondary_client.get_database(options.db_name)
+    await _check_staleness()
+    _staleness_check_task = asyncio.ensure_future(_staleness_check_worker())
+
+
+async def get_secondary_lag():
+  """Get the replication lag of the secondary, as seen by the secondary, in seconds."""
+  status = await _secondary_client.get_database('admin').command('replSetGetStatus')
+  self_optime, primary_optime, primary_heartbeat = None, None, None
+  for member in status['members']:
+    if member.get('self'):
+      self_optime = member['optimeDate']
+    if member['state'] == 1:
+      primary_optime = member['optimeDate']
+      primary_heartbeat = member.get('lastHeartbeat')
+  if self_optime is None or primary_optime is None:
+    raise ValueError('No primary in replica set status')
+  lag = (primary_optime - self_optime).total_seconds()
+  if primary_heartbeat:
+    # The optime of the primary is as of the last heartbeat.
+    lag += max(0.0, (status['date'] - primary_heartbeat).total_seconds())
+  return max(0.0, lag)
+
+
+async def _check_staleness():
+  global _secondary_fresh
+  try:
+    lag = await get_secondary_lag()
+  except Exception as e:
+    _logger.warning('Unable to check replication lag: %s', e)
+    fresh = False
+  else:
+    # The lag may grow until the next check.
+    fresh = lag + options.db_staleness_check_seconds <= options.db_max_staleness_seconds
+  if fresh != _secondary_fresh:
+    _logger.info('Reads tolerating staleness now go to the %s',
+                 'secondary' if fresh else 'primary')
+  _secondary_fresh = fresh
+
+
+async def _staleness_check_worker():
+  while True:
+    await asyncio.sleep(options.db_staleness_check_seconds)
+    await _check_staleness()
 
 
 @functools.lru_cache()
@@ -34,6 +98,22 @@ def coll(name):
   return aiomongo.Collection(_db, name)
 
 
+@functools.lru_cache()
+def _secondary_coll(name):
+  return aiomongo.Collection(_secondary_db, name)
+
+
+def stale_coll(name):
+  """Get a collection for reads which tolerate lagging behind writes.
+
+  Reads are routed to the secondary while its replication lag is within
+  options.db_max_staleness_seconds, and to the primary otherwise. Never write through it.
+  """
+  if _secondary_db is not None and _secondary_fresh:
+    return _secondary_coll(name)
+  return coll(name)
+
+
 @functools.lru_cache()
 def fs(name):
   return aiomongo.GridFS(_db, name)
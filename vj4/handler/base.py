@@ -1,6 +1,7 @@
 import accept
 import asyncio
 import calendar
+import collections
 import functools
 import hmac
 import logging
@@ -23,9 +24,13 @@ from vj4.model import user
 from vj4.model.adaptor import contest
 from vj4.model.adaptor import setting
 from vj4.service import mailer
+from vj4.service import pagecache
+from vj4.service import sessioncache
+from vj4.util import identitymap
 from vj4.util import json
 from vj4.util import locale
 from vj4.util import options
+from vj4.util import zipstream
 
 _logger = logging.getLogger(__name__)
 
@@ -33,8 +38,14 @@ _logger = logging.getLogger(__name__)
 class HandlerBase(setting.SettingMixin):
   NAME = None
   TITLE = None
+  # Whether responses may be compressed, see middleware.conditional_compress_factory.
+  COMPRESS = True
+  # Kinds of documents which GET pages of guests depend on, or None if they are not cached, see
+  # vj4.service.pagecache.
+  PAGE_CACHE = None
 
   async def prepare(self):
+    self.idmap = identitymap.IdentityMap()
     self.translate = locale.get_translate(options.default_locale)  # Default translate for errors.
     self.session = await self.update_session()
     self.domain_id = self.request.match_info.pop('domain_id', builtin.DOMAIN_ID_SYSTEM)
@@ -128,15 +139,15 @@ class HandlerBase(setting.SettingMixin):
       token_type = token.TYPE_UNSAVED_SESSION
       session_expire_seconds = options.unsaved_session_expire_seconds
     if sid:
-      session = await token.update(sid, token_type, session_expire_seconds,
-                                   **{**kwargs,
-                                      'update_ip': self.remote_ip,
-                                      'update_ua': self.request.headers.get('User-Agent')})
+      session = await sessioncache.update(sid, token_type, session_expire_seconds,
+                                          **{**kwargs,
+                                             'update_ip': self.remote_ip,
+                                             'update_ua': self.request.headers.get('User-Agent')})
     if kwargs and not session:
-      sid, session = await token.add(token_type, session_expire_seconds,
-                                     **{**kwargs,
-                                        'create_ip': self.remote_ip,
-                                        'create_ua': self.request.headers.get('User-Agent')})
+      sid, session = await sessioncache.add(token_type, session_expire_seconds,
+                                            **{**kwargs,
+                                               'create_ip': self.remote_ip,
+                                               'create_ua': self.request.headers.get('User-Agent')})
     if session:
       cookie_kwargs = {'domain': options.cookie_domain,
                        'secure': options.cookie_secure,
@@ -158,7 +169,7 @@ class HandlerBase(setting.SettingMixin):
         token_type = token.TYPE_SAVED_SESSION
       else:
         token_type = token.TYPE_UNSAVED_SESSION
-      await token.delete(sid, token_type)
+      await sessioncache.delete(sid, token_type)
     self.clear_cookies('sid', 'save')
 
   def clear_cookies(self, *names):
@@ -218,12 +229,31 @@ class HandlerBase(setting.SettingMixin):
 
 
 class Handler(web.View, HandlerBase):
+  def _get_page_cache_key(self):
+    if (self.PAGE_CACHE is None or not options.page_cache_ttl_seconds
+        or self.request.method != 'GET'
+        or 'sid' in self.request.cookies or 'save' in self.request.cookies):
+      return None
+    return pagecache.get_key(self.request.match_info.get('domain_id', builtin.DOMAIN_ID_SYSTEM),
+                             self.PAGE_CACHE, self.request.path_qs, self.prefer_json)
+
   @asyncio.coroutine
   def __iter__(self):
     try:
+      page_cache_key = self._get_page_cache_key()
+      if page_cache_key:
+        response = pagecache.get(page_cache_key)
+        if response is not None:
+          return response
       self.response = web.Response()
+      self.deferred_json = None
       yield from HandlerBase.prepare(self)
       yield from super(Handler, self).__iter__()
+      if self.deferred_json is not None:
+        self.response.body = yield from json.encode_bytes_async(self.deferred_json)
+      if (page_cache_key and self.response.status == web.HTTPOk.status_code
+          and not self.response.cookies and isinstance(self.response.body, bytes)):
+        pagecache.set(page_cache_key, self.response)
     except asyncio.CancelledError:
       raise
     except error.UserFacingError as e:
@@ -244,32 +274,85 @@ class Handler(web.View, HandlerBase):
       uid = self.user['_id'] if hasattr(self, 'user') else None
       _logger.error('System error by %s %s %s: %s', self.url, self.remote_ip, uid, repr(e))
       raise
+    finally:
+      if options.debug and getattr(self, 'idmap', None) and self.idmap.avoided_reads:
+        _logger.debug('%s read %d documents, avoided %d reads',
+                      self.url, self.idmap.reads, self.idmap.avoided_reads)
     return self.response
 
+  @property
+  def cache_control(self):
+    # Pages of guests may be kept by browsers and revalidated with their ETag, pages of signed in
+    # users must not be written to disk, where they outlive the session.
+    session = getattr(self, 'session', None)
+    if session and 'uid' in session:
+      return 'no-store, no-cache, must-revalidate'
+    return 'private, no-cache'
+
   def render(self, template_name, **kwargs):
     self.response.content_type = 'text/html'
-    self.response.headers.add('Cache-Control', 'no-store, no-cache, must-revalidate')
+    self.response.headers.add('Cache-Control', self.cache_control)
     self.response.headers.add('Pragma', 'no-cache')
     self.response.text = self.render_html(template_name, **kwargs)
 
   def json(self, obj):
     self.response.content_type = 'application/json'
-    self.response.headers.add('Cache-Control', 'no-store, no-cache, must-revalidate')
+    self.response.headers.add('Cache-Control', self.cache_control)
     self.response.headers.add('Pragma', 'no-cache')
-    self.response.text = json.encode(obj)
+    self.response.charset = 'utf-8'
+    if json.is_large(obj):
+      # Encoded in the executor once the handler returns.
+      self.deferred_json = obj
+    else:
+      self.response.body = json.encode_bytes(obj)
+
+  def _add_attachment_header(self, file_name):
+    for char in '/<>:\"\'\\|?* ':
+      file_name = file_name.replace(char, '')
+    self.response.headers.add('Content-Disposition',
+                              'attachment; filename="{}"'.format(file_name))
 
   async def binary(self, data, content_type='application/octet-stream', file_name=None):
     self.response = web.StreamResponse()
     self.response.content_length = len(data)
     self.response.content_type = content_type
     if file_name:
-      for char in '/<>:\"\'\\|?* ':
-        file_name = file_name.replace(char, '')
-      self.response.headers.add('Content-Disposition',
-                                'attachment; filename="{}"'.format(file_name))
+      self._add_attachment_header(file_name)
     await self.response.prepare(self.request)
     self.response.write(data)
 
+  async def binary_stream(self, chunks, content_type='application/octet-stream', file_name=None):
+    """Stream the bytes chunks of an async iterable with chunked encoding."""
+    self.response = web.StreamResponse()
+    self.response.content_type = content_type
+    self.response.enable_chunked_encoding()
+    if file_name:
+      self._add_attachment_header(file_name)
+    await self.response.prepare(self.request)
+    async for chunk in chunks:
+      self.response.write(chunk)
+      await self.response.drain()
+    await self.response.write_eof()
+
+  async def binary_zip(self, entries, file_name=None):
+    """Stream a ZIP archive built from an async iterable of (zip info or name, data) entries.
+
+    Entries are compressed in the default executor and sent as soon as they are produced.
+    """
+    self.response = web.StreamResponse()
+    self.response.content_type = 'application/zip'
+    self.response.enable_chunked_encoding()
+    if file_name:
+      self._add_attachment_header(file_name)
+    await self.response.prepare(self.request)
+    loop = asyncio.get_event_loop()
+    zip_stream = zipstream.ZipStream()
+    async for zip_info_or_name, data in entries:
+      self.response.write(await loop.run_in_executor(None, zip_stream.write, zip_info_or_name, data))
+      await self.response.drain()
+    self.response.write(zip_stream.close())
+    await self.response.write_eof()
+
   @property
   def page_category(self):
     return None
@@ -344,6 +427,7 @@ class Connection(sockjs.Session, HandlerBase):
     super(Connection, self).__init__(*args, **kwargs)
     self.request = request
     self.response = web.Response()  # dummy response
+    self._pending_sends = collections.deque()
 
   async def on_open(self):
     pass
@@ -355,7 +439,32 @@ class Connection(sockjs.Session, HandlerBase):
     pass
 
   def send(self, **kwargs):
-    super(Connection, self).send(json.encode(kwargs))
+    large = json.is_large(kwargs)
+    if not large and not self._pending_sends:
+      super(Connection, self).send(json.encode(kwargs))
+      return
+    # Large messages are encoded in the executor, and the following messages wait for them so that
+    # messages are sent in order.
+    loop = asyncio.get_event_loop()
+    if large:
+      future = loop.run_in_executor(None, json.encode, kwargs)
+    else:
+      future = loop.create_future()
+      future.set_result(json.encode(kwargs))
+    self._pending_sends.append(future)
+    if len(self._pending_sends) == 1:
+      loop.create_task(self._send_pending())
+
+  async def _send_pending(self):
+    while self._pending_sends:
+      try:
+        message = await self._pending_sends[0]
+      except Exception as e:
+        _logger.exception(e)
+        message = None
+      self._pending_sends.popleft()
+      if message is not None:
+        super(Connection, self).send(message)
 
 
 @functools.lru_cache()
@@ -520,7 +629,7 @@ def limit_rate_homework(op, period_hours, max_operations_default=1000):
     async def wrapped(self, **kwargs):
       if not self.has_priv(builtin.PRIV_ALL):
         doc_type = constant.contest.CTYPE_TO_DOCTYPE['homework']
-        tdoc = await contest.get(self.domain_id, doc_type, kwargs['tid'])
+        tdoc = await contest.get(self.domain_id, doc_type, kwargs['tid'], idmap=self.idmap)
         max_operations = tdoc.get('limit_rate') or max_operations_default
         await opcount.inc(op, str(self.user['_id']) + str(kwargs['tid']) + str(kwargs['pid']),
                           period_hours * 3600, max_operations)
@@ -2,13 +2,13 @@ import os
 import asyncio
 import calendar
 import collections
+import csv
 import datetime
 import functools
 import io
 import logging
 import pytz
 import yaml
-import zipfile
 from bson import objectid
 
 from vj4 import app
@@ -16,6 +16,7 @@ from vj4 import constant
 from vj4 import error
 from vj4.model import builtin
 from vj4.model import document
+from vj4.model import fs
 from vj4.model import opcount
 from vj4.model import record
 from vj4.model import user
@@ -23,8 +24,11 @@ from vj4.model.adaptor import discussion
 from vj4.model.adaptor import contest
 from vj4.model.adaptor import moss
 from vj4.model.adaptor import problem
+from vj4.model.adaptor import similarity
 from vj4.handler import base
+from vj4.util import misc
 from vj4.util import pagination, options
+from vj4.util import zipstream
 from vj4.util.misc import filter_language, filter_content_type
 
 _logger = logging.getLogger(__name__)
@@ -137,7 +141,8 @@ class ContestVisibilityMixin(object):
 
 class ContestCommonOperationMixin(object):
     async def get_scoreboard(self, doc_type: int, tid: objectid.ObjectId, is_export: bool = False):
-        tdoc, tsdocs = await contest.get_and_list_status(self.domain_id, doc_type, tid, is_export=is_export)
+        tdoc, tsdocs = await contest.get_and_list_status(self.domain_id, doc_type, tid, is_export=is_export,
+                                                         stale_ok=True)
         if not self.can_show_scoreboard(tdoc):
             if doc_type == document.TYPE_CONTEST:
                 raise error.ContestScoreboardHiddenError(self.domain_id, tid)
@@ -168,45 +173,37 @@ class ContestCommonOperationMixin(object):
         for pid in pids:
             await problem.set_hidden(self.domain_id, pid, True)
 
-    async def get_latest_records(self, doc_type, tid, break_func=None, skip_func=None):
-        tdoc, tsdocs = await contest.get_and_list_status(self.domain_id, doc_type, tid)
-        result = []
+    async def get_latest_records(self, doc_type, tid):
+        """Get the latest record of each participant on each problem of a contest.
 
+        The latest rids are taken from the status documents, so all records are read in one query.
+        """
+        tdoc, tsdocs = await contest.get_and_list_status(self.domain_id, doc_type, tid,
+                                                         fields={'uid': 1, 'latest': 1, 'journal': 1})
+        pids = set(tdoc['pids'])
+        rids = []
         for tsdoc in tsdocs:
-            # continue if no record found
-            if not tsdoc.get('journal'):
-                continue
-
-            rids = list(map(lambda x: x['rid'], tsdoc['journal']))
-            rdocs = record.get_multi(get_hidden=True, _id={'$in': rids}).sort([('_id', -1)])
-
-            pids = set(tdoc.get('pids'))
-            async for rdoc in rdocs:
-                if break_func and break_func(rdoc):
-                    break
-                if skip_func and skip_func(rdoc):
-                    continue
-
-                # when all problem have a record, break
-                if len(pids) == 0:
-                    break
-                # we only need to get one record for each problem
-                if rdoc['pid'] not in pids:
-                    continue
-
-                pids.remove(rdoc['pid'])
-                result.append(rdoc)
-
-        return result
+            latest_rids = {}
+            for jdoc in tsdoc.get('latest', tsdoc.get('journal', [])):
+                if jdoc['pid'] in pids and (jdoc['pid'] not in latest_rids or latest_rids[jdoc['pid']] < jdoc['rid']):
+                    latest_rids[jdoc['pid']] = jdoc['rid']
+            rids.extend(sorted(latest_rids.values(), reverse=True))
+        if not rids:
+            return []
+        rdict = await record.get_dict(rids, get_hidden=True)
+        return [rdict[rid] for rid in rids if rid in rdict]
 
 
 class ContestMixin(ContestStatusMixin, ContestVisibilityMixin, ContestCommonOperationMixin):
-    pass
+    def split_tags(self, s):
+        s = s.replace('，', ',')  # Chinese ', '
+        return list(filter(lambda _: _ != '', map(lambda _: _.strip(), s.split(','))))
 
 
 @app.route('/{ctype:contest|homework}', 'contest_main')
 class ContestMainHandler(ContestMixin, ContestPageCategoryMixin, base.Handler):
     CONTESTS_PER_PAGE = 20
+    PAGE_CACHE = ('contest',)
 
     @base.route_argument
     async def get(self, *, ctype: str):
@@ -263,6 +260,7 @@ class ContestMainHandler(ContestMixin, ContestPageCategoryMixin, base.Handler):
 @app.route('/{ctype:contest|homework}/{tid:\w{24}}', 'contest_detail')
 class ContestDetailHandler(ContestMixin, ContestPageCategoryMixin, base.OperationHandler):
     DISCUSSIONS_PER_PAGE = 15
+    PAGE_CACHE = ('contest', 'problem', 'discussion')
 
     @base.require_perm(builtin.PERM_VIEW_CONTEST)
     @base.get_argument
@@ -341,18 +339,20 @@ class ContestCodeHandler(base.OperationHandler):
         for tsdoc in tsdocs:
             for pdetail in tsdoc.get('detail', []):
                 rnames[pdetail['rid']] = 'U{}_P{}_R{}'.format(tsdoc['uid'], pdetail['pid'], pdetail['rid'])
-        output_buffer = io.BytesIO()
-        zip_file = zipfile.ZipFile(output_buffer, 'a', zipfile.ZIP_DEFLATED)
-        rdocs = record.get_multi(get_hidden=True, _id={'$in': list(rnames.keys())})
-        async for rdoc in rdocs:
-            zip_file.writestr(rnames[rdoc['_id']] + '.' + rdoc['lang'], rdoc['code'])
-        # mark all files as created in Windows :p
-        for zfile in zip_file.filelist:
-            zfile.create_system = 0
-        zip_file.close()
 
-        await self.binary(output_buffer.getvalue(), 'application/zip',
-                          file_name='{}.zip'.format(tdoc['title']))
+        async def read_code(rdoc):
+            code = rdoc['code']
+            if isinstance(code, objectid.ObjectId):
+                code = await (await fs.get(code)).read()
+            return rdoc, code
+
+        async def entries():
+            rdocs = record.get_multi(get_hidden=True, _id={'$in': list(rnames.keys())})
+            async for rdoc, code in misc.prefetch(read_code, rdocs, options.contest_export_prefetch):
+                # mark all files as created in Windows :p
+                yield zipstream.make_info(rnames[rdoc['_id']] + '.' + rdoc['lang'], create_system=0), code
+
+        await self.binary_zip(entries(), file_name='{}.zip'.format(tdoc['title']))
 
 
 @app.route('/{ctype:contest|homework}/{tid}/{pid:-?\d+|\w{24}}', 'contest_detail_problem')
@@ -483,10 +483,9 @@ class ContestDetailProblemSubmitHandler(ContestMixin, ContestPageCategoryMixin,
 
         doc_type = constant.contest.CTYPE_TO_DOCTYPE[ctype]
         # TODO(iceboy): rate limit base on ip.
-        tdoc, pdoc = await asyncio.gather(contest.get(self.domain_id, doc_type, tid),
-                                          problem.get(self.domain_id, pid))
-        tsdoc = await contest.get_status(self.domain_id, doc_type, tdoc['doc_id'], self.user['_id'])
-        if not tsdoc or tsdoc.get('attend') != 1:
+        tdoc, pdoc = await asyncio.gather(contest.get(self.domain_id, doc_type, tid, idmap=self.idmap),
+                                          problem.get(self.domain_id, pid, idmap=self.idmap))
+        if not await contest.is_attended(self.domain_id, doc_type, tdoc['doc_id'], self.user['_id']):
             if ctype == 'contest':
                 raise error.ContestNotAttendedError(tdoc['doc_id'])
             elif ctype == 'homework':
@@ -510,10 +509,10 @@ class ContestDetailProblemSubmitHandler(ContestMixin, ContestPageCategoryMixin,
             raise error.InvalidArgumentError('lang')
         rid = await record.add(self.domain_id, pdoc['doc_id'], constant.record.TYPE_SUBMISSION,
                                self.user['_id'], lang, code, tid=tdoc['doc_id'], hidden=False,
-                               code_type=code_type, show_detail=show_detail)
+                               code_type=code_type, show_detail=show_detail, idmap=self.idmap)
 
         await contest.update_status(self.domain_id, tdoc['doc_id'], self.user['_id'],
-                                    rid, pdoc['doc_id'], False, 0)
+                                    rid, pdoc['doc_id'], False, 0, idmap=self.idmap)
         if not self.can_show_record(tdoc):
             self.json_or_redirect(self.reverse_url('contest_detail', ctype=ctype, tid=tdoc['doc_id']))
         else:
@@ -573,6 +572,47 @@ class ContestScoreboardDownloadHandler(ContestMixin, base.Handler):
         await self.binary(data, file_name='{}.{}'.format(file_name, ext))
 
 
+@app.route('/homework/gradebook', 'homework_gradebook')
+class HomeworkGradebookHandler(ContestMixin, base.Handler):
+    BATCH_SIZE = 100
+
+    def _format_csv(self, rows):
+        buffer = io.StringIO()
+        csv.writer(buffer).writerows(rows)
+        return buffer.getvalue().encode()
+
+    async def _get_csv_chunks(self, tdocs, gdocs):
+        columns = [self.translate('ID'), self.translate('User'), self.translate('Real Name')]
+        columns.extend(tdoc['title'] for tdoc in tdocs)
+        columns.append(self.translate('Total Score'))
+        # BOM for spreadsheet compatibility
+        yield '\uFEFF'.encode() + self._format_csv([columns])
+        batch = []
+        async for gdoc in gdocs:
+            batch.append(gdoc)
+            if len(batch) >= self.BATCH_SIZE:
+                yield await self._format_gradebook_rows(tdocs, batch)
+                batch = []
+        if batch:
+            yield await self._format_gradebook_rows(tdocs, batch)
+
+    async def _format_gradebook_rows(self, tdocs, gdocs):
+        udict = await user.get_dict(gdoc['uid'] for gdoc in gdocs)
+        rows = []
+        for gdoc in gdocs:
+            udoc = udict.get(gdoc['uid'], {})
+            scores = [gdoc['scores'].get(str(tdoc['doc_id']), 0) for tdoc in tdocs]
+            rows.append([gdoc['uid'], udoc.get('uname', ''), udoc.get('realname', ''), *scores, sum(scores)])
+        return self._format_csv(rows)
+
+    @base.require_perm(builtin.PERM_VIEW_HOMEWORK)
+    @base.require_perm(builtin.PERM_VIEW_HOMEWORK_HIDDEN_SCOREBOARD)
+    async def get(self):
+        tdocs, gdocs = await contest.get_gradebook(self.domain_id, document.TYPE_HOMEWORK)
+        await self.binary_stream(self._get_csv_chunks(tdocs, gdocs), 'text/csv',
+                                 file_name='{}_gradebook.csv'.format(self.domain_id))
+
+
 @app.route('/{ctype:contest|homework}/create', 'contest_create')
 class ContestCreateHandler(ContestMixin, ContestPageCategoryMixin, base.Handler):
     @base.route_argument
@@ -855,7 +895,10 @@ class ContestSystemTestHandler(ContestMixin, ContestPageCategoryMixin, base.Hand
             (tdoc['title'], self.reverse_url('contest_detail', ctype='homework', tid=tdoc['doc_id'])),
             (page_title, None))
         # print(tdoc)
+        similarity_result = tdoc.get('similarity_result', [])
+        udict = await user.get_dict(uid for pair in similarity_result for uid in (pair['uid_a'], pair['uid_b']))
         self.render('homework_system_test.html', tdoc=tdoc, moss_user_id=options.moss_user_id,
+                    similarity_result=similarity_result, udict=udict,
                     page_title=page_title, path_components=path_components)
 
     @base.route_argument
@@ -868,10 +911,6 @@ class ContestSystemTestHandler(ContestMixin, ContestPageCategoryMixin, base.Hand
         else:
             raise error.InvalidArgumentError('ctype')
 
-    def split_tags(self, s):
-        s = s.replace('，', ',')  # Chinese ', '
-        return sorted(list(filter(lambda _: _ != '', map(lambda _: _.strip(), s.split(',')))))
-
     @base.require_priv(builtin.PRIV_USER_PROFILE)
     @base.require_perm(builtin.PERM_EDIT_PROBLEM)
     @base.route_argument
@@ -884,16 +923,17 @@ class ContestSystemTestHandler(ContestMixin, ContestPageCategoryMixin, base.Hand
         if not self.own(tdoc, builtin.PERM_EDIT_HOMEWORK_SELF):
             self.check_perm(builtin.PERM_EDIT_HOMEWORK)
         doc_type = constant.contest.CTYPE_TO_DOCTYPE[ctype]
-        judge_category = self.split_tags(judge_category)
+        judge_category = sorted(self.split_tags(judge_category))
         tdoc, tsdocs = await contest.get_and_list_status(self.domain_id, doc_type, tid)
         pid_num = len(tdoc['pids'])
 
         for tsdoc in tsdocs:
+            journal = await contest.get_status_journal(self.domain_id, doc_type, tid, tsdoc)
             # continue if no record found
-            if not tsdoc.get('journal'):
+            if not journal:
                 continue
 
-            rids = list(map(lambda x: x['rid'], tsdoc['journal']))
+            rids = list(map(lambda x: x['rid'], journal))
             rdocs = record.get_multi(get_hidden=True, _id={'$in': rids}).sort([('_id', -1)])
 
             # find the newest record to be system tested
@@ -943,23 +983,20 @@ class ContestExporttHandler(ContestMixin, base.Handler):
         doc_type = constant.contest.CTYPE_TO_DOCTYPE[ctype]
 
         rdocs = await self.get_latest_records(doc_type, tid)
-        data = await contest.export_records(rdocs)
-        await self.binary(data, file_name='{}_records.zip'.format(tid))
+        await self.binary_zip(contest.export_records(rdocs), file_name='{}_records.zip'.format(tid))
 
 
-@app.route('/{ctype:contest|homework}/{tid}/moss', 'contest_moss')
-class ContestMosstHandler(ContestMixin, base.Handler):
-    def split_tags(self, s):
-        s = s.replace('，', ',')  # Chinese ', '
-        return list(filter(lambda _: _ != '', map(lambda _: _.strip(), s.split(','))))
+class ContestPlagiarismHandler(ContestMixin, base.Handler):
+    """Base of the handlers submitting the latest records of a homework to a plagiarism check.
+
+    Subclasses implement `check`, which runs in the background after the response is sent.
+    """
+    TASK_NAME = None
 
     @base.route_argument
     async def post(self, *, ctype: str, **kwargs):
         if ctype == 'homework':
             await self._post_homework()
-        elif ctype == 'contest':
-            raise error.InvalidArgumentError('ctype')
-            # await self._post_contest()
         else:
             raise error.InvalidArgumentError('ctype')
 
@@ -971,12 +1008,6 @@ class ContestMosstHandler(ContestMixin, base.Handler):
     @base.sanitize
     async def _post_homework(self, *, ctype: str, tid: objectid.ObjectId, language: str, wildcards: str,
                              ignore_limit: int = 10):
-        async def moss_task():
-            moss_url = await moss.moss_test(rdocs, language=language, wildcards=wildcards, ignore_limit=ignore_limit)
-            if moss_url:
-                _logger.info('moss url %s', moss_url)
-                await contest.update_moss_result(self.domain_id, document.TYPE_HOMEWORK, tid, moss_url=moss_url)
-
         tdoc = await contest.get(self.domain_id, document.TYPE_HOMEWORK, tid)
         if not self.own(tdoc, builtin.PERM_EDIT_HOMEWORK_SELF):
             self.check_perm(builtin.PERM_EDIT_HOMEWORK)
@@ -985,7 +1016,32 @@ class ContestMosstHandler(ContestMixin, base.Handler):
         rdocs = await self.get_latest_records(doc_type, tid)
         wildcards = self.split_tags(wildcards)
 
-        _logger.info('Submit Moss for %s', tid)
-        asyncio.ensure_future(moss_task())
+        _logger.info('Submit %s for %s', self.TASK_NAME, tid)
+        asyncio.ensure_future(self.check(tid, rdocs, language=language, wildcards=wildcards,
+                                         ignore_limit=ignore_limit))
 
         self.json_or_redirect(self.reverse_url('contest_system_test', ctype=ctype, tid=tid))
+
+    async def check(self, tid, rdocs, *, language, wildcards, ignore_limit):
+        raise NotImplementedError()
+
+
+@app.route('/{ctype:contest|homework}/{tid}/moss', 'contest_moss')
+class ContestMosstHandler(ContestPlagiarismHandler):
+    TASK_NAME = 'Moss'
+
+    async def check(self, tid, rdocs, *, language, wildcards, ignore_limit):
+        moss_url = await moss.moss_test(rdocs, language=language, wildcards=wildcards, ignore_limit=ignore_limit)
+        if moss_url:
+            _logger.info('moss url %s', moss_url)
+            await contest.update_moss_result(self.domain_id, document.TYPE_HOMEWORK, tid, moss_url=moss_url)
+
+
+@app.route('/{ctype:contest|homework}/{tid}/similarity', 'contest_similarity')
+class ContestSimilarityHandler(ContestPlagiarismHandler):
+    TASK_NAME = 'similarity test'
+
+    async def check(self, tid, rdocs, *, language, wildcards, ignore_limit):
+        result = await similarity.similarity_test(rdocs, language=language, wildcards=wildcards,
+                                                  ignore_limit=ignore_limit)
+        await contest.update_similarity_result(self.domain_id, document.TYPE_HOMEWORK, tid, result)
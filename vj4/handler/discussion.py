@@ -27,6 +27,7 @@ def node_url(handler, name, node_or_dtuple):
 @app.route('/discuss', 'discussion_main')
 class DiscussionMainHandler(base.Handler):
   DISCUSSIONS_PER_PAGE = 15
+  PAGE_CACHE = ('discussion',)
 
   @base.require_perm(builtin.PERM_VIEW_DISCUSSION)
   @base.get_argument
@@ -48,6 +49,7 @@ class DiscussionMainHandler(base.Handler):
 @app.route('/discuss/{doc_id:\w{1,23}|\w{25,}|[^/]*[^/\w][^/]*}', 'discussion_node')
 class DiscussionNodeHandler(contest_handler.ContestStatusMixin, base.Handler):
   DISCUSSIONS_PER_PAGE = 15
+  PAGE_CACHE = ('discussion', 'problem', 'contest')
 
   @base.require_perm(builtin.PERM_VIEW_DISCUSSION)
   @base.get_argument
@@ -138,6 +140,8 @@ class DiscussionCreateHandler(base.Handler):
 @app.route('/discuss/{did:\w{24}}', 'discussion_detail')
 class DiscussionDetailHandler(base.OperationHandler):
   REPLIES_PER_PAGE = 50
+  # Views of guests are not counted when their pages are served from the cache.
+  PAGE_CACHE = ('discussion', 'problem', 'contest')
 
   @base.require_perm(builtin.PERM_VIEW_DISCUSSION)
   @base.get_argument
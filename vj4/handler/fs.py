@@ -17,6 +17,9 @@ ALLOWED_MIMETYPE_PREFIX = ['image/', 'text/', 'application/zip']
 
 @app.route('/fs/{secret:\w{40}}', 'fs_get', global_route=True)
 class FsGetHandler(base.Handler):
+  # Files are sent as they are stored, many of them compressed already.
+  COMPRESS = False
+
   @base.route_argument
   @base.sanitize
   async def stream_data(self, *, secret: str, headers_only: bool=False):
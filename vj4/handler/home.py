@@ -17,6 +17,7 @@ from vj4.model.adaptor import setting
 from vj4.model.adaptor import userfile
 from vj4.handler import base
 from vj4.service import bus
+from vj4.service import sessioncache
 from vj4.util import useragent
 from vj4.util import geoip
 from vj4.util import misc
@@ -92,7 +93,7 @@ class HomeSecurityHandler(base.OperationHandler):
     for session in sessions:
       if (token_type == session['token_type'] and
               token_digest == hmac.new(b'token_digest', session['_id'], 'sha256').hexdigest()):
-        await token.delete_by_hashed_id(session['_id'], session['token_type'])
+        await sessioncache.delete_by_hashed_id(session['_id'], session['token_type'])
         break
     else:
       raise error.InvalidTokenDigestError(token_type, token_digest)
@@ -101,7 +102,7 @@ class HomeSecurityHandler(base.OperationHandler):
   @base.require_priv(builtin.PRIV_USER_PROFILE)
   @base.require_csrf_token
   async def post_delete_all_tokens(self):
-    await token.delete_by_uid(self.user['_id'])
+    await sessioncache.delete_by_uid(self.user['_id'])
     self.json_or_redirect(self.url)
 
 
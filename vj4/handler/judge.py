@@ -47,8 +47,7 @@ async def _post_judge(handler, rdoc):
         if accept:
             post_coros.append(_send_ac_mail(handler, rdoc))
         if rdoc['tid']:
-            post_coros.append(contest.update_status(rdoc['domain_id'], rdoc['tid'], rdoc['uid'],
-                                                    rdoc['_id'], rdoc['pid'], accept, rdoc['score']))
+            post_coros.append(contest.update_status_fast(rdoc['domain_id'], rdoc, accept, rdoc['score']))
         if not rdoc.get('rejudged'):
             if await problem.update_status(rdoc['domain_id'], rdoc['pid'], rdoc['uid'],
                                            rdoc['_id'], rdoc['status']):
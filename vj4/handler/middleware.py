@@ -0,0 +1,102 @@
+"""Response middlewares, installed by the application."""
+import asyncio
+import gzip
+import hashlib
+
+from aiohttp import web
+
+try:
+  import brotli
+except ImportError:
+  brotli = None
+
+from vj4.util import options
+
+options.define('compress_min_size', default=1024,
+               help='Minimum size of a response body to compress, in bytes.')
+options.define('compress_executor_min_size', default=262144,
+               help='Minimum size of a response body to compress in the executor, in bytes.')
+options.define('gzip_level', default=6, help='Compression level of gzip, from 1 to 9.')
+options.define('brotli_quality', default=5, help='Compression quality of brotli, from 0 to 11.')
+
+COMPRESSIBLE_TYPES = {'application/json', 'application/javascript', 'application/xml',
+                      'image/svg+xml'}
+
+
+def _is_compressible(content_type):
+  return content_type.startswith('text/') or content_type in COMPRESSIBLE_TYPES
+
+
+def accept_encodings(request):
+  encodings = set()
+  for token in request.headers.get('Accept-Encoding', '').split(','):
+    encoding, _, params = token.partition(';')
+    if params.replace(' ', '') not in ('q=0', 'q=0.0', 'q=0.00', 'q=0.000'):
+      encodings.add(encoding.strip().lower())
+  return encodings
+
+
+def _etag_matches(request, etag):
+  if_none_match = request.headers.get('If-None-Match')
+  if not if_none_match:
+    return False
+  # Weak comparison.
+  tags = {tag.strip() for tag in if_none_match.split(',')}
+  return '*' in tags or etag in tags or etag[2:] in tags
+
+
+def _not_modified(response, etag):
+  not_modified = web.Response(status=web.HTTPNotModified.status_code)
+  not_modified.headers['ETag'] = etag
+  for name in ('Cache-Control', 'Pragma', 'Vary'):
+    if name in response.headers:
+      not_modified.headers[name] = response.headers[name]
+  for name, morsel in response.cookies.items():
+    not_modified.cookies[name] = morsel
+  return not_modified
+
+
+async def _compress(request, response, body):
+  encodings = accept_encodings(request)
+  if brotli and 'br' in encodings:
+    encoding, func, args = 'br', brotli.compress, {'quality': options.brotli_quality}
+  elif 'gzip' in encodings:
+    encoding, func, args = 'gzip', gzip.compress, {'compresslevel': options.gzip_level}
+  else:
+    return
+  if len(body) >= options.compress_executor_min_size:
+    body = await asyncio.get_event_loop().run_in_executor(None, lambda: func(body, **args))
+  else:
+    body = func(body, **args)
+  response.body = body
+  response.headers['Content-Encoding'] = encoding
+
+
+async def conditional_compress_factory(app, handler):
+  """Answers conditional GET of dynamic pages with 304 and compresses their bodies.
+
+  A weak ETag is computed for each successful GET or HEAD response which may be stored. Bodies of
+  text responses are compressed with brotli if available, or gzip. Handlers with COMPRESS = False,
+  streamed responses and responses with an encoding or ETag already are left untouched.
+  """
+  async def middleware(request):
+    response = await handler(request)
+    if (not isinstance(response, web.Response) or response.prepared
+        or not isinstance(response.body, bytes) or 'ETag' in response.headers
+        or 'Content-Encoding' in response.headers):
+      return response
+    body = response.body
+    if (request.method in ('GET', 'HEAD') and response.status == web.HTTPOk.status_code
+        and 'no-store' not in response.headers.get('Cache-Control', '')):
+      etag = 'W/"{0}"'.format(hashlib.sha1(body).hexdigest())
+      if _etag_matches(request, etag):
+        return _not_modified(response, etag)
+      response.headers['ETag'] = etag
+    if (len(body) >= options.compress_min_size
+        and getattr(request.match_info.handler, 'COMPRESS', True)
+        and _is_compressible(response.content_type)):
+      response.headers.add('Vary', 'Accept-Encoding')
+      await _compress(request, response, body)
+    return response
+
+  return middleware
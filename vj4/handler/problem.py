@@ -53,6 +53,7 @@ async def render_or_json_problem_list(self, page, ppcount, pcount, pdocs,
 @app.route('/p', 'problem_main')
 class ProblemMainHandler(base.OperationHandler):
   PROBLEMS_PER_PAGE = 100
+  PAGE_CACHE = ('problem',)
 
   @base.require_perm(builtin.PERM_VIEW_PROBLEM)
   @base.get_argument
@@ -64,6 +65,7 @@ class ProblemMainHandler(base.OperationHandler):
     else:
       f = {}
     pdocs, ppcount, pcount = await pagination.paginate(problem.get_multi(domain_id=self.domain_id,
+                                                                         stale_ok=True,
                                                                          **f) \
                                                        .sort([('doc_id', 1)]),
                                                        page, self.PROBLEMS_PER_PAGE)
@@ -108,6 +110,7 @@ class ProblemRandomHandler(base.Handler):
 @app.route('/p/category/{category:[^/]*}', 'problem_category')
 class ProblemCategoryHandler(base.OperationHandler):
   PROBLEMS_PER_PAGE = 100
+  PAGE_CACHE = ('problem',)
 
   @staticmethod
   def my_split(string, delim):
@@ -145,6 +148,7 @@ class ProblemCategoryHandler(base.OperationHandler):
       f = {}
     query = ProblemCategoryHandler.build_query(category)
     pdocs, ppcount, pcount = await pagination.paginate(problem.get_multi(domain_id=self.domain_id,
+                                                                         stale_ok=True,
                                                                          **query,
                                                                          **f) \
                                                        .sort([('doc_id', 1)]),
@@ -186,6 +190,8 @@ class ProblemCategoryRandomHandler(base.Handler):
 
 @app.route('/p/{pid:-?\d+|\w{24}}', 'problem_detail')
 class ProblemDetailHandler(base.Handler):
+  PAGE_CACHE = ('problem', 'contest')
+
   @base.require_perm(builtin.PERM_VIEW_PROBLEM)
   @base.route_argument
   @base.sanitize
@@ -271,7 +277,7 @@ class ProblemSubmitHandler(base.Handler):
 
     # TODO(tc-imba) add the file size limit as a setting
 
-    pdoc = await problem.get(self.domain_id, pid)
+    pdoc = await problem.get(self.domain_id, pid, idmap=self.idmap)
     if pdoc.get('hidden', False):
       self.check_perm(builtin.PERM_VIEW_PROBLEM_HIDDEN)
 
@@ -279,7 +285,8 @@ class ProblemSubmitHandler(base.Handler):
     code_type = self.file_type or constant.record.FILE_TYPE_TEXT
     show_detail = 'show_case_detail' in pdoc and pdoc['show_case_detail']
     rid = await record.add(self.domain_id, pdoc['doc_id'], constant.record.TYPE_SUBMISSION,
-                           self.user['_id'], lang, code, code_type=code_type, show_detail=show_detail)
+                           self.user['_id'], lang, code, code_type=code_type, show_detail=show_detail,
+                           idmap=self.idmap)
     self.json_or_redirect(self.reverse_url('record_detail', rid=rid))
 
 
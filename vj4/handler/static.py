@@ -0,0 +1,59 @@
+"""Static files of the UI build, served with sendfile.
+
+Pre-compressed .br and .gz variants emitted by the build are served to clients accepting them, so
+that workers never compress static files. Fingerprinted names in the static manifest are cached
+forever by clients.
+"""
+import mimetypes
+from os import path
+
+from aiohttp import web
+
+from vj4.handler import middleware
+from vj4.service import staticmanifest
+from vj4.util import options
+
+options.define('static_max_age_seconds', default=3600,
+               help='Max age of static files which are not fingerprinted, in seconds.')
+
+# Encodings of pre-compressed variants in the order of preference, with their file suffixes.
+ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+
+# Not known to mimetypes before Python 3.9, in which case the content type would be lost.
+mimetypes.encodings_map.setdefault('.br', 'br')
+
+
+class StaticHandler(object):
+  def __init__(self, static_dir):
+    self.static_dir = path.realpath(static_dir)
+
+  def _resolve(self, filename):
+    filepath = path.realpath(path.join(self.static_dir, filename))
+    if not filepath.startswith(self.static_dir + path.sep) or not path.isfile(filepath):
+      raise web.HTTPNotFound()
+    return filepath
+
+  async def __call__(self, request):
+    filename = request.match_info['filename']
+    filepath = self._resolve(filename)
+    accept_encodings = middleware.accept_encodings(request)
+    has_variant = False
+    for encoding, suffix in ENCODINGS:
+      if path.isfile(filepath + suffix):
+        has_variant = True
+        if encoding in accept_encodings:
+          response = web.FileResponse(filepath + suffix)
+          response.headers['Content-Encoding'] = encoding
+          break
+    else:
+      response = web.FileResponse(filepath)
+    if has_variant:
+      response.headers['Vary'] = 'Accept-Encoding'
+    if request.query_string and staticmanifest.is_fingerprinted(
+        filename + '?' + request.query_string):
+      response.headers['Cache-Control'] = IMMUTABLE_CACHE_CONTROL
+    else:
+      response.headers['Cache-Control'] = 'public, max-age={0}'.format(
+          options.static_max_age_seconds)
+    return response
@@ -14,40 +14,30 @@ from vj4.util import domainjob
 _logger = logging.getLogger(__name__)
 
 
-_CACHE_INFO = {
-  'last_s': 0.0,
-  'last_y': 0,
-  'values': [0.0]
-}
-
-
 @argmethod.wrap
 def _LOGP(x: float):
   sqrt_2_pi = 2.506628274631000502415765284811 # math.sqrt(2 * math.pi)
   return math.exp(-1.0 * pow(math.log(x, math.e), 2) / 0.5) / x / 0.5 / sqrt_2_pi
 
 
-@argmethod.wrap
-def _integrate_ensure_cache(y: int):
-  last_y = _CACHE_INFO['last_y']
-  if y <= last_y:
-    return _CACHE_INFO
-  s = _CACHE_INFO['last_s']
-  dx = 0.1
-  dT = 2
-  x0 = last_y / dT * dx
-  while y > last_y:
-    x0 += dx
-    s += _LOGP(x0) * dx
-    for i in range(dT):
-      _CACHE_INFO['values'].append(s)
-    last_y += dT
-  _CACHE_INFO['last_y'] = last_y
-  _CACHE_INFO['last_s'] = s
-  return _CACHE_INFO
+# Right Riemann sums of _LOGP with a step of 0.1, where _integrate(y) is the sum of ceil(y / 2) steps.
+# They are computed on first use. Past the mode of _LOGP its terms decrease, so once a term no longer
+# changes the sum, neither does any later term, and the sums stop growing after a few hundred steps.
+_DX = 0.1
+_sums = [0.0]
+_last_x = 0.0
+_converged = False
 
 
-_integrate_ensure_cache(1000000)
+def _integrate_ensure_sums(steps: int):
+  global _last_x, _converged
+  while len(_sums) <= steps and not _converged:
+    _last_x += _DX
+    s = _sums[-1] + _LOGP(_last_x) * _DX
+    if s == _sums[-1] and _last_x > 1.0:
+      _converged = True
+    else:
+      _sums.append(s)
 
 
 @argmethod.wrap
@@ -66,8 +56,9 @@ def _integrate_direct(y: int):
 
 @argmethod.wrap
 def _integrate(y: int):
-  _integrate_ensure_cache(y)
-  return _CACHE_INFO['values'][y]
+  steps = max(0, (y + 1) // 2)
+  _integrate_ensure_sums(steps)
+  return _sums[min(steps, len(_sums) - 1)]
 
 
 @argmethod.wrap
@@ -1,26 +1,67 @@
+import asyncio
+import bisect
 import collections
 import datetime
 import functools
 import itertools
-from zipfile import ZipFile, ZipInfo, ZIP_DEFLATED
-from io import BytesIO
+import logging
+from zipfile import ZipInfo, ZIP_DEFLATED
 import mimetypes
 
 from bson import objectid
 from pymongo import errors
 
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
 from vj4 import constant
 from vj4 import error
 from vj4.model import document
 from vj4.model import fs
+from vj4.model import gradebook
 from vj4.model import record
+from vj4.model.adaptor import problem
+from vj4.service import bus
+from vj4.service import fragmentcache
+from vj4.service import pagecache
 from vj4.util import argmethod
+from vj4.util import lrucache
 from vj4.util import misc
+from vj4.util import options
 from vj4.util import rank
 from vj4.util import validator
 
+options.define('contest_cache_max_entries', default=256,
+               help='Maximum number of contest documents cached per process.')
+options.define('contest_cache_ttl_seconds', default=60,
+               help='Time to live of cached contest documents, in seconds.')
+options.define('contest_export_prefetch', default=8,
+               help='Maximum number of code files read concurrently when exporting records.')
+options.define('contest_prewarm_seconds', default=600,
+               help='Time before a contest begins to load it into the caches of all processes, in '
+                    'seconds. 0 to disable.')
+options.define('contest_prewarm_poll_seconds', default=60,
+               help='Interval of polling for contests to pre-warm, in seconds.')
+options.define('contest_prewarm_pin_seconds', default=3600,
+               help='Time after a pre-warmed contest begins to keep it pinned in memory, in seconds.')
+options.define('contest_journal_max_entries', default=256,
+               help='Length of the journal of a contest status document beyond which its older half is '
+                    'moved to the archive collection.')
+
 journal_key_func = lambda j: j['rid']
 
+# Minimum number of journal entries to compute penalty coefficients with numpy, if available.
+NUMPY_MIN_SIZE = 256
+
+_logger = logging.getLogger(__name__)
+
+_cache = lrucache.LruCache(options.contest_cache_max_entries, options.contest_cache_ttl_seconds)
+# Uids known to have attended pre-warmed contests, keyed by (domain_id, tid).
+_members = lrucache.LruCache(options.contest_cache_max_entries)
+_prewarm_task = None
+
 Rule = collections.namedtuple('Rule', ['show_record_func',
                                        'show_scoreboard_func',
                                        'stat_func',
@@ -30,58 +71,110 @@ Rule = collections.namedtuple('Rule', ['show_record_func',
 
 
 def _oi_stat(tdoc, journal):
-    detail = list(dict((j['pid'], j) for j in journal if j['pid'] in tdoc['pids']).values())
+    pids = set(tdoc['pids'])
+    detail = list(dict((j['pid'], j) for j in journal if j['pid'] in pids).values())
     return {'score': sum(d['score'] for d in detail), 'detail': detail}
 
 
+def _oi_inc_stat(tdoc, tsdoc, latest, jdoc):
+    return _oi_stat(tdoc, latest)
+
+
+def _acm_time(tdoc, jdoc, naccept):
+    real = jdoc['rid'].generation_time.replace(tzinfo=None) - tdoc['begin_at']
+    penalty = datetime.timedelta(minutes=20) * naccept
+    return int((real + penalty).total_seconds())
+
+
+def _acm_summary(detail):
+    return {'accept': sum(int(d['accept']) for d in detail),
+            'time': sum(d['time'] for d in detail if d['accept']),
+            'detail': detail}
+
+
 def _acm_stat(tdoc, journal):
+    pids = set(tdoc['pids'])
     naccept = collections.defaultdict(int)
     effective = {}
     for j in journal:
-        if j['pid'] in tdoc['pids'] and not (j['pid'] in effective and effective[j['pid']]['accept']):
+        if j['pid'] in pids and not (j['pid'] in effective and effective[j['pid']]['accept']):
             effective[j['pid']] = j
             if not j['accept']:
                 naccept[j['pid']] += 1
 
-    def time(jdoc):
-        real = jdoc['rid'].generation_time.replace(tzinfo=None) - tdoc['begin_at']
-        penalty = datetime.timedelta(minutes=20) * naccept[jdoc['pid']]
-        return int((real + penalty).total_seconds())
-
-    detail = [{**j, 'naccept': naccept[j['pid']], 'time': time(j)} for j in effective.values()]
-    return {'accept': sum(int(d['accept']) for d in detail),
-            'time': sum(d['time'] for d in detail if d['accept']),
-            'detail': detail}
+    detail = [{**j, 'naccept': naccept[j['pid']], 'time': _acm_time(tdoc, j, naccept[j['pid']])}
+              for j in effective.values()]
+    return _acm_summary(detail)
+
+
+def _acm_inc_stat(tdoc, tsdoc, latest, jdoc):
+    detail = list(tsdoc.get('detail', []))
+    if jdoc['pid'] not in tdoc['pids']:
+        return _acm_summary(detail)
+    index = next((i for i, d in enumerate(detail) if d['pid'] == jdoc['pid']), None)
+    if index is None:
+        naccept = 0 if jdoc['accept'] else 1
+        detail.append({**jdoc, 'naccept': naccept, 'time': _acm_time(tdoc, jdoc, naccept)})
+    elif jdoc['rid'] <= detail[index]['rid']:
+        # A rejudged or out of order record may change the effective one, which needs the journal.
+        return None
+    elif not detail[index]['accept']:
+        naccept = detail[index]['naccept'] + (0 if jdoc['accept'] else 1)
+        detail[index] = {**jdoc, 'naccept': naccept, 'time': _acm_time(tdoc, jdoc, naccept)}
+    return _acm_summary(detail)
+
+
+def _penalty_coefficients(tdoc, exceed_seconds):
+    """Returns the coefficient of each exceed seconds, which is the one of the first rule whose time
+    is not less than it, or 1 when it is beyond all rules."""
+    rules = sorted(tdoc['penalty_rules'].items(), key=lambda x: int(x[0]))
+    times = [int(p_time) for p_time, _ in rules]
+    coefficients = [p_coefficient for _, p_coefficient in rules]
+    if numpy and len(exceed_seconds) >= NUMPY_MIN_SIZE:
+        indices = numpy.searchsorted(times, exceed_seconds, side='left').tolist()
+    else:
+        indices = [bisect.bisect_left(times, seconds) for seconds in exceed_seconds]
+    return [coefficients[i] if i < len(times) else 1 for i in indices]
+
+
+def _assignment_stat_multi(tdoc, journals):
+    pids = set(tdoc['pids'])
+    details = []
+    for journal in journals:
+        effective = {}
+        for j in journal:
+            # if j['pid'] in tdoc['pids'] and not (j['pid'] in effective and effective[j['pid']]['accept']):
+            if j['pid'] in pids:
+                effective[j['pid']] = j
+        details.append(list(effective.values()))
+
+    # Penalty coefficients of all participants are computed at once.
+    submit_times = [j['submit_time'].replace(tzinfo=None) for detail in details for j in detail]
+    exceed_seconds = [(t - tdoc['penalty_since']).total_seconds() for t in submit_times]
+    coefficients = iter(_penalty_coefficients(tdoc, exceed_seconds))
+    exceed_seconds = iter(exceed_seconds)
+    submit_times = iter(submit_times)
+    stats = []
+    for detail in details:
+        new_detail = []
+        for j in detail:
+            coefficient = next(coefficients)
+            penalty_score = j['score'] if next(exceed_seconds) < 0 else j['score'] * coefficient
+            time = int((next(submit_times) - tdoc['begin_at']).total_seconds())
+            new_detail.append({**j, 'penalty_score': penalty_score, 'time': time})
+        stats.append({'score': sum(d['score'] for d in new_detail),
+                      'penalty_score': sum(d['penalty_score'] for d in new_detail),
+                      'time': sum(d['time'] for d in new_detail),
+                      'detail': new_detail})
+    return stats
 
 
 def _assignment_stat(tdoc, journal):
-    effective = {}
-    for j in journal:
-        # if j['pid'] in tdoc['pids'] and not (j['pid'] in effective and effective[j['pid']]['accept']):
-        if j['pid'] in tdoc['pids']:
-            effective[j['pid']] = j
+    return _assignment_stat_multi(tdoc, [journal])[0]
 
-    def time(jdoc):
-        real = jdoc['submit_time'].replace(tzinfo=None) - tdoc['begin_at']
-        return int(real.total_seconds())
-
-    def penalty_score(jdoc):
-        score = jdoc['score']
-        exceed_seconds = (jdoc['submit_time'].replace(tzinfo=None) - tdoc['penalty_since']).total_seconds()
-        if exceed_seconds < 0:
-            return score
-        coefficient = 1
-        for p_time, p_coefficient in sorted(tdoc['penalty_rules'].items(), key=lambda x: int(x[0])):
-            if exceed_seconds <= int(p_time):
-                coefficient = p_coefficient
-                break
-        return score * coefficient
-
-    detail = [{**j, 'penalty_score': penalty_score(j), 'time': time(j)} for j in effective.values()]
-    return {'score': sum(d['score'] for d in detail),
-            'penalty_score': sum(d['penalty_score'] for d in detail),
-            'time': sum(d['time'] for d in detail),
-            'detail': detail}
+
+def _assignment_inc_stat(tdoc, tsdoc, latest, jdoc):
+    return _assignment_stat(tdoc, latest)
 
 
 def _oi_equ_func(a, b):
@@ -280,6 +373,34 @@ RULES = {
 }
 
 
+# Functions updating the stats from the previous stats and the latest journal entry of each problem
+# after a journal entry is added, which return None if the full journal is needed.
+INC_STAT_FUNCS = {
+    constant.contest.RULE_OI: _oi_inc_stat,
+    constant.contest.RULE_ACM: _acm_inc_stat,
+    constant.contest.RULE_ASSIGNMENT: _assignment_inc_stat,
+}
+
+
+def _gradebook_key(tdoc):
+    # The gradebook keeps the primary ranking key of the rule.
+    return RULES[tdoc['rule']].status_sort[0][0]
+
+
+async def _update_gradebook(domain_id, tdoc, uid, old_tsdoc, new_tsdoc):
+    key = _gradebook_key(tdoc)
+    if tdoc['doc_type'] == document.TYPE_HOMEWORK and old_tsdoc.get(key) != new_tsdoc.get(key):
+        await gradebook.set(domain_id, tdoc['doc_type'], uid, tdoc['doc_id'], new_tsdoc.get(key, 0))
+
+
+def _stat_multi(tdoc, journals):
+    """Computes the stats of many participants of a contest in one pass."""
+    stat_func = RULES[tdoc['rule']].stat_func
+    if stat_func is _assignment_stat:
+        return _assignment_stat_multi(tdoc, journals)
+    return [stat_func(tdoc, journal) for journal in journals]
+
+
 @argmethod.wrap
 async def add(domain_id: str, doc_type: int,
               title: str, content: str, owner_uid: int, rule: int,
@@ -305,19 +426,151 @@ async def add(domain_id: str, doc_type: int,
             raise error.ValidationError('penalty_since', 'begin_at')
         if kwargs['penalty_since'] > end_at:
             raise error.ValidationError('penalty_since', 'end_at')
+    if doc_type == document.TYPE_HOMEWORK:
+        # The gradebook is kept along with the status documents from the beginning.
+        kwargs['gradebook_built'] = True
     # TODO(twd2): should we check problem existance here?
-    return await document.add(domain_id, content, owner_uid, doc_type,
-                              title=title, rule=rule,
-                              begin_at=begin_at, end_at=end_at, pids=pids, attend=0,
-                              **kwargs)
+    tid = await document.add(domain_id, content, owner_uid, doc_type,
+                             title=title, rule=rule,
+                             begin_at=begin_at, end_at=end_at, pids=pids, attend=0,
+                             **kwargs)
+    await pagecache.invalidate(domain_id, 'contest')
+    return tid
+
+
+def _doc_type_matches(tdoc, doc_type):
+    if isinstance(doc_type, dict):
+        return tdoc['doc_type'] in doc_type['$in']
+    return tdoc['doc_type'] == doc_type
 
 
 @argmethod.wrap
-async def get(domain_id: str, doc_type: int, tid: objectid.ObjectId):
+async def get(domain_id: str, doc_type: int, tid: objectid.ObjectId, *, idmap=None):
+    if idmap is not None:
+        tdoc = await idmap.get(('contest', domain_id, tid), functools.partial(get, domain_id, doc_type, tid))
+        if not _doc_type_matches(tdoc, doc_type):
+            raise error.DocumentNotFoundError(domain_id, doc_type, tid)
+        return tdoc
+    tdoc = _cache.get((domain_id, tid))
+    if tdoc and _doc_type_matches(tdoc, doc_type):
+        return dict(tdoc)
     tdoc = await document.get(domain_id, doc_type, tid)
     if not tdoc:
         raise error.DocumentNotFoundError(domain_id, doc_type, tid)
-    return tdoc
+    _cache.set((domain_id, tid), tdoc)
+    return dict(tdoc)
+
+
+def get_cache_stats():
+    return _cache.stats()
+
+
+async def _on_contest_change(e):
+    _cache.pop((e['value']['domain_id'], e['value']['tid']))
+
+
+def init():
+    global _prewarm_task
+    bus.subscribe(_on_contest_change, ['contest_change'])
+    bus.subscribe(_on_contest_prewarm, ['contest_prewarm'])
+    if options.contest_prewarm_seconds > 0:
+        _prewarm_task = asyncio.get_event_loop().create_task(_prewarm_worker())
+
+
+def uninit():
+    global _prewarm_task
+    bus.unsubscribe(_on_contest_change)
+    bus.unsubscribe(_on_contest_prewarm)
+    if _prewarm_task:
+        _prewarm_task.cancel()
+        _prewarm_task = None
+    _cache.clear()
+    _members.clear()
+
+
+def _pin_ttl(tdoc):
+    pin_until = min(tdoc['end_at'],
+                    tdoc['begin_at'] + datetime.timedelta(seconds=options.contest_prewarm_pin_seconds))
+    return (pin_until - datetime.datetime.utcnow()).total_seconds()
+
+
+async def _prewarm_local(domain_id, doc_type, tid):
+    """Load the contest, its problems with rendered content and its participants into the caches
+    of this process, pinned until options.contest_prewarm_pin_seconds after it begins."""
+    tdoc = await document.get(domain_id, doc_type, tid)
+    if not tdoc:
+        return
+    ttl = _pin_ttl(tdoc)
+    if ttl <= 0:
+        return
+    pdocs = await problem.get_dict(domain_id, tdoc['pids'])
+    uids = set()
+    async for tsdoc in get_multi_status(domain_id=domain_id, doc_type=doc_type, doc_id=tid,
+                                        attend=1, fields={'uid': 1}):
+        uids.add(tsdoc['uid'])
+    _cache.set((domain_id, tid), tdoc, ttl)
+    misc.pin_markdown(tdoc['content'], ttl)
+    for pdoc in pdocs.values():
+        problem.pin(pdoc, ttl)
+        misc.pin_markdown(pdoc['content'], ttl)
+    _members.set((domain_id, tid), uids, ttl)
+    _logger.info('Pre-warmed %s/%s: %d problems, %d participants, pinned for %d seconds',
+                 domain_id, tid, len(pdocs), len(uids), ttl)
+
+
+async def _on_contest_prewarm(e):
+    await _prewarm_local(e['value']['domain_id'], e['value']['doc_type'], e['value']['tid'])
+
+
+@argmethod.wrap
+async def prewarm(domain_id: str, doc_type: int, tid: objectid.ObjectId):
+    """Pre-warm a contest in all processes now."""
+    await bus.publish('contest_prewarm', {'domain_id': domain_id, 'doc_type': doc_type, 'tid': tid})
+
+
+async def _prewarm_upcoming():
+    now = datetime.datetime.utcnow()
+    tdocs = document.get_multi(doc_type={'$in': [document.TYPE_CONTEST, document.TYPE_HOMEWORK]},
+                               begin_at={'$gt': now,
+                                         '$lte': now + datetime.timedelta(
+                                             seconds=options.contest_prewarm_seconds)},
+                               fields={'domain_id': 1, 'doc_type': 1, 'doc_id': 1, 'begin_at': 1,
+                                       'prewarm_at': 1})
+    async for tdoc in tdocs:
+        if tdoc.get('prewarm_at') == tdoc['begin_at']:
+            continue
+        # Every process polls, the one which marks the contest first publishes it to all.
+        if await document.set_if_not(tdoc['domain_id'], tdoc['doc_type'], tdoc['doc_id'],
+                                     'prewarm_at', tdoc['begin_at'], tdoc['begin_at']):
+            await prewarm(tdoc['domain_id'], tdoc['doc_type'], tdoc['doc_id'])
+
+
+async def _prewarm_worker():
+    while True:
+        try:
+            await _prewarm_upcoming()
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            _logger.exception('Failed to pre-warm upcoming contests')
+        await asyncio.sleep(options.contest_prewarm_poll_seconds)
+
+
+async def _invalidate(domain_id, tid):
+    _cache.pop((domain_id, tid))
+    await bus.publish('contest_change', {'domain_id': domain_id, 'tid': tid})
+    await _invalidate_scoreboard(domain_id, tid)
+
+
+def scoreboard_fragment_name(tid):
+    """Name of the rendered scoreboard table of a contest in the fragment cache."""
+    return 'contest_scoreboard/{0}'.format(tid)
+
+
+async def _invalidate_scoreboard(domain_id, tid):
+    # Judged submissions do not invalidate the scoreboard, or it would hardly ever be hit during a
+    # contest. They show up once the cached table expires.
+    await fragmentcache.invalidate(scoreboard_fragment_name(tid), domain_id)
 
 
 async def edit(domain_id: str, doc_type: int, tid: objectid.ObjectId, **kwargs):
@@ -345,11 +598,22 @@ async def edit(domain_id: str, doc_type: int, tid: objectid.ObjectId, **kwargs):
     if 'limit_rate' in kwargs:
         if kwargs['limit_rate'] < 0:
             raise error.ValidationError('limit_rate')
-    return await document.set(domain_id, doc_type, tid, **kwargs)
+    tdoc = await document.set(domain_id, doc_type, tid, **kwargs)
+    await _invalidate(domain_id, tid)
+    return tdoc
 
 
 async def update_moss_result(domain_id: str, doc_type: int, tid: objectid.ObjectId, moss_url: str):
-    return await document.set(domain_id, doc_type, tid, moss_url=moss_url)
+    tdoc = await document.set(domain_id, doc_type, tid, moss_url=moss_url)
+    await _invalidate(domain_id, tid)
+    return tdoc
+
+
+async def update_similarity_result(domain_id: str, doc_type: int, tid: objectid.ObjectId, result: list):
+    tdoc = await document.set(domain_id, doc_type, tid, similarity_result=result,
+                              similarity_at=datetime.datetime.utcnow())
+    await _invalidate(domain_id, tid)
+    return tdoc
 
 
 def get_multi(domain_id: str, doc_type: int, fields=None, **kwargs):
@@ -374,7 +638,28 @@ async def attend(domain_id: str, doc_type: int, tid: objectid.ObjectId, uid: int
             raise error.HomeworkAlreadyAttendedError(domain_id, tid, uid) from None
         else:
             raise error.InvalidArgumentError('doc_type')
-    return await document.inc(domain_id, doc_type, tid, 'attend', 1)
+    tdoc = await document.inc(domain_id, doc_type, tid, 'attend', 1)
+    # Only the attend counter changed, other processes may show a stale count until the TTL expires.
+    members = _members.get((domain_id, tid), count=False)
+    if members is not None:
+        members.add(uid)
+        _cache.set((domain_id, tid), tdoc, _pin_ttl(tdoc))
+    else:
+        _cache.set((domain_id, tid), tdoc)
+    await _invalidate_scoreboard(domain_id, tid)
+    return tdoc
+
+
+async def is_attended(domain_id: str, doc_type: int, tid: objectid.ObjectId, uid: int):
+    """Check attendance from memory for pre-warmed contests, falling back to the status document."""
+    members = _members.get((domain_id, tid))
+    if members is not None and uid in members:
+        return True
+    tsdoc = await get_status(domain_id, doc_type, tid, uid, fields={'attend': 1})
+    attended = bool(tsdoc) and tsdoc.get('attend') == 1
+    if attended and members is not None:
+        members.add(uid)
+    return attended
 
 
 @argmethod.wrap
@@ -399,20 +684,22 @@ async def get_dict_status(domain_id, uid, tids, *, fields=None):
 
 @argmethod.wrap
 async def get_and_list_status(domain_id: str, doc_type: int, tid: objectid.ObjectId,
-                              fields=None, is_export: bool = False):
+                              fields=None, is_export: bool = False, stale_ok: bool = False):
     # TODO(iceboy): projection, pagination.
     tdoc = await get(domain_id, doc_type, tid)
     if is_export:
         tsdocs = await document.aggregate_contest_detail(domain_id=domain_id,
                                                          doc_type=doc_type,
                                                          doc_id=tdoc['doc_id'],
-                                                         sort=RULES[tdoc['rule']].status_sort)
+                                                         sort=RULES[tdoc['rule']].status_sort,
+                                                         stale_ok=stale_ok)
     # print(tsdocs)
     else:
         tsdocs = await document.get_multi_status(domain_id=domain_id,
                                                  doc_type=doc_type,
                                                  doc_id=tdoc['doc_id'],
-                                                 fields=fields) \
+                                                 fields=fields,
+                                                 stale_ok=stale_ok) \
             .sort(RULES[tdoc['rule']].status_sort) \
             .to_list()
     # print(tsdocs)
@@ -425,65 +712,226 @@ def _get_status_journal(tsdoc):
                                                       key=journal_key_func)]
 
 
-@argmethod.wrap
-async def update_status(domain_id: str, tid: objectid.ObjectId, uid: int, rid: objectid.ObjectId,
-                        pid: document.convert_doc_id, accept: bool, score: int):
-    """This method returns None when the modification has been superseded by a parallel operation."""
-    tdoc = await document.get(domain_id, {'$in': [document.TYPE_CONTEST, document.TYPE_HOMEWORK]}, tid)
-    rdoc = await record.get(rid)
+def _get_latest(journal):
+    # The latest journal entry of each problem, from a sorted and uniquified journal.
+    return list(dict((j['pid'], j) for j in journal).values())
+
+
+def _update_latest(latest, jdoc):
+    latest = list(latest)
+    for index, j in enumerate(latest):
+        if j['pid'] == jdoc['pid']:
+            if j['rid'] <= jdoc['rid']:
+                latest[index] = jdoc
+            return latest
+    latest.append(jdoc)
+    return latest
+
+
+async def get_status_journal(domain_id: str, doc_type: int, tid: objectid.ObjectId, tsdoc):
+    """Returns the full journal of a status document, including the archived entries.
+
+    The journal is sorted and uniquified by rid.
+    """
+    journal = []
+    if tsdoc.get('journal_archived'):
+        async for adoc in document.get_multi_status_journal_archive(domain_id=domain_id,
+                                                                   doc_type=doc_type,
+                                                                   doc_id=tid,
+                                                                   uid=tsdoc['uid'],
+                                                                   fields={'journal': 1}):
+            journal.extend(adoc['journal'])
+    return _get_status_journal({'journal': [*journal, *tsdoc.get('journal', [])]})
+
+
+async def _compact_journal(domain_id, doc_type, tid, uid):
+    """Moves the older half of the journal of a status document to the archive collection.
+
+    Entries archived by an update which is then superseded are uniquified when read.
+    """
+    tsdoc = await document.get_status(domain_id, doc_type, tid, uid,
+                                      fields={'rev': 1, 'journal': 1, 'journal_archived': 1})
+    journal = _get_status_journal(tsdoc)
+    num_archive = len(journal) - options.contest_journal_max_entries // 2
+    if num_archive <= 0:
+        return
+    await document.add_status_journal_archive(domain_id, doc_type, tid, uid, journal[:num_archive])
+    await document.rev_set_status(domain_id, doc_type, tid, uid, tsdoc['rev'], return_doc=False,
+                                  journal=journal[num_archive:],
+                                  journal_size=len(journal) - num_archive,
+                                  journal_archived=tsdoc.get('journal_archived', 0) + num_archive)
+
+
+def _raise_not_attended(domain_id, doc_type, tid, uid):
+    if doc_type == document.TYPE_CONTEST:
+        raise error.ContestNotAttendedError(domain_id, tid, uid)
+    elif doc_type == document.TYPE_HOMEWORK:
+        raise error.HomeworkNotAttendedError(domain_id, tid, uid)
+    else:
+        raise error.InvalidArgumentError('doc_type')
+
+
+def _make_journal_entry(rdoc, pid, accept, score):
+    submit_time = rdoc.get('submit_time') or rdoc['_id'].generation_time
+    return {'rid': rdoc['_id'], 'pid': pid, 'accept': accept, 'score': score, 'submit_time': submit_time}
+
+
+async def _rev_update_status(domain_id, tdoc, uid, jdoc):
     doc_type = tdoc['doc_type']
-    submit_time = rdoc.get('submit_time') or rid.generation_time
-    tsdoc = await document.rev_push_status(
-        domain_id, doc_type, tdoc['doc_id'], uid,
-        'journal', {'rid': rid, 'pid': pid, 'accept': accept, 'score': score, 'submit_time': submit_time})
+    tsdoc = await document.rev_push_status(domain_id, doc_type, tdoc['doc_id'], uid, 'journal', jdoc)
     if 'attend' not in tsdoc or not tsdoc['attend']:
-        if doc_type == document.TYPE_CONTEST:
-            raise error.ContestNotAttendedError(domain_id, tid, uid)
-        elif doc_type == document.TYPE_HOMEWORK:
-            raise error.HomeworkNotAttendedError(domain_id, tid, uid)
-        else:
-            raise error.InvalidArgumentError('doc_type')
+        _raise_not_attended(domain_id, doc_type, tdoc['doc_id'], uid)
 
     journal = _get_status_journal(tsdoc)
-    stats = RULES[tdoc['rule']].stat_func(tdoc, journal)
-    tsdoc = await document.rev_set_status(domain_id, doc_type, tid, uid, tsdoc['rev'],
-                                          journal=journal, **stats)
+    full_journal = await get_status_journal(domain_id, doc_type, tdoc['doc_id'], tsdoc)
+    stats = RULES[tdoc['rule']].stat_func(tdoc, full_journal)
+    old_tsdoc = tsdoc
+    tsdoc = await document.rev_set_status(domain_id, doc_type, tdoc['doc_id'], uid, tsdoc['rev'],
+                                          journal=journal, journal_size=len(journal),
+                                          latest=_get_latest(full_journal), **stats)
+    if tsdoc:
+        await _update_gradebook(domain_id, tdoc, uid, old_tsdoc, tsdoc)
+        if len(journal) > options.contest_journal_max_entries:
+            await _compact_journal(domain_id, doc_type, tdoc['doc_id'], uid)
     return tsdoc
 
 
+@argmethod.wrap
+async def update_status(domain_id: str, tid: objectid.ObjectId, uid: int, rid: objectid.ObjectId,
+                        pid: document.convert_doc_id, accept: bool, score: int, *, idmap=None):
+    """This method returns None when the modification has been superseded by a parallel operation."""
+    if idmap is not None:
+        tdoc = await get(domain_id, {'$in': [document.TYPE_CONTEST, document.TYPE_HOMEWORK]}, tid,
+                         idmap=idmap)
+    else:
+        tdoc = await document.get(domain_id, {'$in': [document.TYPE_CONTEST, document.TYPE_HOMEWORK]}, tid)
+    rdoc = await record.get(rid, idmap=idmap)
+    return await _rev_update_status(domain_id, tdoc, uid, _make_journal_entry(rdoc, pid, accept, score))
+
+
+async def update_status_fast(domain_id: str, rdoc, accept: bool, score: int, tdoc=None):
+    """Hot path of update_status for a judged record which has been loaded by the caller.
+
+    The stats are updated from the latest journal entry of each problem kept in the status document,
+    so neither the journal is read nor rewritten. The journal entry is pushed along with the stats in
+    one update conditioned on the revision of the status document. The rev based push-then-set path
+    is only taken on conflict, or when the stats cannot be updated incrementally.
+
+    The returned status document does not include the journal.
+    """
+    if not tdoc:
+        tdoc = await get(domain_id, {'$in': [document.TYPE_CONTEST, document.TYPE_HOMEWORK]}, rdoc['tid'])
+    uid = rdoc['uid']
+    doc_type = tdoc['doc_type']
+    jdoc = _make_journal_entry(rdoc, rdoc['pid'], accept, score)
+    tsdoc = await document.get_status(domain_id, doc_type, tdoc['doc_id'], uid, fields={'journal': 0})
+    if not tsdoc or not tsdoc.get('attend'):
+        _raise_not_attended(domain_id, doc_type, tdoc['doc_id'], uid)
+    # A status document which has only been attended has no rev, which matches None.
+    if 'latest' not in tsdoc and tsdoc.get('rev') is not None:
+        # Journal written before the latest entries were kept.
+        return await _rev_update_status(domain_id, tdoc, uid, jdoc)
+    inc_stat_func = INC_STAT_FUNCS.get(tdoc['rule'])
+    latest = _update_latest(tsdoc.get('latest', []), jdoc)
+    stats = inc_stat_func(tdoc, tsdoc, latest, jdoc) if inc_stat_func else None
+    if stats is None:
+        return await _rev_update_status(domain_id, tdoc, uid, jdoc)
+    journal_size = tsdoc.get('journal_size', 0) + 1
+    new_tsdoc = await document.rev_push_set_status(domain_id, doc_type, tdoc['doc_id'], uid,
+                                                   tsdoc.get('rev'), 'journal', jdoc, fields={'journal': 0},
+                                                   journal_size=journal_size, latest=latest, **stats)
+    if not new_tsdoc:
+        return await _rev_update_status(domain_id, tdoc, uid, jdoc)
+    await _update_gradebook(domain_id, tdoc, uid, tsdoc, new_tsdoc)
+    if journal_size > options.contest_journal_max_entries:
+        await _compact_journal(domain_id, doc_type, tdoc['doc_id'], uid)
+    return new_tsdoc
+
+
 @argmethod.wrap
 async def recalc_status(domain_id: str, doc_type: int, tid: objectid.ObjectId):
+    await _invalidate(domain_id, tid)
     tdoc = await document.get(domain_id, doc_type, tid)
-    async with document.get_multi_status(domain_id=domain_id,
-                                         doc_type=doc_type,
-                                         doc_id=tdoc['doc_id']) as tsdocs:
-        async for tsdoc in tsdocs:
-            if 'journal' not in tsdoc or not tsdoc['journal']:
-                continue
-            journal = _get_status_journal(tsdoc)
-            stats = RULES[tdoc['rule']].stat_func(tdoc, journal)
-            await document.rev_set_status(domain_id, doc_type, tid, tsdoc['uid'], tsdoc['rev'],
-                                          return_doc=False, journal=journal, **stats)
+    tsdocs = await document.get_multi_status(domain_id=domain_id,
+                                             doc_type=doc_type,
+                                             doc_id=tdoc['doc_id'],
+                                             **{'$or': [{'journal.0': {'$exists': True}},
+                                                        {'journal_archived': {'$gt': 0}}]},
+                                             fields={'uid': 1, 'rev': 1, 'journal': 1,
+                                                     'journal_archived': 1}).to_list()
+    archived = collections.defaultdict(list)
+    if any(tsdoc.get('journal_archived') for tsdoc in tsdocs):
+        async for adoc in document.get_multi_status_journal_archive(domain_id=domain_id,
+                                                                   doc_type=doc_type,
+                                                                   doc_id=tdoc['doc_id'],
+                                                                   fields={'uid': 1, 'journal': 1}):
+            archived[adoc['uid']].extend(adoc['journal'])
+    journals = [_get_status_journal({'journal': tsdoc.get('journal', [])}) for tsdoc in tsdocs]
+    full_journals = [_get_status_journal({'journal': [*archived[tsdoc['uid']], *journal]})
+                     for tsdoc, journal in zip(tsdocs, journals)]
+    stats = _stat_multi(tdoc, full_journals)
+    await document.rev_set_multi_status(domain_id, doc_type, tdoc['doc_id'],
+                                        [(tsdoc['uid'], tsdoc.get('rev'),
+                                          {'journal': journal, 'journal_size': len(journal),
+                                           'latest': _get_latest(full_journal), **stat})
+                                         for tsdoc, journal, full_journal, stat
+                                         in zip(tsdocs, journals, full_journals, stats)])
+    if doc_type == document.TYPE_HOMEWORK:
+        key = _gradebook_key(tdoc)
+        await gradebook.set_multi(domain_id, doc_type, tdoc['doc_id'],
+                                  {tsdoc['uid']: stat.get(key, 0) for tsdoc, stat in zip(tsdocs, stats)})
+    # Scoreboards rendered while the statuses were rewritten are stale.
+    await _invalidate_scoreboard(domain_id, tid)
+
+
+async def _rebuild_gradebook(domain_id, tdoc):
+    await gradebook.rebuild(domain_id, tdoc['doc_type'], tdoc['doc_id'], _gradebook_key(tdoc))
+    await document.set(domain_id, tdoc['doc_type'], tdoc['doc_id'], gradebook_built=True)
+
+
+@argmethod.wrap
+async def rebuild_gradebook(domain_id: str, doc_type: int = document.TYPE_HOMEWORK):
+    tdocs = await get_multi(domain_id, doc_type, fields={'doc_id': 1, 'doc_type': 1, 'rule': 1}).to_list()
+    for tdoc in tdocs:
+        await _rebuild_gradebook(domain_id, tdoc)
+
+
+async def get_gradebook(domain_id: str, doc_type: int = document.TYPE_HOMEWORK):
+    """Returns the contests in the order of begin time and a cursor of gradebook rows ordered by uid.
+
+    Each row has the score of each contest in scores, keyed by the string of tid.
+    """
+    tdocs = await get_multi(domain_id, doc_type, fields={'doc_id': 1, 'doc_type': 1, 'title': 1,
+                                                         'rule': 1, 'begin_at': 1,
+                                                         'gradebook_built': 1}).to_list()
+    for tdoc in tdocs:
+        # Homeworks created before the gradebook was kept, their rows are built once.
+        if not tdoc.get('gradebook_built'):
+            await _rebuild_gradebook(domain_id, tdoc)
+    tdocs.sort(key=lambda tdoc: (tdoc['begin_at'], tdoc['doc_id']))
+    return tdocs, gradebook.get_multi(domain_id, doc_type, fields={'uid': 1, 'scores': 1})
+
+
+async def _read_record_code(rdoc):
+    grid_out = await fs.get(rdoc['code'])
+    content_type = grid_out.content_type or 'application/octet-stream'
+    ext = mimetypes.guess_extension(content_type)
+    if not ext:
+        ext = ''
+    filename = str(rdoc['pid']) + '/' + str(rdoc['uid']) + ext
+    zip_info = ZipInfo(filename)
+    zip_info.external_attr = 0o666 << 16
+    zip_info.compress_type = ZIP_DEFLATED
+    return zip_info, await grid_out.read()
 
 
 async def export_records(rdocs: list):
-    bytes = BytesIO()
-    zip_file = ZipFile(bytes, 'w', ZIP_DEFLATED, False)
-    for rdoc in rdocs:
-        grid_out = await fs.get(rdoc['code'])
-        content_type = grid_out.content_type or 'application/octet-stream'
-        ext = mimetypes.guess_extension(content_type)
-        if not ext:
-            ext = ''
-        filename = str(rdoc['pid']) + '/' + str(rdoc['uid']) + ext
-        zip_info = ZipInfo(filename)
-        zip_info.external_attr = 0o666 << 16
-        zip_info.compress_type = ZIP_DEFLATED
-        zip_file.writestr(zip_info, await grid_out.read())
-    zip_file.close()
-    bytes.seek(0)
-    data = bytes.read()
-    return data
+    """Yields a (zip info, data) entry of the code of each record.
+
+    Code files are read from GridFS concurrently, at most options.contest_export_prefetch at a time.
+    """
+    async for entry in misc.prefetch(_read_record_code, rdocs, options.contest_export_prefetch):
+        yield entry
 
 
 if __name__ == '__main__':
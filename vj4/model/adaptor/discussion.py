@@ -7,6 +7,8 @@ from pymongo import errors
 from vj4 import error
 from vj4.model import builtin
 from vj4.model import document
+from vj4.service import fragmentcache
+from vj4.service import pagecache
 from vj4.service import smallcache
 from vj4.util import argmethod
 from vj4.util import validator
@@ -60,6 +62,8 @@ async def _update_nodes(domain_id, nodes):
     if not doc:
       raise error.InvalidStateError()
   await smallcache.unset_global(smallcache.PREFIX_DISCUSSION_NODES + domain_id)
+  await fragmentcache.invalidate('discussion_nodes', domain_id)
+  await pagecache.invalidate(domain_id, 'discussion')
 
 
 @argmethod.wrap
@@ -140,10 +144,12 @@ async def add(domain_id: str, node_or_dtuple: str, owner_uid: int, title: str, c
   vnode = await get_vnode(domain_id, node_or_dtuple)
   if not vnode:
       raise error.DiscussionNodeNotFoundError(domain_id, node_or_dtuple)
-  return await document.add(domain_id, content, owner_uid, document.TYPE_DISCUSSION,
-                            title=title, num_replies=0, views=0, **flags,
-                            update_at=datetime.datetime.utcnow(),
-                            parent_doc_type=vnode['doc_type'], parent_doc_id=vnode['doc_id'])
+  did = await document.add(domain_id, content, owner_uid, document.TYPE_DISCUSSION,
+                           title=title, num_replies=0, views=0, **flags,
+                           update_at=datetime.datetime.utcnow(),
+                           parent_doc_type=vnode['doc_type'], parent_doc_id=vnode['doc_id'])
+  await pagecache.invalidate(domain_id, 'discussion')
+  return did
 
 
 @argmethod.wrap
@@ -156,7 +162,9 @@ async def edit(domain_id: str, did: document.convert_doc_id, **kwargs):
       validator.check_title(kwargs['title'])
   if 'content' in kwargs:
       validator.check_content(kwargs['content'])
-  return await document.set(domain_id, document.TYPE_DISCUSSION, did, **kwargs)
+  ddoc = await document.set(domain_id, document.TYPE_DISCUSSION, did, **kwargs)
+  await pagecache.invalidate(domain_id, 'discussion')
+  return ddoc
 
 
 @argmethod.wrap
@@ -166,6 +174,7 @@ async def delete(domain_id: str, did: document.convert_doc_id):
   await document.delete_multi(domain_id, document.TYPE_DISCUSSION_REPLY,
                               parent_doc_type=document.TYPE_DISCUSSION,
                               parent_doc_id=did)
+  await pagecache.invalidate(domain_id, 'discussion')
 
 
 @argmethod.wrap
@@ -200,6 +209,7 @@ async def add_reply(domain_id: str, did: document.convert_doc_id, owner_uid: int
                  parent_doc_type=document.TYPE_DISCUSSION, parent_doc_id=did),
     document.inc_and_set(domain_id, document.TYPE_DISCUSSION, did,
                          'num_replies', 1, 'update_at', datetime.datetime.utcnow()))
+  await pagecache.invalidate(domain_id, 'discussion')
   return drdoc
 
 
@@ -215,6 +225,7 @@ async def get_reply(domain_id: str, drid: document.convert_doc_id, did=None):
 async def edit_reply(domain_id: str, drid: document.convert_doc_id, content: str):
   validator.check_content(content)
   drdoc = await document.set(domain_id, document.TYPE_DISCUSSION_REPLY, drid, content=content)
+  await pagecache.invalidate(domain_id, 'discussion')
   return drdoc
 
 
@@ -226,6 +237,7 @@ async def delete_reply(domain_id: str, drid: document.convert_doc_id):
   await document.delete(domain_id, document.TYPE_DISCUSSION_REPLY, drid)
   await document.inc(domain_id, drdoc['parent_doc_type'], drdoc['parent_doc_id'],
                      'num_replies', -1)
+  await pagecache.invalidate(domain_id, 'discussion')
   return drdoc
 
 
@@ -257,6 +269,7 @@ async def add_tail_reply(domain_id: str, drid: document.convert_doc_id,
                                    'reply', content, owner_uid)
   await document.set(domain_id, document.TYPE_DISCUSSION, drdoc['parent_doc_id'],
                      update_at=datetime.datetime.utcnow())
+  await pagecache.invalidate(domain_id, 'discussion')
   return drdoc, sid
 
 
@@ -266,15 +279,21 @@ def get_tail_reply(domain_id: str, drid: document.convert_doc_id, drrid: objecti
 
 
 @argmethod.wrap
-def edit_tail_reply(domain_id: str, drid: document.convert_doc_id, drrid: objectid.ObjectId,
-                    content: str):
-  return document.set_sub(domain_id, document.TYPE_DISCUSSION_REPLY, drid, 'reply', drrid,
-                          content=content)
+async def edit_tail_reply(domain_id: str, drid: document.convert_doc_id, drrid: objectid.ObjectId,
+                          content: str):
+  drdoc = await document.set_sub(domain_id, document.TYPE_DISCUSSION_REPLY, drid, 'reply', drrid,
+                                 content=content)
+  await pagecache.invalidate(domain_id, 'discussion')
+  return drdoc
 
 
 @argmethod.wrap
-def delete_tail_reply(domain_id: str, drid: document.convert_doc_id, drrid: objectid.ObjectId):
-  return document.delete_sub(domain_id, document.TYPE_DISCUSSION_REPLY, drid, 'reply', drrid)
+async def delete_tail_reply(domain_id: str, drid: document.convert_doc_id,
+                            drrid: objectid.ObjectId):
+  drdoc = await document.delete_sub(domain_id, document.TYPE_DISCUSSION_REPLY, drid, 'reply',
+                                    drrid)
+  await pagecache.invalidate(domain_id, 'discussion')
+  return drdoc
 
 
 async def get_dict_vnodes(domain_id, node_or_dtuples):
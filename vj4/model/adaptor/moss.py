@@ -1,19 +1,39 @@
 from bson import objectid
-from os import path, makedirs
+from concurrent.futures import ProcessPoolExecutor
+from os import path, getuid, makedirs, rename, scandir, symlink, utime
 from shutil import rmtree
-from tempfile import mkdtemp
+from tempfile import gettempdir, mkdtemp
 from mosspy import Moss
 from io import BytesIO
 
 import rarfile, tarfile, zipfile
 import asyncio
+import logging
+import stat
 
 from vj4 import constant
 from vj4 import db
 from vj4 import error
 from vj4.model import fs
+from vj4.util import misc
 from vj4.util import options
 
+options.define('moss_cache_dir', default='',
+               help='Directory of extracted submissions, keyed by md5. It can be cleaned at any time. '
+                    'It must be owned by this user and not accessible by others. Empty to use a '
+                    'private directory of this user in the temporary directory.')
+options.define('moss_cache_max_entries', default=4096,
+               help='Maximum number of extracted submissions kept, the least recently used ones are '
+                    'removed.')
+options.define('moss_extract_processes', default=2,
+               help='Number of processes extracting submission archives for MOSS.')
+options.define('moss_prefetch', default=8,
+               help='Maximum number of submissions read and extracted concurrently for MOSS.')
+
+_logger = logging.getLogger(__name__)
+_executor = None
+_cache_dir = None
+
 
 # @TODO(tc-imba) the extraction is not safe now.
 
@@ -50,6 +70,92 @@ EXTRACT_OPEN_FUNC = {
 }
 
 
+def _extract_to_cache(code_type, data, entry_dir, lang):
+    """Extract an archive into a directory of the cache. Runs in the extraction process pool."""
+    tmp_dir = mkdtemp(prefix='.tmp.', dir=path.dirname(entry_dir))
+    try:
+        EXTRACT_OPEN_FUNC[code_type](BytesIO(data), tmp_dir, lang)
+        try:
+            rename(tmp_dir, entry_dir)
+        except OSError:
+            # Extracted by a parallel run.
+            if not path.isdir(entry_dir):
+                raise
+    finally:
+        rmtree(tmp_dir, ignore_errors=True)
+
+
+def _get_cache_dir():
+    """Get the cache directory, which nobody else can read submissions from or plant them in."""
+    global _cache_dir
+    if not _cache_dir:
+        if options.moss_cache_dir:
+            _cache_dir = misc.make_private_dir(options.moss_cache_dir, stat.S_IRWXG | stat.S_IRWXO)
+        else:
+            try:
+                _cache_dir = misc.make_private_dir(
+                    path.join(gettempdir(), 'cb4.moss.cache-{0}'.format(getuid())),
+                    stat.S_IRWXG | stat.S_IRWXO)
+            except PermissionError as e:
+                # Taken by someone else, use a new directory of this process instead.
+                _logger.warning('%s, using a temporary directory', e)
+                _cache_dir = mkdtemp(prefix='cb4.moss.cache.')
+    return _cache_dir
+
+
+def _prune_cache(cache_dir, max_entries):
+    """Remove the least recently used entries over max_entries. Runs in the default executor."""
+    entries = []
+    for entry in scandir(cache_dir):
+        # Directories of running extractions are left alone.
+        if entry.is_dir(follow_symlinks=False) and not entry.name.startswith('.tmp.'):
+            entries.append((entry.stat(follow_symlinks=False).st_mtime, entry.path))
+    if len(entries) <= max_entries:
+        return
+    entries.sort(reverse=True)
+    for _, entry_dir in entries[max_entries:]:
+        rmtree(entry_dir, ignore_errors=True)
+
+
+def get_executor():
+    """Get the process pool extracting archives, also used for other CPU bound work on submissions."""
+    global _executor
+    if not _executor:
+        _executor = ProcessPoolExecutor(max_workers=options.moss_extract_processes)
+    return _executor
+
+
+async def _get_extracted_dir(rdoc, lang):
+    """Get the cache directory of the extracted files of a record, keyed by the md5 of its code."""
+    grid_out = await fs.get(rdoc['code'])
+    entry_dir = path.join(_get_cache_dir(), '{0}.{1}.{2}'.format(grid_out.md5, rdoc['code_type'], lang))
+    if not path.isdir(entry_dir):
+        data = await grid_out.read()
+        await asyncio.get_event_loop().run_in_executor(
+            get_executor(), _extract_to_cache, rdoc['code_type'], data, entry_dir, lang)
+    else:
+        # The modification time orders the entries for _prune_cache.
+        utime(entry_dir)
+    return entry_dir
+
+
+async def collect(rdocs: list, language: str):
+    """Yield (rdoc, directory of extracted files) of the records which can be extracted, in order."""
+    async def prepare(rdoc):
+        try:
+            return rdoc, await _get_extracted_dir(rdoc, language)
+        except Exception as e:
+            _logger.warning('Unable to extract record %s: %s', rdoc['_id'], repr(e))
+            return rdoc, None
+
+    await asyncio.get_event_loop().run_in_executor(
+        None, _prune_cache, _get_cache_dir(), options.moss_cache_max_entries)
+    rdocs = [rdoc for rdoc in rdocs if rdoc['code_type'] in EXTRACT_OPEN_FUNC]
+    async for rdoc, entry_dir in misc.prefetch(prepare, rdocs, options.moss_prefetch):
+        if entry_dir:
+            yield rdoc, entry_dir
+
+
 async def moss_test(rdocs: list, language: str, ignore_limit: int = 10, wildcards: list = None):
     # check the language is supported by moss
     if language not in constant.language.LANG_MOSS:
@@ -68,18 +174,15 @@ async def moss_test(rdocs: list, language: str, ignore_limit: int = 10, wildcard
         moss.setDirectoryMode(1)
         moss.setIgnoreLimit(ignore_limit)
 
-        for rdoc in rdocs:
-            if rdoc['code_type'] in EXTRACT_OPEN_FUNC:
-                try:
-                    grid_out = await fs.get(rdoc['code'])
-                    file_obj = BytesIO(await grid_out.read())
-                    dest_dir = path.join(moss_dir, str(rdoc['pid']), str(rdoc['uid']))
-                    makedirs(dest_dir, exist_ok=True)
-                    EXTRACT_OPEN_FUNC[rdoc['code_type']](file_obj, dest_dir, language)
-                    for wildcard in wildcards:
-                        moss.addFilesByWildcard(path.join(dest_dir, wildcard))
-                except Exception as e:
-                    print(e)
+        async for rdoc, entry_dir in collect(rdocs, language):
+            # Files in one directory are one submission in directory mode.
+            dest_dir = path.join(moss_dir, str(rdoc['pid']), str(rdoc['uid']))
+            if path.lexists(dest_dir):
+                continue
+            makedirs(path.dirname(dest_dir), exist_ok=True)
+            symlink(entry_dir, dest_dir)
+            for wildcard in wildcards:
+                moss.addFilesByWildcard(path.join(dest_dir, wildcard))
 
         url = await asyncio.get_event_loop().run_in_executor(None, moss.send)
         return url
@@ -1,5 +1,6 @@
 import collections
 import datetime
+import functools
 import itertools
 import random
 from bson import objectid
@@ -13,9 +14,17 @@ from vj4.model import document
 from vj4.model import domain
 from vj4.model import fs
 from vj4.service import bus
+from vj4.service import pagecache
 from vj4.util import argmethod
+from vj4.util import lrucache
+from vj4.util import options
 from vj4.util import validator
 
+options.define('problem_pin_max_entries', default=1024,
+               help='Maximum number of problem documents pinned per process for upcoming contests. '
+                    'The least recently used ones are evicted over it, so it should exceed the '
+                    'number of problems of contests beginning at the same time.')
+
 
 SETTING_DIFFICULTY_ALGORITHM = 0
 SETTING_DIFFICULTY_ADMIN = 1
@@ -27,6 +36,10 @@ SETTING_DIFFICULTY_RANGE = collections.OrderedDict([
   (SETTING_DIFFICULTY_AVERAGE, 'Use average of above')
 ])
 
+# Problem documents of upcoming contests, pinned until options.contest_prewarm_pin_seconds after
+# they begin.
+_pinned = lrucache.LruCache(options.problem_pin_max_entries)
+
 
 @argmethod.wrap
 def get_categories():
@@ -45,14 +58,22 @@ async def add(domain_id: str, title: str, content: str, owner_uid: int,
                            hidden=hidden, show_case_detail=show_case_detail,
                            num_submit=0, num_accept=0, languages=['cc'])
   await domain.inc_user(domain_id, owner_uid, num_problems=1)
+  await pagecache.invalidate(domain_id, 'problem')
   return pid
 
 
 @argmethod.wrap
-async def get(domain_id: str, pid: document.convert_doc_id, uid: int = None):
-  pdoc = await document.get(domain_id, document.TYPE_PROBLEM, pid)
-  if not pdoc:
-    raise error.ProblemNotFoundError(domain_id, pid)
+async def get(domain_id: str, pid: document.convert_doc_id, uid: int = None, *, idmap=None):
+  if idmap is not None:
+    pdoc = await idmap.get(('problem', domain_id, pid), functools.partial(get, domain_id, pid))
+  else:
+    pdoc = _pinned.get((domain_id, pid))
+    if pdoc:
+      pdoc = dict(pdoc)
+    else:
+      pdoc = await document.get(domain_id, document.TYPE_PROBLEM, pid)
+    if not pdoc:
+      raise error.ProblemNotFoundError(domain_id, pid)
   # TODO(twd2): move out:
   if uid is not None:
     pdoc['psdoc'] = await document.get_status(domain_id, document.TYPE_PROBLEM,
@@ -71,9 +92,45 @@ async def edit(domain_id: str, pid: document.convert_doc_id, **kwargs):
   pdoc = await document.set(domain_id, document.TYPE_PROBLEM, pid, **kwargs)
   if not pdoc:
     raise error.DocumentNotFoundError(domain_id, document.TYPE_PROBLEM, pid)
+  await _invalidate(domain_id, pid)
   return pdoc
 
 
+def pin(pdoc, ttl_seconds):
+  """Serve a problem document from memory in this process for ttl_seconds, or until it changes.
+
+  Edits drop the pinned document in all processes, but counters such as num_submit and num_accept do
+  not, they change with every judged submission. inc updates them in the pinned document of this
+  process only, so other processes serve them stale until the pin expires.
+
+  Pinned documents are kept in a bounded LRU cache of options.problem_pin_max_entries, they may still
+  be evicted when more problems are pinned at the same time.
+  """
+  _pinned.set((pdoc['domain_id'], pdoc['doc_id']), pdoc, ttl_seconds)
+
+
+def get_pin_stats():
+  return _pinned.stats()
+
+
+async def _on_problem_change(e):
+  _pinned.pop((e['value']['domain_id'], e['value']['pid']))
+
+
+def init():
+  bus.subscribe(_on_problem_change, ['problem_change', 'problem_data_change'])
+
+
+def uninit():
+  bus.unsubscribe(_on_problem_change)
+  _pinned.clear()
+
+
+async def _invalidate(domain_id, pid):
+  _pinned.pop((domain_id, pid))
+  await bus.publish('problem_change', {'domain_id': domain_id, 'pid': pid})
+
+
 @argmethod.wrap
 async def count(domain_id: str, **kwargs):
   return await document.get_multi(domain_id=domain_id, doc_type=document.TYPE_PROBLEM,
@@ -95,8 +152,17 @@ async def get_random_id(domain_id: str, **kwargs):
 
 async def get_dict(domain_id, pids, *, fields=None, **kwargs):
   result = dict()
+  pids = set(pids)
+  if fields is None and not kwargs:
+    for pid in pids:
+      pdoc = _pinned.get((domain_id, pid))
+      if pdoc:
+        result[pid] = dict(pdoc)
+    pids.difference_update(result)
+    if not pids:
+      return result
   async for pdoc in get_multi(domain_id=domain_id,
-                              doc_id={'$in': list(set(pids))},
+                              doc_id={'$in': list(pids)},
                               fields=fields, **kwargs):
     result[pdoc['doc_id']] = pdoc
   return result
@@ -276,6 +342,7 @@ async def set_data(domain_id: str, pid: document.convert_doc_id, data: objectid.
   pdoc = await document.set(domain_id, document.TYPE_PROBLEM, pid, data=data)
   if not pdoc:
     raise error.DocumentNotFoundError(domain_id, document.TYPE_PROBLEM, pid)
+  _pinned.pop((domain_id, pid))
   await bus.publish('problem_data_change', {'domain_id': domain_id, 'pid': pid})
   return pdoc
 
@@ -285,6 +352,7 @@ async def set_hidden(domain_id: str, pid: document.convert_doc_id, hidden: bool)
   pdoc = await document.set(domain_id, document.TYPE_PROBLEM, pid, hidden=hidden)
   if not pdoc:
     raise error.DocumentNotFoundError(domain_id, document.TYPE_PROBLEM, pid)
+  await _invalidate(domain_id, pid)
   return pdoc
 
 
@@ -308,7 +376,12 @@ async def get_data_list(last: int):
 
 @argmethod.wrap
 async def inc(domain_id: str, pid: document.convert_doc_id, key: str, value: int):
-  return await document.inc(domain_id, document.TYPE_PROBLEM, pid, key, value)
+  pdoc = await document.inc(domain_id, document.TYPE_PROBLEM, pid, key, value)
+  # Not invalidated, which would unpin the problems of a running contest on every submission.
+  pinned_pdoc = _pinned.get((domain_id, pid), count=False)
+  if pdoc and pinned_pdoc:
+    pinned_pdoc[key] = pdoc[key]
+  return pdoc
 
 
 @argmethod.wrap
@@ -0,0 +1,82 @@
+import asyncio
+import collections
+import glob
+import logging
+from os import path
+
+from vj4 import constant
+from vj4 import error
+from vj4.model import fingerprint
+from vj4.model.adaptor import moss
+from vj4.util import winnow
+
+_logger = logging.getLogger(__name__)
+
+DEFAULT_LIMIT = 100
+
+
+def _fingerprint_files(entry_dir, wildcards, lang, k, window):
+    """Fingerprint the files of an extracted submission. Runs in the extraction process pool."""
+    file_names = sorted({file_name for wildcard in wildcards
+                         for file_name in glob.glob(path.join(entry_dir, wildcard))})
+    texts = []
+    for file_name in file_names:
+        with open(file_name, 'rb') as file:
+            texts.append(file.read().decode(errors='replace'))
+    return winnow.fingerprint('\n'.join(texts), lang, k, window)
+
+
+async def similarity_test(rdocs: list, language: str, ignore_limit: int = 10, wildcards: list = None,
+                          min_similarity: float = 0.0, limit: int = DEFAULT_LIMIT):
+    """Find similar submissions of each problem locally, as an alternative to MOSS.
+
+    Fingerprints are stored per record, so only records not seen before are read and fingerprinted.
+    Returns a list of pairs ordered by similarity, most similar first.
+    """
+    if language not in constant.language.LANG_MOSS:
+        raise error.LanguageNotSupportedError(language)
+
+    ignore_limit = int(ignore_limit)
+    if ignore_limit < 2:
+        raise error.InvalidArgumentError('ignore_limit')
+
+    if wildcards is None or len(wildcards) == 0:
+        wildcards = constant.language.LANG_MOSS_WILDCARDS.get(language, [])
+
+    # Keep the first record of each user for each problem, as in moss_test.
+    latest = collections.OrderedDict()
+    for rdoc in rdocs:
+        latest.setdefault((rdoc['pid'], rdoc['uid']), rdoc)
+    rdocs = list(latest.values())
+
+    params = (language, wildcards, winnow.DEFAULT_K, winnow.DEFAULT_WINDOW)
+    fingerprints = await fingerprint.get_dict([rdoc['_id'] for rdoc in rdocs], *params)
+    new_fingerprints = dict()
+    loop = asyncio.get_event_loop()
+    async for rdoc, entry_dir in moss.collect([rdoc for rdoc in rdocs if rdoc['_id'] not in fingerprints],
+                                              language):
+        new_fingerprints[rdoc['_id']] = await loop.run_in_executor(
+            moss.get_executor(), _fingerprint_files, entry_dir, wildcards, *params)
+    await fingerprint.set_multi(new_fingerprints, *params)
+    fingerprints.update(new_fingerprints)
+    _logger.info('Fingerprinted %d new of %d records', len(new_fingerprints), len(rdocs))
+
+    documents = collections.defaultdict(list)
+    for rdoc in rdocs:
+        if rdoc['_id'] in fingerprints:
+            documents[rdoc['pid']].append((rdoc, fingerprints[rdoc['_id']]))
+
+    result = []
+    for pid, pdocuments in documents.items():
+        pairs, index = winnow.match_all(((rdoc['_id'], fps) for rdoc, fps in pdocuments), ignore_limit)
+        rdict = {rdoc['_id']: rdoc for rdoc, _ in pdocuments}
+        for rid_a, rid_b, shared in pairs:
+            similarity_a, similarity_b = index.similarity(rid_a, rid_b, shared)
+            if max(similarity_a, similarity_b) < min_similarity:
+                continue
+            result.append({'pid': pid, 'shared': shared,
+                           'rid_a': rid_a, 'uid_a': rdict[rid_a]['uid'], 'similarity_a': similarity_a,
+                           'rid_b': rid_b, 'uid_b': rdict[rid_b]['uid'], 'similarity_b': similarity_b})
+    result.sort(key=lambda pair: (max(pair['similarity_a'], pair['similarity_b']), pair['shared']),
+                reverse=True)
+    return result[:limit]
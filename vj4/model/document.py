@@ -79,6 +79,18 @@ async def set(domain_id: str, doc_type: int, doc_id: convert_doc_id, **kwargs):
   return doc
 
 
+async def set_if_not(domain_id: str, doc_type: int, doc_id: convert_doc_id,
+                     key: str, value, if_not, **kwargs):
+  """Set key to value unless it is if_not already. Returns None if it was."""
+  coll = db.coll('document')
+  return await coll.find_one_and_update(filter={'domain_id': domain_id,
+                                                'doc_type': doc_type,
+                                                'doc_id': doc_id,
+                                                key: {'$ne': if_not}},
+                                        update={'$set': {key: value, **kwargs}},
+                                        return_document=ReturnDocument.AFTER)
+
+
 async def delete(domain_id: str, doc_type: int, doc_id: convert_doc_id):
   # TODO(twd2): delete status?
   coll = db.coll('document')
@@ -95,8 +107,8 @@ async def delete_multi(domain_id: str, doc_type: int, **kwargs):
                                  **kwargs})
 
 
-def get_multi(*, fields=None, **kwargs):
-  coll = db.coll('document')
+def get_multi(*, fields=None, stale_ok=False, **kwargs):
+  coll = db.stale_coll('document') if stale_ok else db.coll('document')
   return coll.find(kwargs, projection=fields)
 
 
@@ -230,14 +242,16 @@ async def get_status(domain_id: str, doc_type: int, doc_id: convert_doc_id, uid:
                              projection=fields)
 
 
-def get_multi_status(*, fields=None, **kwargs):
-  coll = db.coll('document.status')
+def get_multi_status(*, fields=None, stale_ok=False, **kwargs):
+  coll = db.stale_coll('document.status') if stale_ok else db.coll('document.status')
   return coll.find(kwargs, projection=fields)
 
 
-async def aggregate_contest_detail(*, sort: list = None, **kwargs):
+async def aggregate_contest_detail(*, sort: list = None, stale_ok=False, **kwargs):
   pipeline = [{
     '$match': kwargs
+  }, {
+    '$project': {'journal': 0}
   }, {
     '$unwind': '$detail'
   }, {
@@ -268,8 +282,9 @@ async def aggregate_contest_detail(*, sort: list = None, **kwargs):
   }, {
     '$sort': dict(sort or [])
   }]
+  coll = db.stale_coll('document.status') if stale_ok else db.coll('document.status')
   adocs = []
-  async for adoc in await db.coll('document.status').aggregate(pipeline):
+  async for adoc in await coll.aggregate(pipeline):
     adocs.append(adoc)
   return adocs
 
@@ -382,6 +397,58 @@ async def rev_set_status(domain_id, doc_type, doc_id, uid, rev, return_doc=True,
     return result
 
 
+async def rev_push_set_status(domain_id, doc_type, doc_id, uid, rev, key, value, fields=None, **kwargs):
+  """Push a value and set fields of a status document in one update conditioned on the revision."""
+  coll = db.coll('document.status')
+  doc = await coll.find_one_and_update(filter={'domain_id': domain_id,
+                                               'doc_type': doc_type,
+                                               'doc_id': doc_id,
+                                               'uid': uid,
+                                               'rev': rev},
+                                       update={'$push': {key: value},
+                                               '$set': kwargs,
+                                               '$inc': {'rev': 1}},
+                                       projection=fields,
+                                       return_document=ReturnDocument.AFTER)
+  return doc
+
+
+async def rev_set_multi_status(domain_id, doc_type, doc_id, updates):
+  """Set status documents of many users in one unordered bulk operation.
+
+  Args:
+    updates: iterable of (uid, rev, fields) tuples. An update is skipped if the rev does not match.
+  """
+  coll = db.coll('document.status')
+  bulk = coll.initialize_unordered_bulk_op()
+  execute = False
+  for uid, rev, fields in updates:
+    bulk.find({'domain_id': domain_id,
+               'doc_type': doc_type,
+               'doc_id': doc_id,
+               'uid': uid,
+               'rev': rev}).update_one({'$set': fields, '$inc': {'rev': 1}})
+    execute = True
+  if execute:
+    return await bulk.execute()
+
+
+async def add_status_journal_archive(domain_id, doc_type, doc_id, uid, journal):
+  """Move entries of the journal of a status document to the archive collection."""
+  coll = db.coll('document.status.journal')
+  await coll.insert_one({'domain_id': domain_id,
+                         'doc_type': doc_type,
+                         'doc_id': doc_id,
+                         'uid': uid,
+                         'journal': journal})
+
+
+def get_multi_status_journal_archive(*, fields=None, **kwargs):
+  """Get archived journal entries, in the order they were archived."""
+  coll = db.coll('document.status.journal')
+  return coll.find(kwargs, fields).sort([('_id', 1)])
+
+
 @argmethod.wrap
 async def ensure_indexes():
   coll = db.coll('document')
@@ -442,6 +509,9 @@ async def ensure_indexes():
                            ('doc_type', 1),
                            ('rule', 1),
                            ('doc_id', -1)], sparse=True)
+  # for contest pre-warming, across domains
+  await coll.create_index([('doc_type', 1),
+                           ('begin_at', 1)], sparse=True)
   # for training
   await coll.create_index([('domain_id', 1),
                            ('doc_type', 1),
@@ -475,6 +545,12 @@ async def ensure_indexes():
                                   ('uid', 1),
                                   ('enroll', 1),
                                   ('doc_id', 1)], sparse=True)
+  journal_coll = db.coll('document.status.journal')
+  await journal_coll.create_index([('domain_id', 1),
+                                   ('doc_type', 1),
+                                   ('doc_id', 1),
+                                   ('uid', 1),
+                                   ('_id', 1)])
 
 
 if __name__ == '__main__':
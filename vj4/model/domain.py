@@ -7,11 +7,26 @@ from vj4 import constant
 from vj4 import db
 from vj4 import error
 from vj4.model import builtin
+from vj4.service import bus
 from vj4.util import argmethod
+from vj4.util import lrucache
+from vj4.util import options
 from vj4.util import validator
 
+options.define('domain_cache_max_entries', default=1024,
+               help='Maximum number of domain documents cached per process.')
+options.define('domain_cache_ttl_seconds', default=300,
+               help='Time to live of cached domain documents, in seconds.')
+
 PROJECTION_PUBLIC = {'uid': 1}
 
+_BUILTIN_DOMAINS = {ddoc['_id']: ddoc for ddoc in builtin.DOMAINS}
+_BUILTIN_ROLES = {role: rd.default_permission for role, rd in builtin.BUILTIN_ROLE_DESCRIPTORS.items()}
+
+_cache = lrucache.LruCache(options.domain_cache_max_entries, options.domain_cache_ttl_seconds)
+# Compiled role to permission mask dicts, keyed by domain_id, along with the roles they are from.
+_all_roles = lrucache.LruCache(options.domain_cache_max_entries)
+
 
 @argmethod.wrap
 async def add(domain_id: str, owner_uid: int,
@@ -36,6 +51,7 @@ async def add(domain_id: str, owner_uid: int,
   await add_user_role(domain_id, owner_uid, builtin.ROLE_ROOT)
   await coll.update_one({'_id': domain_id},
                         {'$unset': {'pending': ''}})
+  await _invalidate(domain_id)
   return domain_id
 
 
@@ -53,20 +69,51 @@ async def add_continue(domain_id: str, ensure_owner_uid: int=None):
   coll = db.coll('domain')
   await coll.update_one({'_id': domain_id},
                         {'$unset': {'pending': ''}})
+  await _invalidate(domain_id)
 
 
 @argmethod.wrap
 async def get(domain_id: str, fields=None):
-  for domain in builtin.DOMAINS:
-    if domain['_id'] == domain_id:
-      return domain
+  ddoc = _BUILTIN_DOMAINS.get(domain_id)
+  if ddoc:
+    return ddoc
+  if fields is None:
+    ddoc = _cache.get(domain_id)
+    if ddoc:
+      return dict(ddoc)
   coll = db.coll('domain')
   ddoc = await coll.find_one(domain_id, fields)
   if not ddoc:
     raise error.DomainNotFoundError(domain_id)
+  if fields is None:
+    _cache.set(domain_id, ddoc)
+    ddoc = dict(ddoc)
   return ddoc
 
 
+def get_cache_stats():
+  return _cache.stats()
+
+
+async def _on_domain_change(e):
+  _cache.pop(e['value']['domain_id'])
+
+
+def init():
+  bus.subscribe(_on_domain_change, ['domain_change'])
+
+
+def uninit():
+  bus.unsubscribe(_on_domain_change)
+  _cache.clear()
+  _all_roles.clear()
+
+
+async def _invalidate(domain_id):
+  _cache.pop(domain_id)
+  await bus.publish('domain_change', {'domain_id': domain_id})
+
+
 def get_multi(*, fields=None, **kwargs):
   coll = db.coll('domain')
   return coll.find(kwargs, fields)
@@ -93,17 +140,21 @@ async def edit(domain_id: str, **kwargs):
   if 'name' in kwargs:
     validator.check_name(kwargs['name'])
   # TODO(twd2): check kwargs
-  return await coll.find_one_and_update(filter={'_id': domain_id},
+  ddoc = await coll.find_one_and_update(filter={'_id': domain_id},
                                         update={'$set': {**kwargs}},
                                         return_document=ReturnDocument.AFTER)
+  await _invalidate(domain_id)
+  return ddoc
 
 
 async def unset(domain_id, fields):
   # TODO(twd2): check fields
   coll = db.coll('domain')
-  return await coll.find_one_and_update(filter={'_id': domain_id},
+  ddoc = await coll.find_one_and_update(filter={'_id': domain_id},
                                         update={'$unset': dict((f, '') for f in set(fields))},
                                         return_document=ReturnDocument.AFTER)
+  await _invalidate(domain_id)
+  return ddoc
 
 
 @argmethod.wrap
@@ -125,9 +176,11 @@ async def set_roles(domain_id: str, roles):
     if domain['_id'] == domain_id:
       raise error.BuiltinDomainError(domain_id)
   coll = db.coll('domain')
-  return await coll.find_one_and_update(filter={'_id': domain_id},
+  ddoc = await coll.find_one_and_update(filter={'_id': domain_id},
                                         update={'$set': update},
                                         return_document=ReturnDocument.AFTER)
+  await _invalidate(domain_id)
+  return ddoc
 
 
 @argmethod.wrap
@@ -148,10 +201,12 @@ async def delete_roles(domain_id: str, roles):
   await user_coll.update_many({'domain_id': domain_id, 'role': {'$in': list(roles)}},
                               {'$unset': {'role': ''}})
   coll = db.coll('domain')
-  return await coll.find_one_and_update(filter={'_id': domain_id},
+  ddoc = await coll.find_one_and_update(filter={'_id': domain_id},
                                         update={'$unset': dict(('roles.{0}'.format(role), '')
                                                                for role in roles)},
                                         return_document=ReturnDocument.AFTER)
+  await _invalidate(domain_id)
+  return ddoc
 
 
 @argmethod.wrap
@@ -160,9 +215,11 @@ async def transfer(domain_id: str, old_owner_uid: int, new_owner_uid: int):
     if domain['_id'] == domain_id:
       raise error.BuiltinDomainError(domain_id)
   coll = db.coll('domain')
-  return await coll.find_one_and_update(filter={'_id': domain_id, 'owner_uid': old_owner_uid},
+  ddoc = await coll.find_one_and_update(filter={'_id': domain_id, 'owner_uid': old_owner_uid},
                                         update={'$set': {'owner_uid': new_owner_uid}},
                                         return_document=ReturnDocument.AFTER)
+  await _invalidate(domain_id)
+  return ddoc
 
 
 @argmethod.wrap
@@ -279,9 +336,16 @@ async def get_dict_user_by_domain_id(uid, *, fields=None):
 
 
 def get_all_roles(ddoc):
-  builtin_roles = {role: rd.default_permission for role, rd in builtin.BUILTIN_ROLE_DESCRIPTORS.items()}
-  domain_roles = ddoc['roles']
-  return {**builtin_roles, **domain_roles}
+  """Get the permission mask of each role of a domain, including the built-in roles.
+
+  The dict is compiled once for the roles of a cached domain document and shared, do not modify it.
+  """
+  roles = ddoc['roles']
+  entry = _all_roles.get(ddoc['_id'], count=False)
+  if not entry or entry[0] is not roles:
+    entry = (roles, {**_BUILTIN_ROLES, **roles})
+    _all_roles.set(ddoc['_id'], entry)
+  return entry[1]
 
 
 def get_join_settings(ddoc, now):
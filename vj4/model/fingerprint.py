@@ -0,0 +1,40 @@
+from bson import objectid
+
+from vj4 import db
+from vj4.util import argmethod
+
+
+def _params(lang: str, wildcards: list, k: int, window: int):
+  return {'lang': lang, 'wildcards': list(wildcards), 'k': k, 'window': window}
+
+
+async def get_dict(rids, lang: str, wildcards: list, k: int, window: int):
+  """Get the stored fingerprints of records computed with the same parameters, keyed by rid."""
+  coll = db.coll('fingerprint')
+  result = dict()
+  async for fdoc in coll.find({'_id': {'$in': list(set(rids))}, **_params(lang, wildcards, k, window)},
+                              {'fingerprints': 1}):
+    result[fdoc['_id']] = fdoc['fingerprints']
+  return result
+
+
+async def set_multi(fingerprints: dict, lang: str, wildcards: list, k: int, window: int):
+  """Store the fingerprints of records, keyed by rid."""
+  if not fingerprints:
+    return
+  coll = db.coll('fingerprint')
+  bulk = coll.initialize_unordered_bulk_op()
+  for rid, fps in fingerprints.items():
+    bulk.find({'_id': rid}).upsert().update_one(
+        {'$set': {**_params(lang, wildcards, k, window), 'fingerprints': fps}})
+  await bulk.execute()
+
+
+@argmethod.wrap
+async def delete(rid: objectid.ObjectId):
+  coll = db.coll('fingerprint')
+  return await coll.delete_one({'_id': rid})
+
+
+if __name__ == '__main__':
+  argmethod.invoke_by_args()
@@ -0,0 +1,80 @@
+"""Score of each user in each contest of a domain, one document per user.
+
+Kept up to date along with contest status documents, so a gradebook is read without aggregating
+status documents of all contests.
+"""
+from vj4 import db
+from vj4.util import argmethod
+
+_REBUILD_BATCH_SIZE = 1000
+
+
+async def set(domain_id: str, doc_type: int, uid: int, tid, value):
+  coll = db.coll('gradebook')
+  await coll.update_one({'domain_id': domain_id, 'doc_type': doc_type, 'uid': uid},
+                        {'$set': {'scores.' + str(tid): value}},
+                        upsert=True)
+
+
+async def set_multi(domain_id: str, doc_type: int, tid, values: dict):
+  """Set the scores of many users in a contest, from a dict of uid to score."""
+  if not values:
+    return
+  coll = db.coll('gradebook')
+  bulk = coll.initialize_unordered_bulk_op()
+  for uid, value in values.items():
+    bulk.find({'domain_id': domain_id, 'doc_type': doc_type, 'uid': uid}) \
+        .upsert().update_one({'$set': {'scores.' + str(tid): value}})
+  await bulk.execute()
+
+
+def get_multi(domain_id: str, doc_type: int, *, fields=None, **kwargs):
+  coll = db.coll('gradebook')
+  return coll.find({'domain_id': domain_id, 'doc_type': doc_type, **kwargs}, fields).sort('uid', 1)
+
+
+async def rebuild(domain_id: str, doc_type: int, tid, key: str):
+  """Rebuild the scores of a contest from its status documents.
+
+  Args:
+    key: the key of the score in the status documents of the contest.
+  """
+  coll = db.coll('gradebook')
+  score_key = 'scores.' + str(tid)
+  bulk = coll.initialize_unordered_bulk_op()
+  uids = set()
+  async for tsdoc in db.coll('document.status').find({'domain_id': domain_id,
+                                                      'doc_type': doc_type,
+                                                      'doc_id': tid,
+                                                      'attend': {'$gte': 1}},
+                                                     {'uid': 1, key: 1}):
+    uids.add(tsdoc['uid'])
+    bulk.find({'domain_id': domain_id, 'doc_type': doc_type, 'uid': tsdoc['uid']}) \
+        .upsert().update_one({'$set': {score_key: tsdoc.get(key, 0)}})
+  if uids:
+    await bulk.execute()
+  # Scores of users who no longer attend, removed in batches of uids.
+  stale_uids = [gdoc['uid'] async for gdoc in coll.find({'domain_id': domain_id,
+                                                         'doc_type': doc_type,
+                                                         score_key: {'$exists': True}},
+                                                        {'uid': 1})
+                if gdoc['uid'] not in uids]
+  for index in range(0, len(stale_uids), _REBUILD_BATCH_SIZE):
+    await coll.update_many({'domain_id': domain_id,
+                            'doc_type': doc_type,
+                            'uid': {'$in': stale_uids[index:index + _REBUILD_BATCH_SIZE]}},
+                           {'$unset': {score_key: ''}})
+  if stale_uids:
+    await coll.delete_many({'domain_id': domain_id, 'doc_type': doc_type, 'scores': {}})
+
+
+@argmethod.wrap
+async def ensure_indexes():
+  coll = db.coll('gradebook')
+  await coll.create_index([('domain_id', 1),
+                           ('doc_type', 1),
+                           ('uid', 1)], unique=True)
+
+
+if __name__ == '__main__':
+  argmethod.invoke_by_args()
@@ -1,5 +1,6 @@
 import asyncio
 import datetime
+import functools
 import logging
 from typing import Union
 from bson import objectid
@@ -24,7 +25,7 @@ _logger = logging.getLogger(__name__)
 async def add(domain_id: str, pid: document.convert_doc_id, type: int, uid: int, lang: str,
               code: Union[str, objectid.ObjectId], data_id: objectid.ObjectId = None,
               tid: objectid.ObjectId = None, hidden=False, show_detail=False,
-              code_type=constant.record.FILE_TYPE_TEXT, judge_category=[]):
+              code_type=constant.record.FILE_TYPE_TEXT, judge_category=[], *, idmap=None):
     validator.check_lang(lang)
     coll = db.coll('record')
     doc = {'hidden': hidden,
@@ -44,6 +45,8 @@ async def add(domain_id: str, pid: document.convert_doc_id, type: int, uid: int,
            'type': type,
            'judge_category': judge_category}
     rid = (await coll.insert_one(doc)).inserted_id
+    if idmap is not None:
+        idmap.set(('record', None, rid), dict(doc))
     bus.publish_throttle('record_change', doc, rid)
     post_coros = [queue.publish('judge', rid=rid)]
     if type == constant.record.TYPE_SUBMISSION:
@@ -82,8 +85,10 @@ async def system_test(rdoc, judge_category):
 
 
 @argmethod.wrap
-async def get(record_id: objectid.ObjectId, fields=PROJECTION_ALL):
+async def get(record_id: objectid.ObjectId, fields=PROJECTION_ALL, *, idmap=None):
     coll = db.coll('record')
+    if idmap is not None and fields is PROJECTION_ALL:
+        return await idmap.get(('record', None, record_id), functools.partial(coll.find_one, record_id))
     return await coll.find_one(record_id, fields)
 
 
@@ -111,7 +116,8 @@ async def rejudge(record_id: objectid.ObjectId, enqueue: bool = True):
 @argmethod.wrap
 def get_all_multi(end_id: objectid.ObjectId = None, get_hidden: bool = False, *, fields=None,
                   **kwargs):
-    coll = db.coll('record')
+    # Record lists tolerate staleness, they are updated by the record_change events.
+    coll = db.stale_coll('record')
     query = {**kwargs, 'hidden': False if not get_hidden else {'$gte': False}}
     if end_id:
         query['_id'] = {'$lt': end_id}
@@ -127,7 +133,7 @@ def get_multi(get_hidden: bool = False, fields=None, **kwargs):
 
 @argmethod.wrap
 async def get_count(begin_id: objectid.ObjectId = None):
-    coll = db.coll('record')
+    coll = db.stale_coll('record')
     query = {}
     if begin_id:
         query['_id'] = {'$gte': begin_id}
@@ -91,6 +91,20 @@ async def set_db_version(version: int):
   return result.modified_count
 
 
+@argmethod.wrap
+async def get_index_fingerprint():
+  coll = db.coll('system')
+  doc = await coll.find_one({'_id': 'index_fingerprint'})
+  return doc['value'] if doc else None
+
+
+async def set_index_fingerprint(fingerprint: str):
+  coll = db.coll('system')
+  await coll.update_one(filter={'_id': 'index_fingerprint'},
+                        update={'$set': {'value': fingerprint}},
+                        upsert=True)
+
+
 async def ensure_db_version(allowed_version=None):
   if allowed_version is None:
     allowed_version = EXPECTED_DB_VERSION
@@ -19,6 +19,11 @@ def _get_id(id_binary):
   return hashlib.sha256(id_binary).digest()
 
 
+def get_hashed_id(token_id: str):
+  """Get the hashed ID, which is the _id of the token document."""
+  return _get_id(binascii.unhexlify(token_id))
+
+
 @argmethod.wrap
 async def add(token_type: int, expire_seconds: int, **kwargs):
   """Add a token.
@@ -106,6 +111,21 @@ async def update(token_id: str, token_type: int, expire_seconds: int, **kwargs):
   return doc
 
 
+async def touch_multi(updates):
+  """Refresh many tokens in one bulk write.
+
+  Args:
+    updates: list of (hashed ID, token type, dict of fields to set).
+  """
+  if not updates:
+    return
+  coll = db.coll('token')
+  bulk = coll.initialize_unordered_bulk_op()
+  for hashed_id, token_type, fields in updates:
+    bulk.find({'_id': hashed_id, 'token_type': token_type}).update_one({'$set': fields})
+  await bulk.execute()
+
+
 @argmethod.wrap
 async def delete(token_id: str, token_type: int):
   """Delete a token.
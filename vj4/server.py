@@ -1,56 +1,281 @@
-import atexit
+"""The server, a supervisor of prefork workers.
+
+Shared state is loaded and frozen in the supervisor before forking, so that workers share its pages
+copy-on-write. With SO_REUSEPORT, each worker listens on a socket of its own and the kernel balances
+connections between them.
+
+Send SIGHUP to the supervisor to reload: it re-executes itself with the new code, then replaces
+workers one at a time. Each old worker is stopped only after its replacement is ready, and stops by
+closing its socket and draining its connections in up to options.shutdown_timeout seconds.
+"""
+import asyncio
 import coloredlogs
+import gc
 import logging
 import os
+import select
 import signal
 import socket
 import sys
+import time
 import urllib.parse
 
-from aiohttp import web
 from coloredlogs import syslog
+
+try:
+  import uvloop
+except ImportError:
+  uvloop = None
+
 from vj4 import app
+from vj4 import template
 from vj4.util import options
 
 options.define('listen', default='http://127.0.0.1:34765', help='Server listening address.')
 options.define('prefork', default=1, help='Number of prefork workers.')
+options.define('reuse_port', default=True,
+               help='Listen on a socket per worker with SO_REUSEPORT, if available.')
+options.define('shutdown_timeout', default=30,
+               help='Time for a stopping worker to drain its connections, in seconds.')
+options.define('worker_start_timeout', default=120,
+               help='Time for a worker to start listening, in seconds, after which it is killed.')
 options.define('syslog', default=False, help='Use syslog instead of stderr for logging.')
+options.define('uvloop', default=False, help='Use the uvloop event loop, if installed.')
+options.define('tcp_nodelay', default=True, help='Disable Nagle\'s algorithm on connections.')
+options.define('socket_buffer_size', default=0,
+               help='Size of the send and receive buffers of connections, in bytes, '
+                    'or 0 for the system default.')
 
 _logger = logging.getLogger(__name__)
 
+# Passed to the re-executed supervisor on reload.
+_ENV_WORKERS = 'VJ4_SERVER_WORKERS'
+_ENV_LISTEN_FD = 'VJ4_SERVER_LISTEN_FD'
 
-def main():
-  if not options.syslog:
-    coloredlogs.install(level=logging.DEBUG if options.debug else logging.INFO,
-                        fmt='[%(levelname).1s %(asctime)s %(module)s:%(lineno)d] %(message)s',
-                        datefmt='%y%m%d %H:%M:%S')
-  else:
-    syslog.enable_system_logging(level=logging.DEBUG if options.debug else logging.INFO,
-                                 fmt='vj4[%(process)d] %(programname)s %(levelname).1s %(message)s')
-  logging.getLogger('sockjs').setLevel(logging.WARNING)
-  url = urllib.parse.urlparse(options.listen)
+_FAMILIES = {'http': socket.AF_INET, 'unix': socket.AF_UNIX}
+
+
+def _bind(url, reuse_port=False):
+  sock = socket.socket(_FAMILIES[url.scheme], socket.SOCK_STREAM)
   if url.scheme == 'http':
-    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
     sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, True)
+    if reuse_port:
+      sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, True)
+    # Accepted connections inherit the options of the listening socket.
+    if options.tcp_nodelay:
+      sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, True)
     host, port_str = url.netloc.rsplit(':', 1)
     sock.bind((host, int(port_str)))
-  elif url.scheme == 'unix':
-    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+  else:
     try:
       os.remove(url.path)
     except FileNotFoundError:
       pass
     sock.bind(url.path)
+  if options.socket_buffer_size:
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, options.socket_buffer_size)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, options.socket_buffer_size)
+  return sock
+
+
+def install_event_loop_policy():
+  """Install the uvloop policy if enabled, before any event loop is created."""
+  if not options.uvloop:
+    return
+  if not uvloop:
+    _logger.warning('uvloop is not installed, using the default event loop')
+    return
+  asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+
+
+def _run_worker(url, sock, ready_fd):
+  for signum in (signal.SIGHUP, signal.SIGINT, signal.SIGTERM):
+    signal.signal(signum, signal.SIG_DFL)
+  if not sock:
+    sock = _bind(url, reuse_port=True)
+  loop = asyncio.get_event_loop()
+  # Debug mode of the loop may be turned on by PYTHONASYNCIODEBUG, it is slow.
+  loop.set_debug(options.debug)
+  application = app.Application()
+  # Like web.run_app, whose on_startup hooks run before listening, but reports readiness once the
+  # server accepts connections, so that the worker it replaces is only stopped then.
+  loop.run_until_complete(application.startup())
+  handler = application.make_handler(access_log=None)
+  server = loop.run_until_complete(loop.create_server(handler, sock=sock, backlog=128))
+  # Stopping the loop closes the socket and drains connections.
+  loop.add_signal_handler(signal.SIGTERM, loop.stop)
+  os.write(ready_fd, b'\0')
+  os.close(ready_fd)
+  try:
+    loop.run_forever()
+  finally:
+    server.close()
+    loop.run_until_complete(server.wait_closed())
+    loop.run_until_complete(application.shutdown())
+    loop.run_until_complete(handler.shutdown(options.shutdown_timeout))
+    loop.run_until_complete(application.cleanup())
+  loop.close()
+
+
+class Supervisor(object):
+  def __init__(self, url, sock):
+    self.url = url
+    # The socket shared by all workers, or None if each worker listens on a socket of its own.
+    self.sock = sock
+    self.workers = set()
+    self.stopping = False
+    self.reloading = False
+
+  def _on_stop(self, signum, frame):
+    self.stopping = True
+
+  def _on_reload(self, signum, frame):
+    self.reloading = True
+
+  def _spawn(self):
+    """Fork a worker and wait until it is ready.
+
+    Returns:
+      The pid of the worker, or None if it failed to start.
+    """
+    read_fd, write_fd = os.pipe()
+    pid = os.fork()
+    if not pid:
+      os.close(read_fd)
+      try:
+        _run_worker(self.url, self.sock, write_fd)
+      except BaseException as e:
+        _logger.exception(e)
+        os._exit(1)
+      os._exit(0)
+    os.close(write_fd)
+    try:
+      readable, _, _ = select.select([read_fd], [], [], options.worker_start_timeout)
+      # End of file without data means the worker exited before being ready.
+      ready = os.read(read_fd, 1) if readable else b''
+    finally:
+      os.close(read_fd)
+    if not ready:
+      if not readable:
+        _logger.error('Worker %d did not start in %d seconds', pid, options.worker_start_timeout)
+        try:
+          os.kill(pid, signal.SIGKILL)
+        except ProcessLookupError:
+          pass
+      self._wait(pid)
+      _logger.error('Worker %d failed to start', pid)
+      return None
+    self.workers.add(pid)
+    _logger.info('Worker %d started', pid)
+    return pid
+
+  def _stop(self, pid):
+    try:
+      os.kill(pid, signal.SIGTERM)
+    except ProcessLookupError:
+      pass
+    self._wait(pid)
+
+  def _wait(self, pid):
+    try:
+      os.waitpid(pid, 0)
+    except ChildProcessError:
+      pass
+    self.workers.discard(pid)
+
+  def _reap(self):
+    while self.workers:
+      try:
+        pid, status = os.waitpid(-1, os.WNOHANG)
+      except ChildProcessError:
+        self.workers.clear()
+        break
+      if not pid:
+        break
+      if pid in self.workers:
+        self.workers.discard(pid)
+        _logger.warning('Worker %d exited with status %d', pid, status)
+
+  def _replace(self, old_workers):
+    """Replace old workers one at a time, so that there are always workers accepting."""
+    for pid in old_workers:
+      if self.stopping:
+        return
+      if len(self.workers) <= options.prefork:
+        if not self._spawn():
+          _logger.error('Keeping old workers')
+          return
+      self._stop(pid)
+      _logger.info('Worker %d replaced', pid)
+
+  def _reload(self):
+    """Re-execute the supervisor with the new code, passing the workers on."""
+    _logger.info('Reloading')
+    os.environ[_ENV_WORKERS] = ','.join(str(pid) for pid in self.workers)
+    if self.sock:
+      os.set_inheritable(self.sock.fileno(), True)
+      os.environ[_ENV_LISTEN_FD] = str(self.sock.fileno())
+    main_spec = getattr(sys.modules['__main__'], '__spec__', None)
+    args = ['-m', main_spec.name] if main_spec else [sys.argv[0]]
+    sys.stdout.flush()
+    sys.stderr.flush()
+    os.execv(sys.executable, [sys.executable] + args + sys.argv[1:])
+
+  def run(self, old_workers=()):
+    signal.signal(signal.SIGINT, self._on_stop)
+    signal.signal(signal.SIGTERM, self._on_stop)
+    signal.signal(signal.SIGHUP, self._on_reload)
+    self.workers.update(old_workers)
+    self._replace(old_workers)
+    while not self.stopping:
+      if self.reloading:
+        self._reload()
+      self._reap()
+      while len(self.workers) < options.prefork and not self.stopping:
+        if not self._spawn():
+          break
+      time.sleep(1)
+    _logger.info('Stopping')
+    for pid in list(self.workers):
+      os.kill(pid, signal.SIGTERM)
+    for pid in list(self.workers):
+      self._wait(pid)
+
+
+def main():
+  if not options.syslog:
+    coloredlogs.install(level=logging.DEBUG if options.debug else logging.INFO,
+                        fmt='[%(levelname).1s %(asctime)s %(module)s:%(lineno)d] %(message)s',
+                        datefmt='%y%m%d %H:%M:%S')
   else:
+    syslog.enable_system_logging(level=logging.DEBUG if options.debug else logging.INFO,
+                                 fmt='vj4[%(process)d] %(programname)s %(levelname).1s %(message)s')
+  logging.getLogger('sockjs').setLevel(logging.WARNING)
+  url = urllib.parse.urlparse(options.listen)
+  if url.scheme not in _FAMILIES:
     _logger.error('Invalid listening scheme %s', url.scheme)
     return 1
-  for i in range(1, options.prefork):
-    pid = os.fork()
-    if not pid:
-      break
-    else:
-      atexit.register(lambda: os.kill(pid, signal.SIGTERM))
-  web.run_app(app.Application(), sock=sock, access_log=None, shutdown_timeout=0)
+  old_workers = [int(pid) for pid in os.environ.pop(_ENV_WORKERS, '').split(',') if pid]
+  listen_fd = os.environ.pop(_ENV_LISTEN_FD, None)
+  if url.scheme == 'http' and options.reuse_port and hasattr(socket, 'SO_REUSEPORT'):
+    # Fail early on a bad address, workers bind their own sockets.
+    _bind(url, reuse_port=True).close()
+    sock = None
+  elif listen_fd:
+    sock = socket.socket(_FAMILIES[url.scheme], socket.SOCK_STREAM, 0, int(listen_fd))
+    os.set_inheritable(sock.fileno(), False)
+  else:
+    sock = _bind(url)
+  install_event_loop_policy()
+  app.preload()
+  if options.template_precompile:
+    template.Environment().precompile()
+  # Objects loaded so far live as long as the workers, keep the collector of workers from touching
+  # them so their pages stay shared.
+  gc.collect()
+  if hasattr(gc, 'freeze'):
+    gc.freeze()
+  Supervisor(url, sock).run(old_workers)
 
 if __name__ == '__main__':
   sys.exit(main())
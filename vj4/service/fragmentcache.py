@@ -0,0 +1,55 @@
+"""Rendered template fragments cached per process, see the cache tag in vj4.template.
+
+A fragment is keyed by a tuple of (name, domain_id, *dependencies), for example the view language.
+Invalidating a name in a domain drops its fragments of all dependencies in all processes.
+"""
+from vj4.service import bus
+from vj4.util import lrucache
+from vj4.util import options
+
+options.define('fragment_cache_max_entries', default=1024,
+               help='Maximum number of rendered template fragments cached per process.')
+
+_cache = lrucache.LruCache(options.fragment_cache_max_entries)
+# Fragments are keyed along with the generation of their (name, domain_id), which is increased on
+# invalidation, so the stale ones are no longer hit and age out of the cache.
+_generations = dict()
+
+
+async def _on_invalidate(e):
+  _bump(e['value']['name'], e['value']['domain_id'])
+
+
+def init():
+  bus.subscribe(_on_invalidate, ['fragment_invalidate'])
+
+
+def uninit():
+  bus.unsubscribe(_on_invalidate)
+  _cache.clear()
+  _generations.clear()
+
+
+def _bump(name, domain_id):
+  _generations[(name, domain_id)] = _generations.get((name, domain_id), 0) + 1
+
+
+def _cache_key(key):
+  return _generations.get(tuple(key[:2]), 0), tuple(key)
+
+
+def get(key):
+  return _cache.get(_cache_key(key))
+
+
+def set(key, value, ttl_seconds=None):
+  _cache.set(_cache_key(key), value, ttl_seconds)
+
+
+async def invalidate(name, domain_id):
+  _bump(name, domain_id)
+  await bus.publish('fragment_invalidate', {'name': name, 'domain_id': domain_id})
+
+
+def get_stats():
+  return _cache.stats()
@@ -0,0 +1,92 @@
+"""Rendered pages of guests cached per process, see base.Handler.PAGE_CACHE.
+
+Guests share the same user, session and settings, so their pages only differ by the path, the query
+and whether JSON is preferred. Requests with a session cookie always bypass the cache.
+
+A page depends on some kinds of documents of its domain, for example 'problem', and always on the
+domain itself. Invalidating a kind in a domain drops the pages depending on it in all processes.
+Other changes, for example of statistics, are visible once cached pages expire.
+"""
+from aiohttp import web
+
+from vj4.service import bus
+from vj4.util import lrucache
+from vj4.util import options
+
+options.define('page_cache_max_entries', default=1024,
+               help='Maximum number of guest pages cached per process.')
+options.define('page_cache_ttl_seconds', default=10,
+               help='Time to live of cached guest pages, in seconds, or 0 to disable.')
+
+# Headers of cached responses which are not replayed, they are set by later middlewares.
+_SKIP_HEADERS = {'content-length', 'content-encoding', 'etag', 'set-cookie', 'vary'}
+
+_cache = lrucache.LruCache(options.page_cache_max_entries, options.page_cache_ttl_seconds)
+# Pages are keyed along with the generations of their (domain_id, kind)s, which are increased on
+# invalidation, so the stale ones are no longer hit and age out of the cache.
+_generations = dict()
+
+
+async def _on_problem_change(e):
+  _bump(e['value']['domain_id'], 'problem')
+
+
+async def _on_contest_change(e):
+  _bump(e['value']['domain_id'], 'contest')
+
+
+async def _on_domain_change(e):
+  _bump(e['value']['domain_id'], 'domain')
+
+
+async def _on_invalidate(e):
+  _bump(e['value']['domain_id'], e['value']['kind'])
+
+
+def init():
+  bus.subscribe(_on_problem_change, ['problem_change'])
+  bus.subscribe(_on_contest_change, ['contest_change'])
+  bus.subscribe(_on_domain_change, ['domain_change'])
+  bus.subscribe(_on_invalidate, ['page_invalidate'])
+
+
+def uninit():
+  bus.unsubscribe(_on_problem_change)
+  bus.unsubscribe(_on_contest_change)
+  bus.unsubscribe(_on_domain_change)
+  bus.unsubscribe(_on_invalidate)
+  _cache.clear()
+  _generations.clear()
+
+
+def _bump(domain_id, kind):
+  _generations[(domain_id, kind)] = _generations.get((domain_id, kind), 0) + 1
+
+
+def get_key(domain_id, kinds, path_qs, prefer_json):
+  generations = tuple(_generations.get((domain_id, kind), 0) for kind in ('domain', *kinds))
+  return domain_id, generations, path_qs, prefer_json, options.default_locale
+
+
+def get(key):
+  """Get a new response of the page of key, or None."""
+  page = _cache.get(key)
+  if not page:
+    return None
+  status, headers, body = page
+  return web.Response(status=status, headers=headers, body=body)
+
+
+def set(key, response):
+  headers = [(name, value) for name, value in response.headers.items()
+             if name.lower() not in _SKIP_HEADERS]
+  _cache.set(key, (response.status, headers, response.body))
+
+
+async def invalidate(domain_id, kind):
+  _bump(domain_id, kind)
+  await bus.publish('page_invalidate', {'domain_id': domain_id, 'kind': kind})
+
+
+def get_stats():
+  return _cache.stats()
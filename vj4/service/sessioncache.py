@@ -0,0 +1,159 @@
+"""Session tokens cached per process, with their expiry refreshed write-behind.
+
+Touching a session on each request only changes the cached document. The refresh is written back in
+one bulk write per options.session_touch_flush_seconds, and only once the session has not been
+written for options.session_touch_threshold_seconds or its IP or user agent changed. Other changes
+of a session are written through, and changed or deleted sessions are dropped from the caches of all
+processes through the bus.
+"""
+import asyncio
+import datetime
+import logging
+
+from vj4.model import token
+from vj4.service import bus
+from vj4.util import lrucache
+from vj4.util import options
+
+options.define('session_cache_max_entries', default=4096,
+               help='Maximum number of sessions cached per process.')
+options.define('session_cache_ttl_seconds', default=60,
+               help='Time to live of cached sessions, in seconds.')
+options.define('session_touch_threshold_seconds', default=300,
+               help='Time since a session was last written before its expiry is written back, '
+                    'in seconds.')
+options.define('session_touch_flush_seconds', default=5,
+               help='Delay of writing back touched sessions in batch, in seconds.')
+
+_logger = logging.getLogger(__name__)
+
+# Fields refreshed on every request, which are written back lazily.
+TOUCH_FIELDS = ('update_ip', 'update_ua')
+
+_cache = lrucache.LruCache(options.session_cache_max_entries, options.session_cache_ttl_seconds)
+_pending = dict()
+_flush_handle = None
+
+
+async def _on_session_change(e):
+  for hashed_id in e['value']['ids']:
+    _forget(hashed_id)
+
+
+def init():
+  bus.subscribe(_on_session_change, ['session_change'])
+
+
+def uninit():
+  global _flush_handle
+  bus.unsubscribe(_on_session_change)
+  if _flush_handle:
+    _flush_handle.cancel()
+    _flush_handle = None
+  _cache.clear()
+  _pending.clear()
+
+
+def get_stats():
+  return {**_cache.stats(), 'pending': len(_pending)}
+
+
+def _forget(hashed_id):
+  _cache.pop(hashed_id)
+  _pending.pop(hashed_id, None)
+
+
+async def _publish_change(hashed_ids):
+  await bus.publish('session_change', {'ids': list(hashed_ids)})
+
+
+def _schedule_flush():
+  global _flush_handle
+  if not _flush_handle:
+    loop = asyncio.get_event_loop()
+    _flush_handle = loop.call_later(options.session_touch_flush_seconds,
+                                    lambda: loop.create_task(flush()))
+
+
+async def flush():
+  """Write back the sessions touched since the last flush."""
+  global _flush_handle
+  if _flush_handle:
+    _flush_handle.cancel()
+    _flush_handle = None
+  updates = [(hashed_id, token_type, fields) for hashed_id, (token_type, fields) in _pending.items()]
+  _pending.clear()
+  try:
+    await token.touch_multi(updates)
+  except Exception as e:
+    _logger.exception(e)
+
+
+def _touch(doc, expire_seconds, now, fields):
+  changed = {key: value for key, value in fields.items() if doc.get(key) != value}
+  if not changed and (now - doc['update_at']).total_seconds() < options.session_touch_threshold_seconds:
+    return
+  update = {**changed,
+            'update_at': now,
+            'expire_at': now + datetime.timedelta(seconds=expire_seconds)}
+  doc.update(update)
+  _pending.setdefault(doc['_id'], (doc['token_type'], {}))[1].update(update)
+  _schedule_flush()
+
+
+async def add(token_type: int, expire_seconds: int, **kwargs):
+  """Add a session token, see token.add."""
+  token_id, doc = await token.add(token_type, expire_seconds, **kwargs)
+  _cache.set(doc['_id'], doc)
+  return token_id, dict(doc)
+
+
+async def update(token_id: str, token_type: int, expire_seconds: int, **kwargs):
+  """Update a session token like token.update, without writing when only touching it.
+
+  Returns:
+    The session document, or None.
+  """
+  hashed_id = token.get_hashed_id(token_id)
+  data = {key: value for key, value in kwargs.items() if key not in TOUCH_FIELDS}
+  if not data:
+    doc = _cache.get(hashed_id)
+    if not doc or doc['token_type'] != token_type:
+      doc = await token.get(token_id, token_type)
+      if not doc:
+        return None
+      _cache.set(hashed_id, doc)
+    _touch(doc, expire_seconds, datetime.datetime.utcnow(), kwargs)
+    return dict(doc)
+  _pending.pop(hashed_id, None)
+  doc = await token.update(token_id, token_type, expire_seconds, **kwargs)
+  if doc:
+    _cache.set(hashed_id, doc)
+  else:
+    _cache.pop(hashed_id)
+  # Other processes may have cached the session before it changed.
+  await _publish_change([hashed_id])
+  return dict(doc) if doc else None
+
+
+async def delete(token_id: str, token_type: int):
+  """Delete a session token in all processes."""
+  return await delete_by_hashed_id(token.get_hashed_id(token_id), token_type)
+
+
+async def delete_by_hashed_id(hashed_id: bytes, token_type: int):
+  _forget(hashed_id)
+  result = await token.delete_by_hashed_id(hashed_id, token_type)
+  await _publish_change([hashed_id])
+  return result
+
+
+async def delete_by_uid(uid: int):
+  """Delete all session tokens of a user in all processes."""
+  sessions = await token.get_session_list_by_uid(uid)
+  for session in sessions:
+    _forget(session['_id'])
+  result = await token.delete_by_uid(uid)
+  if sessions:
+    await _publish_change(session['_id'] for session in sessions)
+  return result
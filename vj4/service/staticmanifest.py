@@ -6,19 +6,26 @@ MANIFEST_FILE = 'static-manifest.json'
 _manifest_dir = None
 _manifest_path = None
 _manifest = {}
+_fingerprinted = set()
 
 
 def init(static_dir):
-  global _manifest_dir, _manifest_path, _manifest
+  global _manifest_dir, _manifest_path, _manifest, _fingerprinted
   _manifest_dir = static_dir
   _manifest_path = path.join(_manifest_dir, MANIFEST_FILE)
   try:
     with open(_manifest_path, 'r') as manifest_file:
       data = json.decode(manifest_file.read())
     _manifest = data
+    _fingerprinted = {value for key, value in data.items() if value != key}
   except Exception:
     pass
 
 
 def get(name):
   return _manifest.get(name, name)
+
+
+def is_fingerprinted(name):
+  """Whether name is an asset name with its hash, whose content never changes."""
+  return name in _fingerprinted
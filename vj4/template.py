@@ -1,17 +1,30 @@
+import logging
+import time
 from os import path
 
 import jinja2
 import jinja2.ext
+import jinja2.nodes
 import jinja2.runtime
 
 import vj4
 import vj4.constant
 import vj4.job
+from vj4.service import fragmentcache
 from vj4.service import staticmanifest
 from vj4.util import json
 from vj4.util import misc
 from vj4.util import options
 
+options.define('template_bytecode_cache_dir', default='',
+               help='Directory of the compiled template cache shared by all processes, which must be '
+                    'owned by this user and not writable by others. Empty to use a private '
+                    'directory of this user in the temporary directory.')
+options.define('template_precompile', default=False,
+               help='Compile all templates at startup, before forking workers.')
+
+_logger = logging.getLogger(__name__)
+
 
 class Undefined(jinja2.runtime.Undefined):
   def __getitem__(self, _):
@@ -21,12 +34,48 @@ class Undefined(jinja2.runtime.Undefined):
     __str__ = jinja2.runtime.Undefined.__call__
 
 
+class FragmentCacheExtension(jinja2.ext.Extension):
+  """Caches the rendered body of {% cache (name, domain_id, ...), ttl_seconds %}...{% endcache %}.
+
+  All values the body depends on other than the documents of the name in the domain, such as the
+  view language, have to be in the key. The fragments are invalidated by fragmentcache.invalidate.
+  """
+  tags = {'cache'}
+
+  def parse(self, parser):
+    lineno = next(parser.stream).lineno
+    args = [parser.parse_expression()]
+    parser.stream.expect('comma')
+    args.append(parser.parse_expression())
+    body = parser.parse_statements(['name:endcache'], drop_needle=True)
+    return jinja2.nodes.CallBlock(self.call_method('_cache', args), [], [], body).set_lineno(lineno)
+
+  def _cache(self, key, ttl_seconds, caller):
+    if options.debug:
+      return caller()
+    value = fragmentcache.get(key)
+    if value is None:
+      value = caller()
+      fragmentcache.set(key, value, ttl_seconds)
+    return value
+
+
 class Environment(jinja2.Environment):
   def __init__(self):
+    # Bytecode found in the cache is executed, so nobody else may be able to write there.
+    if options.template_bytecode_cache_dir:
+      bytecode_cache = jinja2.FileSystemBytecodeCache(
+          misc.make_private_dir(options.template_bytecode_cache_dir))
+    else:
+      # Jinja creates a directory of mode 0700 for this user, and checks its owner.
+      bytecode_cache = jinja2.FileSystemBytecodeCache()
     super(Environment, self).__init__(
         loader=jinja2.FileSystemLoader(path.join(path.dirname(__file__), 'ui/templates')),
-        extensions=[jinja2.ext.with_],
+        extensions=[jinja2.ext.with_, FragmentCacheExtension],
+        # Templates are only checked for changes in debug mode, and never evicted otherwise.
         auto_reload=options.debug,
+        cache_size=400 if options.debug else -1,
+        bytecode_cache=bytecode_cache,
         autoescape=True,
         trim_blocks=True,
         undefined=Undefined)
@@ -43,3 +92,11 @@ class Environment(jinja2.Environment):
     self.filters['format_size'] = misc.format_size
     self.filters['format_seconds'] = misc.format_seconds
     self.filters['base64_encode'] = misc.base64_encode
+
+  def precompile(self):
+    """Load all templates, so that forked workers share them."""
+    start = time.perf_counter()
+    names = self.list_templates(extensions=['html'])
+    for name in names:
+      self.get_template(name)
+    _logger.info('Compiled %d templates in %.3fs', len(names), time.perf_counter() - start)
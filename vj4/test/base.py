@@ -1,4 +1,5 @@
 import asyncio
+import collections
 import functools
 import os
 import unittest
@@ -21,12 +22,16 @@ class DatabaseTestCase(unittest.TestCase):
     db._client = None
     db._db = None
     db.coll.cache_clear()
+    db._secondary_coll.cache_clear()
     db.fs.cache_clear()
     options.db_name = 'unittest_' + str(os.getpid())
     wait(db.init())
     wait(tools.ensure_all_indexes())
 
   def tearDown(self):
+    if db._staleness_check_task:
+      db._staleness_check_task.cancel()
+      db._staleness_check_task = None
     db._client.close()
     wait(db._client.wait_closed())
     pymongo.MongoClient(options.db_host).drop_database(options.db_name)
@@ -76,6 +81,43 @@ class SmallcacheTestCase(BusTestCase):
     super(SmallcacheTestCase, self).tearDown()
 
 
+class RoundTripCounter(object):
+  """Counts database operations issued through db.coll while active."""
+  METHODS = ('find', 'find_one', 'find_one_and_update', 'find_one_and_delete', 'insert_one',
+             'insert_many', 'update_one', 'update_many', 'delete_one', 'delete_many',
+             'aggregate', 'bulk_write', 'count')
+
+  def __init__(self):
+    self.counts = collections.Counter()
+
+  @property
+  def total(self):
+    return sum(self.counts.values())
+
+  def reset(self):
+    self.counts.clear()
+
+  def __enter__(self):
+    self.old_coll = db.coll
+    counter = self
+
+    class CountingCollection(object):
+      def __init__(self, name):
+        self._name = name
+        self._coll = counter.old_coll(name)
+
+      def __getattr__(self, name):
+        if name in counter.METHODS:
+          counter.counts[(self._name, name)] += 1
+        return getattr(self._coll, name)
+
+    db.coll = CountingCollection
+    return self
+
+  def __exit__(self, *exc_info):
+    db.coll = self.old_coll
+
+
 def wrap_coro(coro):
   @functools.wraps(coro)
   def wrapped(*args, **kwargs):
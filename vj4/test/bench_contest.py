@@ -0,0 +1,121 @@
+"""Benchmarks for the contest model.
+
+These are not collected by the unit test runner. Run with:
+
+    python -m unittest vj4.test.bench_contest
+"""
+import datetime
+import random
+import time
+import unittest
+
+from bson import objectid
+
+from vj4 import constant
+from vj4 import db
+from vj4.model import document
+from vj4.model.adaptor import contest
+from vj4.test import base
+
+DOMAIN_ID_DUMMY = 'dummy'
+OWNER_UID = 22
+ATTEND_UID = 44
+PIDS = [777, 778, 779]
+NUM_SUBMISSIONS = 200
+NUM_PARTICIPANTS = 3000
+NUM_JOURNAL_ENTRIES = 50
+NUM_PENALTY_RULES = 100
+
+
+def _make_rdoc(tid, index):
+  rid = objectid.ObjectId()
+  return {'_id': rid, 'tid': tid, 'uid': ATTEND_UID, 'pid': PIDS[index % len(PIDS)],
+          'domain_id': DOMAIN_ID_DUMMY, 'submit_time': rid.generation_time,
+          'status': constant.record.STATUS_ACCEPTED, 'score': index % 101}
+
+
+def _make_journals(begin_at):
+  journals = []
+  for _ in range(NUM_PARTICIPANTS):
+    journal = []
+    for _ in range(NUM_JOURNAL_ENTRIES):
+      submit_time = begin_at + datetime.timedelta(seconds=random.randint(0, 14 * 24 * 3600))
+      journal.append({'rid': objectid.ObjectId.from_datetime(submit_time), 'pid': random.choice(PIDS),
+                      'accept': random.random() < 0.3, 'score': random.randint(0, 100),
+                      'submit_time': submit_time})
+    journals.append(journal)
+  return journals
+
+
+class StatBenchmark(unittest.TestCase):
+  """Time to recompute the stats of all participants of a large contest, per rule."""
+
+  def setUp(self):
+    begin_at = datetime.datetime.utcnow().replace(microsecond=0)
+    self.tdoc = {'pids': PIDS, 'begin_at': begin_at,
+                 'penalty_since': begin_at + datetime.timedelta(days=7),
+                 'penalty_rules': {str(3600 * (i + 1)): 1 - i / NUM_PENALTY_RULES
+                                   for i in range(NUM_PENALTY_RULES)}}
+    self.journals = _make_journals(begin_at)
+
+  def _time(self, func):
+    begin = time.perf_counter()
+    func()
+    return (time.perf_counter() - begin) * 1000
+
+  def test_rules(self):
+    print()
+    for rule in [constant.contest.RULE_OI, constant.contest.RULE_ACM, constant.contest.RULE_ASSIGNMENT]:
+      tdoc = {**self.tdoc, 'rule': rule}
+      stat_func = contest.RULES[rule].stat_func
+      single_ms = self._time(lambda: [stat_func(tdoc, journal) for journal in self.journals])
+      multi_ms = self._time(lambda: contest._stat_multi(tdoc, self.journals))
+      print('rule {0}: {1:.1f} ms per participant loop, {2:.1f} ms in one pass '
+            '({3} participants)'.format(rule, single_ms, multi_ms, NUM_PARTICIPANTS))
+    numpy, contest.numpy = contest.numpy, None
+    try:
+      tdoc = {**self.tdoc, 'rule': constant.contest.RULE_ASSIGNMENT}
+      python_ms = self._time(lambda: contest._stat_multi(tdoc, self.journals))
+    finally:
+      contest.numpy = numpy
+    print('rule {0}: {1:.1f} ms in one pass without numpy'.format(constant.contest.RULE_ASSIGNMENT, python_ms))
+
+
+class UpdateStatusBenchmark(base.BusTestCase):
+  def setUp(self):
+    super(UpdateStatusBenchmark, self).setUp()
+    now = datetime.datetime.utcnow()
+    self.tid = base.wait(contest.add(DOMAIN_ID_DUMMY, document.TYPE_CONTEST, 'bench', 'bench', OWNER_UID,
+                                     constant.contest.RULE_OI, now, now + datetime.timedelta(hours=5),
+                                     PIDS))
+    base.wait(contest.attend(DOMAIN_ID_DUMMY, document.TYPE_CONTEST, self.tid, ATTEND_UID))
+
+  async def _run(self, update):
+    rdocs = [_make_rdoc(self.tid, index) for index in range(NUM_SUBMISSIONS)]
+    await db.coll('record').insert_many(rdocs)
+    counter = base.RoundTripCounter()
+    begin = time.perf_counter()
+    with counter:
+      for rdoc in rdocs:
+        await update(rdoc)
+    elapsed = time.perf_counter() - begin
+    return counter.total / NUM_SUBMISSIONS, elapsed / NUM_SUBMISSIONS * 1000
+
+  @base.wrap_coro
+  async def test_round_trips(self):
+    async def slow(rdoc):
+      await contest.update_status(DOMAIN_ID_DUMMY, self.tid, rdoc['uid'], rdoc['_id'], rdoc['pid'],
+                                  True, rdoc['score'])
+
+    async def fast(rdoc):
+      await contest.update_status_fast(DOMAIN_ID_DUMMY, rdoc, True, rdoc['score'])
+
+    slow_trips, slow_ms = await self._run(slow)
+    fast_trips, fast_ms = await self._run(fast)
+    print('\nupdate_status:      {0:.2f} round trips, {1:.3f} ms per submission'.format(slow_trips, slow_ms))
+    print('update_status_fast: {0:.2f} round trips, {1:.3f} ms per submission'.format(fast_trips, fast_ms))
+    self.assertLess(fast_trips, slow_trips)
+
+
+if __name__ == '__main__':
+  unittest.main()
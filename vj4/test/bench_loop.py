@@ -0,0 +1,88 @@
+"""Benchmarks of request throughput under the default event loop and uvloop.
+
+These are not collected by the unit test runner. Run with:
+
+    python -m unittest vj4.test.bench_loop
+"""
+import asyncio
+import datetime
+import time
+import unittest
+
+import aiohttp
+from aiohttp import web
+
+try:
+  import uvloop
+except ImportError:
+  uvloop = None
+
+from vj4.util import json
+
+NUM_REQUESTS = 5000
+CONCURRENCY = 50
+NUM_ROWS = 50
+
+
+def _make_rdocs():
+  now = datetime.datetime.utcnow()
+  return [{'_id': index, 'uid': 22, 'pid': 1000 + index, 'lang': 'cc', 'status': 1,
+           'score': 100, 'time_ms': 15, 'memory_kb': 1024, 'submit_at': now}
+          for index in range(NUM_ROWS)]
+
+
+async def _handle(request):
+  # Like a JSON record list: a few awaits on the loop, then encoding a small document.
+  await asyncio.sleep(0)
+  return web.Response(body=json.encode({'rdocs': _make_rdocs()}).encode(),
+                      content_type='application/json')
+
+
+async def _run(loop):
+  application = web.Application(loop=loop)
+  application.router.add_get('/', _handle)
+  handler = application.make_handler(access_log=None)
+  server = await loop.create_server(handler, '127.0.0.1', 0)
+  port = server.sockets[0].getsockname()[1]
+  connector = aiohttp.TCPConnector(loop=loop, limit=CONCURRENCY)
+  session = aiohttp.ClientSession(loop=loop, connector=connector)
+  url = 'http://127.0.0.1:{0}/'.format(port)
+  remaining = [NUM_REQUESTS]
+
+  async def client():
+    while remaining[0] > 0:
+      remaining[0] -= 1
+      async with session.get(url) as response:
+        await response.read()
+
+  try:
+    begin = time.perf_counter()
+    await asyncio.gather(*[client() for _ in range(CONCURRENCY)], loop=loop)
+    return NUM_REQUESTS / (time.perf_counter() - begin)
+  finally:
+    session.close()
+    server.close()
+    await server.wait_closed()
+    await handler.shutdown(0)
+
+
+class LoopBenchmark(unittest.TestCase):
+  def _requests_per_second(self, loop):
+    try:
+      return loop.run_until_complete(_run(loop))
+    finally:
+      loop.close()
+
+  def test_throughput(self):
+    print()
+    default_rps = self._requests_per_second(asyncio.new_event_loop())
+    print('asyncio: {0:.0f} requests per second'.format(default_rps))
+    if not uvloop:
+      self.skipTest('uvloop is not installed')
+    uvloop_rps = self._requests_per_second(uvloop.new_event_loop())
+    print('uvloop:  {0:.0f} requests per second ({1:.2f}x)'.format(uvloop_rps,
+                                                               uvloop_rps / default_rps))
+
+
+if __name__ == '__main__':
+  unittest.main()
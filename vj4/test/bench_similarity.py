@@ -0,0 +1,85 @@
+"""Benchmarks for the local similarity test.
+
+These are not collected by the unit test runner. Run with:
+
+    python -m unittest vj4.test.bench_similarity
+"""
+import random
+import time
+import unittest
+
+from vj4.util import winnow
+
+NUM_SUBMISSIONS = 3000
+NUM_COPIES = 30
+NUM_STATEMENTS = 80
+NUM_PAIRWISE = 500
+
+_OPERATORS = ['+', '-', '*', '/', '%', '<<', '>>', '&', '|', '^']
+_STATEMENTS = [
+    '{0} = {1};',
+    '{0} += {1};',
+    'for (int i = 0; i < {1}; i++) {{ {0} = {1}; }}',
+    'if ({0} > {1}) {{ return {0}; }}',
+    'while ({1}) {{ {0}--; }}',
+    'printf("%d\\n", {1});',
+    '{0} = f({0}, {1});',
+    'a[{0}] = {1};',
+]
+
+
+def _make_expression(rand, depth=2):
+  if depth == 0 or rand.random() < 0.3:
+    return rand.choice(['x', 'y', 'z', '1', '2', 'a[i]', 'g(x)'])
+  return '({0} {1} {2})'.format(_make_expression(rand, depth - 1), rand.choice(_OPERATORS),
+                                _make_expression(rand, depth - 1))
+
+
+def _make_submission(rand):
+  lines = []
+  for _ in range(NUM_STATEMENTS):
+    name = 'v{0}'.format(rand.randrange(20))
+    lines.append(rand.choice(_STATEMENTS).format(name, _make_expression(rand)))
+  return 'int main() {{\n{0}\n}}\n'.format('\n'.join(lines))
+
+
+def _rename(text, rand):
+  for i in range(20):
+    text = text.replace('v{0} '.format(i), 'w{0} '.format(rand.randrange(20)))
+  return text
+
+
+class SimilarityBenchmark(unittest.TestCase):
+  def setUp(self):
+    rand = random.Random(0)
+    self.texts = [_make_submission(rand) for _ in range(NUM_SUBMISSIONS - NUM_COPIES)]
+    self.copied = []
+    for _ in range(NUM_COPIES):
+      source = rand.randrange(len(self.texts))
+      self.copied.append((source, len(self.texts)))
+      self.texts.append(_rename(self.texts[source], rand))
+
+  def test_match(self):
+    begin = time.perf_counter()
+    documents = [(i, winnow.fingerprint(text, 'c')) for i, text in enumerate(self.texts)]
+    fingerprint_ms = (time.perf_counter() - begin) * 1000
+    begin = time.perf_counter()
+    pairs, index = winnow.match_all(documents)
+    match_ms = (time.perf_counter() - begin) * 1000
+    begin = time.perf_counter()
+    sets = [set(fps) for _, fps in documents[:NUM_PAIRWISE]]
+    for i in range(len(sets)):
+      for j in range(i):
+        len(sets[i] & sets[j])
+    pairwise_ms = (time.perf_counter() - begin) * 1000 * (NUM_SUBMISSIONS / NUM_PAIRWISE) ** 2
+    print('\n{0} submissions: fingerprint {1:.0f} ms, inverted index {2:.0f} ms, '
+          'pairwise comparison {3:.0f} ms (extrapolated)'.format(
+              NUM_SUBMISSIONS, fingerprint_ms, match_ms, pairwise_ms))
+    top = {(a, b) for a, b, shared in pairs
+           if max(index.similarity(a, b, shared)) >= 0.5}
+    for pair in self.copied:
+      self.assertIn(pair, top)
+
+
+if __name__ == '__main__':
+  unittest.main()
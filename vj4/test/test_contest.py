@@ -5,9 +5,11 @@ import unittest
 from bson import objectid
 
 from vj4 import constant
+from vj4 import db
 from vj4 import error
 from vj4.model import document
 from vj4.model.adaptor import contest
+from vj4.service import fragmentcache
 from vj4.test import base
 
 
@@ -127,6 +129,13 @@ class AcmRuleTest(unittest.TestCase):
     self.assertEqual(stats['time'], 0)
     self.assertEqual(stats['detail'], [])
 
+  def test_inc(self):
+    stats = contest._acm_inc_stat(TDOC, {}, [SUBMIT_777_NAC], SUBMIT_777_NAC)
+    self.assertEqual(stats, contest._acm_stat(TDOC, [SUBMIT_777_NAC]))
+    stats = contest._acm_inc_stat(TDOC, stats, [SUBMIT_777_AC_LATE], SUBMIT_777_AC_LATE)
+    self.assertEqual(stats, contest._acm_stat(TDOC, [SUBMIT_777_NAC, SUBMIT_777_AC_LATE]))
+    self.assertIsNone(contest._acm_inc_stat(TDOC, stats, [SUBMIT_777_AC_LATE], SUBMIT_777_AC))
+
 
 class AssignmentRuleTest(unittest.TestCase):
   def test_zero(self):
@@ -227,7 +236,7 @@ class AssignmentRuleTest(unittest.TestCase):
     self.assertEqual(stats['detail'], [])
 
 
-class OuterTest(base.DatabaseTestCase):
+class OuterTest(base.BusTestCase):
   @base.wrap_coro
   async def test_add_get(self):
     begin_at = datetime.datetime.utcnow()
@@ -245,8 +254,79 @@ class OuterTest(base.DatabaseTestCase):
     self.assertEqual(tdocs[0]['title'], TITLE)
     self.assertFalse('content' in tdocs[0])
 
+  @base.wrap_coro
+  async def test_journal_compaction(self):
+    tid = await contest.add(DOMAIN_ID_DUMMY, document.TYPE_CONTEST, TITLE, CONTENT, OWNER_UID,
+                            constant.contest.RULE_ACM, NOW, NOW + datetime.timedelta(seconds=22), [777, 778])
+    await contest.attend(DOMAIN_ID_DUMMY, document.TYPE_CONTEST, tid, ATTEND_UID)
+    max_entries = contest.options.contest_journal_max_entries
+    contest.options.contest_journal_max_entries = 4
+    try:
+      for index, submit in enumerate([SUBMIT_777_NAC, SUBMIT_777_AC_LATE, SUBMIT_778_AC, SUBMIT_778_AC_LATE,
+                                      SUBMIT_777_NAC_LATE, SUBMIT_780_AC]):
+        rdoc = {'_id': submit['rid'], 'tid': tid, 'uid': ATTEND_UID, 'pid': submit['pid']}
+        tsdoc = await contest.update_status_fast(DOMAIN_ID_DUMMY, rdoc, submit['accept'], submit['score'])
+        self.assertNotIn('journal', tsdoc)
+    finally:
+      contest.options.contest_journal_max_entries = max_entries
+    self.assertEqual(tsdoc['accept'], 2)
+    self.assertEqual([j['rid'] for j in tsdoc['latest']],
+                     [SUBMIT_777_NAC_LATE['rid'], SUBMIT_778_AC_LATE['rid'], SUBMIT_780_AC['rid']])
+    tsdoc = await contest.get_status(DOMAIN_ID_DUMMY, document.TYPE_CONTEST, tid, ATTEND_UID)
+    self.assertEqual(tsdoc['journal_archived'], 3)
+    self.assertEqual(len(tsdoc['journal']), 3)
+    journal = await contest.get_status_journal(DOMAIN_ID_DUMMY, document.TYPE_CONTEST, tid, tsdoc)
+    self.assertEqual(len(journal), 6)
+    await contest.recalc_status(DOMAIN_ID_DUMMY, document.TYPE_CONTEST, tid)
+    recalc_tsdoc = await contest.get_status(DOMAIN_ID_DUMMY, document.TYPE_CONTEST, tid, ATTEND_UID)
+    for key in ['accept', 'time', 'detail', 'latest']:
+      self.assertEqual(recalc_tsdoc[key], tsdoc[key])
+    self.assertEqual(len(recalc_tsdoc['journal']), 3)
+
+  @base.wrap_coro
+  async def test_gradebook(self):
+    tids = []
+    for _ in range(2):
+      tid = await contest.add(DOMAIN_ID_DUMMY, document.TYPE_HOMEWORK, TITLE, CONTENT, OWNER_UID,
+                              constant.contest.RULE_ASSIGNMENT, NOW, NOW + datetime.timedelta(seconds=22),
+                              [777, 778], penalty_since=NOW + datetime.timedelta(seconds=20), penalty_rules={})
+      await contest.attend(DOMAIN_ID_DUMMY, document.TYPE_HOMEWORK, tid, ATTEND_UID)
+      tids.append(tid)
+    for tid, submit in [(tids[0], SUBMIT_777_AC), (tids[0], SUBMIT_778_AC), (tids[1], SUBMIT_777_NAC)]:
+      rdoc = {'_id': submit['rid'], 'tid': tid, 'uid': ATTEND_UID, 'pid': submit['pid']}
+      await contest.update_status_fast(DOMAIN_ID_DUMMY, rdoc, submit['accept'], submit['score'])
+    tdocs, gdocs = await contest.get_gradebook(DOMAIN_ID_DUMMY)
+    self.assertEqual([tdoc['doc_id'] for tdoc in tdocs], tids)
+    gdocs = await gdocs.to_list()
+    self.assertEqual(len(gdocs), 1)
+    self.assertEqual(gdocs[0]['scores'], {str(tids[0]): 55, str(tids[1]): 44})
+    await contest.rebuild_gradebook(DOMAIN_ID_DUMMY)
+    _, rebuilt_gdocs = await contest.get_gradebook(DOMAIN_ID_DUMMY)
+    self.assertEqual((await rebuilt_gdocs.to_list())[0]['scores'], gdocs[0]['scores'])
 
-class InnerTest(base.DatabaseTestCase):
+  @base.wrap_coro
+  async def test_gradebook_built_lazily(self):
+    tid = await contest.add(DOMAIN_ID_DUMMY, document.TYPE_HOMEWORK, TITLE, CONTENT, OWNER_UID,
+                            constant.contest.RULE_ASSIGNMENT, NOW, NOW + datetime.timedelta(seconds=22),
+                            [777, 778], penalty_since=NOW + datetime.timedelta(seconds=20), penalty_rules={})
+    await contest.attend(DOMAIN_ID_DUMMY, document.TYPE_HOMEWORK, tid, ATTEND_UID)
+    rdoc = {'_id': SUBMIT_777_AC['rid'], 'tid': tid, 'uid': ATTEND_UID, 'pid': SUBMIT_777_AC['pid']}
+    await contest.update_status_fast(DOMAIN_ID_DUMMY, rdoc, SUBMIT_777_AC['accept'], SUBMIT_777_AC['score'])
+    # A homework created before the gradebook was kept, and a stale row.
+    await db.coll('gradebook').delete_many({})
+    await db.coll('gradebook').insert_one({'domain_id': DOMAIN_ID_DUMMY, 'doc_type': document.TYPE_HOMEWORK,
+                                           'uid': OWNER_UID, 'scores': {str(tid): 100}})
+    await db.coll('document').update_one({'domain_id': DOMAIN_ID_DUMMY, 'doc_id': tid},
+                                         {'$unset': {'gradebook_built': ''}})
+    _, gdocs = await contest.get_gradebook(DOMAIN_ID_DUMMY)
+    gdocs = await gdocs.to_list()
+    self.assertEqual([gdoc['uid'] for gdoc in gdocs], [ATTEND_UID])
+    self.assertEqual(gdocs[0]['scores'], {str(tid): 22})
+    tdoc = await document.get(DOMAIN_ID_DUMMY, document.TYPE_HOMEWORK, tid)
+    self.assertTrue(tdoc['gradebook_built'])
+
+
+class InnerTest(base.BusTestCase):
   def setUp(self):
     super(InnerTest, self).setUp()
     begin_at = NOW
@@ -273,6 +353,45 @@ class InnerTest(base.DatabaseTestCase):
     self.assertEqual(len(tsdocs), 1)
     self.assertEqual(tsdocs[0]['uid'], ATTEND_UID)
 
+  @base.wrap_coro
+  async def test_attend_invalidates_scoreboard(self):
+    key = (contest.scoreboard_fragment_name(self.tid), DOMAIN_ID_DUMMY, 'en')
+    fragmentcache.set(key, '<table></table>')
+    try:
+      await contest.attend(DOMAIN_ID_DUMMY, document.TYPE_CONTEST, self.tid, ATTEND_UID)
+      self.assertIsNone(fragmentcache.get(key))
+    finally:
+      fragmentcache.uninit()
+
+  @base.wrap_coro
+  async def test_get_cached(self):
+    hits = contest.get_cache_stats()['hits']
+    await contest.get(DOMAIN_ID_DUMMY, document.TYPE_CONTEST, self.tid)
+    tdoc = await contest.get(DOMAIN_ID_DUMMY, document.TYPE_CONTEST, self.tid)
+    self.assertEqual(contest.get_cache_stats()['hits'], hits + 1)
+    self.assertEqual(tdoc['title'], TITLE)
+    with self.assertRaises(error.DocumentNotFoundError):
+      await contest.get(DOMAIN_ID_DUMMY, document.TYPE_HOMEWORK, self.tid)
+    await contest.edit(DOMAIN_ID_DUMMY, document.TYPE_CONTEST, self.tid, title='new_title')
+    tdoc = await contest.get(DOMAIN_ID_DUMMY, document.TYPE_CONTEST, self.tid)
+    self.assertEqual(tdoc['title'], 'new_title')
+
+  @base.wrap_coro
+  async def test_prewarm(self):
+    await contest.attend(DOMAIN_ID_DUMMY, document.TYPE_CONTEST, self.tid, ATTEND_UID)
+    await contest._prewarm_local(DOMAIN_ID_DUMMY, document.TYPE_CONTEST, self.tid)
+    with base.RoundTripCounter() as counter:
+      tdoc = await contest.get(DOMAIN_ID_DUMMY, document.TYPE_CONTEST, self.tid)
+      self.assertTrue(await contest.is_attended(DOMAIN_ID_DUMMY, document.TYPE_CONTEST, self.tid,
+                                                ATTEND_UID))
+      self.assertEqual(counter.total, 0)
+      self.assertFalse(await contest.is_attended(DOMAIN_ID_DUMMY, document.TYPE_CONTEST, self.tid,
+                                                 OWNER_UID))
+    self.assertEqual(tdoc['attend'], 1)
+    await contest.attend(DOMAIN_ID_DUMMY, document.TYPE_CONTEST, self.tid, OWNER_UID)
+    self.assertTrue(await contest.is_attended(DOMAIN_ID_DUMMY, document.TYPE_CONTEST, self.tid,
+                                              OWNER_UID))
+
   @base.wrap_coro
   async def test_attend_twice(self):
     await contest.attend(DOMAIN_ID_DUMMY, document.TYPE_CONTEST, self.tid, ATTEND_UID)
@@ -305,6 +424,24 @@ class InnerTest(base.DatabaseTestCase):
     self.assertEqual(tsdoc['detail'][2]['time'], 4)
     self.assertEqual(tsdoc['detail'][3]['time'], 5)
 
+  @base.wrap_coro
+  async def test_update_status_fast(self):
+    await contest.attend(DOMAIN_ID_DUMMY, document.TYPE_CONTEST, self.tid, ATTEND_UID)
+    for submit in [SUBMIT_777_AC, SUBMIT_777_NAC, SUBMIT_778_AC]:
+      rdoc = {'_id': submit['rid'], 'tid': self.tid, 'uid': ATTEND_UID, 'pid': submit['pid']}
+      tsdoc = await contest.update_status_fast(DOMAIN_ID_DUMMY, rdoc, submit['accept'], submit['score'])
+    self.assertEqual(tsdoc['score'], 99)
+    self.assertEqual(len(tsdoc['detail']), 3)
+    tsdoc = await contest.get_status(DOMAIN_ID_DUMMY, document.TYPE_CONTEST, self.tid, ATTEND_UID)
+    self.assertEqual(len(tsdoc['journal']), 3)
+    self.assertEqual(tsdoc['journal'][2]['rid'], SUBMIT_778_AC['rid'])
+
+  @base.wrap_coro
+  async def test_update_status_fast_none(self):
+    rdoc = {'_id': SUBMIT_777_AC['rid'], 'tid': self.tid, 'uid': ATTEND_UID, 'pid': 777}
+    with self.assertRaises(error.ContestNotAttendedError):
+      await contest.update_status_fast(DOMAIN_ID_DUMMY, rdoc, True, 22)
+
   @base.wrap_coro
   async def test_recalc_status(self):
     await contest.attend(DOMAIN_ID_DUMMY, document.TYPE_CONTEST, self.tid, ATTEND_UID)
@@ -352,5 +489,102 @@ class InnerTest(base.DatabaseTestCase):
     del tsdoc_old['rev']
     self.assertEqual(tsdoc, tsdoc_old)
 
+
+class UpdateStatusFastTest(base.BusTestCase):
+  # Sorted by rid, as the judge usually reports them.
+  SUBMITS = [SUBMIT_777_AC, SUBMIT_777_NAC, SUBMIT_778_AC, SUBMIT_780_AC, SUBMIT_777_AC_LATE,
+             SUBMIT_778_AC_LATE, SUBMIT_777_NAC_LATE]
+
+  async def _add(self, doc_type, rule, **kwargs):
+    tid = await contest.add(DOMAIN_ID_DUMMY, doc_type, TITLE, CONTENT, OWNER_UID, rule,
+                            NOW, NOW + datetime.timedelta(seconds=22), [777, 778, 779], **kwargs)
+    for uid in [ATTEND_UID, OWNER_UID]:
+      await contest.attend(DOMAIN_ID_DUMMY, doc_type, tid, uid)
+    for submit in self.SUBMITS:
+      await db.coll('record').insert_one({'_id': submit['rid'], 'tid': tid, 'pid': submit['pid']})
+    return tid
+
+  async def _update_status_fast(self, tid, submit):
+    rdoc = {'_id': submit['rid'], 'tid': tid, 'uid': ATTEND_UID, 'pid': submit['pid']}
+    return await contest.update_status_fast(DOMAIN_ID_DUMMY, rdoc, submit['accept'], submit['score'])
+
+  async def _update_status(self, tid, submit):
+    return await contest.update_status(DOMAIN_ID_DUMMY, tid, OWNER_UID, submit['rid'], submit['pid'],
+                                       submit['accept'], submit['score'])
+
+  async def _assert_same_status(self, doc_type, tid, fast_tsdoc, tsdoc):
+    """Compares the stats of the fast path with the ones update_status computes from the journal."""
+    tdoc = await contest.get(DOMAIN_ID_DUMMY, doc_type, tid)
+    journal = await contest.get_status_journal(DOMAIN_ID_DUMMY, doc_type, tid, tsdoc)
+    for key in contest.RULES[tdoc['rule']].stat_func(tdoc, journal):
+      self.assertEqual(fast_tsdoc[key], tsdoc[key], key)
+    self.assertEqual(fast_tsdoc['latest'], tsdoc['latest'])
+    fast_tsdoc = await contest.get_status(DOMAIN_ID_DUMMY, doc_type, tid, ATTEND_UID)
+    self.assertEqual(fast_tsdoc['journal'], tsdoc['journal'])
+
+  async def _check_rule(self, doc_type, rule, **kwargs):
+    tid = await self._add(doc_type, rule, **kwargs)
+    for submit in self.SUBMITS:
+      fast_tsdoc = await self._update_status_fast(tid, submit)
+      self.assertNotIn('journal', fast_tsdoc)
+      tsdoc = await self._update_status(tid, submit)
+      await self._assert_same_status(doc_type, tid, fast_tsdoc, tsdoc)
+
+  @base.wrap_coro
+  async def test_oi(self):
+    await self._check_rule(document.TYPE_CONTEST, constant.contest.RULE_OI)
+
+  @base.wrap_coro
+  async def test_acm(self):
+    await self._check_rule(document.TYPE_CONTEST, constant.contest.RULE_ACM)
+
+  @base.wrap_coro
+  async def test_assignment(self):
+    await self._check_rule(document.TYPE_HOMEWORK, constant.contest.RULE_ASSIGNMENT,
+                           penalty_since=ASSDOC['penalty_since'], penalty_rules=ASSDOC['penalty_rules'])
+
+  @base.wrap_coro
+  async def test_conflict(self):
+    tid = await self._add(document.TYPE_CONTEST, constant.contest.RULE_ACM)
+    await self._update_status_fast(tid, SUBMIT_777_NAC)
+    await self._update_status(tid, SUBMIT_777_NAC)
+    rev_push_set_status = document.rev_push_set_status
+
+    async def racing_rev_push_set_status(domain_id, doc_type, doc_id, uid, *args, **kwargs):
+      # A parallel update of the same status document lands first.
+      await db.coll('document.status').update_one({'domain_id': domain_id, 'doc_type': doc_type,
+                                                   'doc_id': doc_id, 'uid': uid}, {'$inc': {'rev': 1}})
+      return await rev_push_set_status(domain_id, doc_type, doc_id, uid, *args, **kwargs)
+
+    document.rev_push_set_status = racing_rev_push_set_status
+    try:
+      fast_tsdoc = await self._update_status_fast(tid, SUBMIT_778_AC)
+    finally:
+      document.rev_push_set_status = rev_push_set_status
+    # The rev based fallback returns the journal.
+    self.assertEqual(len(fast_tsdoc['journal']), 2)
+    tsdoc = await self._update_status(tid, SUBMIT_778_AC)
+    await self._assert_same_status(document.TYPE_CONTEST, tid, fast_tsdoc, tsdoc)
+
+  @base.wrap_coro
+  async def test_legacy(self):
+    tid = await self._add(document.TYPE_CONTEST, constant.contest.RULE_ACM)
+    for submit in [SUBMIT_777_NAC, SUBMIT_778_AC]:
+      await self._update_status_fast(tid, submit)
+      await self._update_status(tid, submit)
+    # A status document written before the latest entries were kept.
+    await db.coll('document.status').update_one({'domain_id': DOMAIN_ID_DUMMY, 'doc_id': tid,
+                                                 'uid': ATTEND_UID}, {'$unset': {'latest': ''}})
+    fast_tsdoc = await self._update_status_fast(tid, SUBMIT_777_AC_LATE)
+    self.assertEqual(len(fast_tsdoc['journal']), 3)
+    tsdoc = await self._update_status(tid, SUBMIT_777_AC_LATE)
+    await self._assert_same_status(document.TYPE_CONTEST, tid, fast_tsdoc, tsdoc)
+    # The latest entries are kept again, so the next submission takes the fast path.
+    fast_tsdoc = await self._update_status_fast(tid, SUBMIT_778_AC_LATE)
+    self.assertNotIn('journal', fast_tsdoc)
+    tsdoc = await self._update_status(tid, SUBMIT_778_AC_LATE)
+    await self._assert_same_status(document.TYPE_CONTEST, tid, fast_tsdoc, tsdoc)
+
+
 if __name__ == '__main__':
   unittest.main()
@@ -0,0 +1,39 @@
+import unittest
+
+from vj4.service import fragmentcache
+from vj4.test import base
+
+DOMAIN_ID = 'dummy'
+
+
+class OfflineTest(unittest.TestCase):
+  def tearDown(self):
+    fragmentcache.uninit()
+
+  def test_get_set(self):
+    self.assertIsNone(fragmentcache.get(('nodes', DOMAIN_ID, 'en')))
+    fragmentcache.set(('nodes', DOMAIN_ID, 'en'), '<ul></ul>')
+    self.assertEqual(fragmentcache.get(('nodes', DOMAIN_ID, 'en')), '<ul></ul>')
+    self.assertIsNone(fragmentcache.get(('nodes', DOMAIN_ID, 'zh_CN')))
+
+
+class OnlineTest(base.BusTestCase):
+  def setUp(self):
+    super(OnlineTest, self).setUp()
+    fragmentcache.init()
+
+  def tearDown(self):
+    fragmentcache.uninit()
+    super(OnlineTest, self).tearDown()
+
+  @base.wrap_coro
+  async def test_invalidate(self):
+    fragmentcache.set(('nodes', DOMAIN_ID, 'en'), '<ul></ul>')
+    fragmentcache.set(('nodes', 'other', 'en'), '<ol></ol>')
+    await fragmentcache.invalidate('nodes', DOMAIN_ID)
+    self.assertIsNone(fragmentcache.get(('nodes', DOMAIN_ID, 'en')))
+    self.assertEqual(fragmentcache.get(('nodes', 'other', 'en')), '<ol></ol>')
+
+
+if __name__ == '__main__':
+  unittest.main()
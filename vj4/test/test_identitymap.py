@@ -0,0 +1,52 @@
+import asyncio
+import unittest
+
+from vj4.util import identitymap
+
+wait = asyncio.get_event_loop().run_until_complete
+
+
+class Test(unittest.TestCase):
+  def setUp(self):
+    self.loads = 0
+
+  async def load(self):
+    self.loads += 1
+    await asyncio.sleep(0)
+    return {'_id': 7, 'title': 'dummy'}
+
+  async def load_none(self):
+    self.loads += 1
+    raise KeyError(7)
+
+  def test_once(self):
+    idmap = identitymap.IdentityMap()
+    doc1, doc2 = wait(asyncio.gather(idmap.get(('problem', 'dummy', 7), self.load),
+                                     idmap.get(('problem', 'dummy', 7), self.load)))
+    doc3 = wait(idmap.get(('problem', 'dummy', 7), self.load))
+    self.assertEqual(self.loads, 1)
+    self.assertEqual(idmap.reads, 1)
+    self.assertEqual(idmap.avoided_reads, 2)
+    self.assertEqual(doc1, doc3)
+    doc1['psdoc'] = None
+    self.assertNotIn('psdoc', doc2)
+
+  def test_error(self):
+    idmap = identitymap.IdentityMap()
+    with self.assertRaises(KeyError):
+      wait(idmap.get(('problem', 'dummy', 7), self.load_none))
+    self.assertNotIn(('problem', 'dummy', 7), idmap)
+    self.assertEqual(wait(idmap.get(('problem', 'dummy', 7), self.load))['title'], 'dummy')
+    self.assertEqual(self.loads, 2)
+
+  def test_set(self):
+    idmap = identitymap.IdentityMap()
+    idmap.set(('record', None, 7), {'_id': 7})
+    self.assertEqual(wait(idmap.get(('record', None, 7), self.load)), {'_id': 7})
+    self.assertEqual(self.loads, 0)
+    idmap.discard(('record', None, 7))
+    self.assertNotIn(('record', None, 7), idmap)
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -248,3 +248,15 @@ class DifficultyTest(unittest.TestCase):
   def test_integrate(self):
     for x in range(1000):
       self.assertEqual(job.difficulty._integrate(x), job.difficulty._integrate_direct(x))
+
+  def test_integrate_converged(self):
+    for x in (1999, 2000, 10 ** 4, 10 ** 6):
+      self.assertEqual(job.difficulty._integrate(x), job.difficulty._integrate_direct(x))
+    self.assertLess(len(job.difficulty._sums), 1000)
+
+  def test_difficulty_algorithm(self):
+    for num_submit in (1, 2, 3, 10, 99, 100, 1000, 12345):
+      s = job.difficulty._integrate_direct(num_submit)
+      for num_accept in range(0, num_submit + 1, max(1, num_submit // 20)):
+        expected = max(1, int(10.0 - 1.30 * s * 10.0 * num_accept / num_submit))
+        self.assertEqual(job.difficulty.difficulty_altorithm(num_submit, num_accept), expected)
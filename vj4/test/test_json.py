@@ -0,0 +1,53 @@
+import asyncio
+import datetime
+import unittest
+
+from bson import objectid
+
+from vj4.util import json
+from vj4.util import options
+
+wait = asyncio.get_event_loop().run_until_complete
+
+DOCS = [
+  {'_id': objectid.ObjectId(), 'uid': 22, 'lang': 'cc', 'title': '中文 "quoted" </script>\n',
+   'submit_at': datetime.datetime(2017, 3, 4, 5, 6, 7, 890000), 'score': 1.5, 'hidden': False,
+   'detail': [{'pid': 1000, 'accept': True}, (1, 2)], 'none': None},
+  {1000: {'status': 1}, 1001: {'status': 2}},
+  {'big': 2 ** 70},
+  {'aware': datetime.datetime(2017, 1, 1, tzinfo=datetime.timezone(datetime.timedelta(hours=8)))},
+]
+
+
+class Test(unittest.TestCase):
+  def test_encode(self):
+    doc = DOCS[0]
+    self.assertEqual(json.decode(json.encode(doc)),
+                     {**doc, '_id': str(doc['_id']), 'submit_at': 1488603967000,
+                      'detail': [{'pid': 1000, 'accept': True}, [1, 2]]})
+    self.assertEqual(json.encode_bytes(doc), json.encode(doc).encode())
+
+  @unittest.skipUnless(json.orjson, 'orjson is not installed')
+  def test_orjson(self):
+    for doc in DOCS:
+      self.assertEqual(json._encode_orjson(doc), json._encode_json(doc))
+      self.assertEqual(json._encode_bytes_orjson(doc), json._encode_bytes_json(doc))
+    for doc in [{'set': {1}}, {objectid.ObjectId(): 1}, {'date': datetime.date.today()}]:
+      self.assertRaises(TypeError, json._encode_json, doc)
+      self.assertRaises(TypeError, json._encode_orjson, doc)
+
+  def test_is_large(self):
+    self.assertFalse(json.is_large(DOCS[0], 1024))
+    self.assertTrue(json.is_large({'html': 'x' * 1024}, 1024))
+    self.assertTrue(json.is_large({'rdocs': [DOCS[0]] * 100}, 1024))
+    self.assertGreater(len(json.encode({'rdocs': [DOCS[0]] * 100})), 1024)
+
+  def test_encode_bytes_async(self):
+    doc = {'html': 'x' * options.json_executor_min_size, 'rdocs': [DOCS[0]] * 100}
+    self.assertTrue(json.is_large(doc))
+    self.assertEqual(wait(json.encode_bytes_async(doc)), json.encode_bytes(doc))
+    self.assertEqual(wait(json.encode_bytes_async(DOCS[0])), json.encode_bytes(DOCS[0]))
+
+
+if __name__ == '__main__':
+  unittest.main()
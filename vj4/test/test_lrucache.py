@@ -0,0 +1,51 @@
+import time
+import unittest
+
+from vj4.util import lrucache
+
+
+class Test(unittest.TestCase):
+  def test_none(self):
+    cache = lrucache.LruCache(4)
+    self.assertIsNone(cache.get(0))
+    self.assertEqual(cache.misses, 1)
+
+  def test_evict(self):
+    cache = lrucache.LruCache(2)
+    cache.set(0, 7)
+    cache.set(1, 0)
+    self.assertEqual(cache.get(0), 7)
+    cache.set(2, 5)
+    self.assertEqual(cache.get(0), 7)
+    self.assertIsNone(cache.get(1))
+    self.assertEqual(cache.get(2), 5)
+    self.assertEqual(cache.hits, 3)
+    self.assertEqual(cache.misses, 1)
+
+  def test_ttl(self):
+    cache = lrucache.LruCache(4, 0.01)
+    cache.set(0, 7)
+    self.assertIn(0, cache)
+    time.sleep(0.02)
+    self.assertNotIn(0, cache)
+    self.assertEqual(len(cache), 0)
+
+  def test_pop(self):
+    cache = lrucache.LruCache(4)
+    cache.set(0, None)
+    self.assertIn(0, cache)
+    cache.pop(0)
+    self.assertNotIn(0, cache)
+    self.assertIsNone(cache.pop(0))
+
+  def test_values(self):
+    cache = lrucache.LruCache(4)
+    cache.set(0, 7)
+    cache.set(1, 5, 0.01)
+    time.sleep(0.02)
+    self.assertListEqual(list(cache.values()), [7])
+    self.assertEqual(cache.hits + cache.misses, 0)
+
+
+if __name__ == '__main__':
+  unittest.main()
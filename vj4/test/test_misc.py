@@ -1,5 +1,10 @@
+import asyncio
+import os
+import stat
+import tempfile
 import unittest
 
+from vj4.test import base
 from vj4.util import misc
 
 
@@ -11,6 +16,44 @@ class Test(unittest.TestCase):
     self.assertListEqual(misc.dedupe(['b','a','b','c','b']),['b','a','c'])
     self.assertListEqual(misc.dedupe([0]),[0])
 
+  def test_markdown_cache(self):
+    hits = misc.get_markdown_stats()['hits']
+    html = misc.markdown('# test_markdown_cache\n\n*dummy*')
+    self.assertIn('<em>dummy</em>', html)
+    self.assertEqual(misc.markdown('# test_markdown_cache\n\n*dummy*'), html)
+    self.assertEqual(misc.get_markdown_stats()['hits'], hits + 1)
+    self.assertGreater(misc.get_markdown_stats()['bytes'], 0)
+
+  @base.wrap_coro
+  async def test_prefetch(self):
+    running = [0, 0]
+
+    async def double(i):
+      running[0] += 1
+      running[1] = max(running[1], running[0])
+      await asyncio.sleep(0.001 * (5 - i % 5))
+      running[0] -= 1
+      return i * 2
+
+    results = [r async for r in misc.prefetch(double, range(20), 4)]
+    self.assertListEqual(results, [i * 2 for i in range(20)])
+    self.assertEqual(running[1], 4)
+
+  def test_make_private_dir(self):
+    with tempfile.TemporaryDirectory() as parent_dir:
+      dir_path = os.path.join(parent_dir, 'cache')
+      self.assertEqual(misc.make_private_dir(dir_path), dir_path)
+      self.assertEqual(stat.S_IMODE(os.stat(dir_path).st_mode) & 0o077, 0)
+      self.assertEqual(misc.make_private_dir(dir_path), dir_path)
+      os.chmod(dir_path, 0o777)
+      self.assertRaises(PermissionError, misc.make_private_dir, dir_path)
+      os.chmod(dir_path, 0o755)
+      self.assertEqual(misc.make_private_dir(dir_path), dir_path)
+      self.assertRaises(PermissionError, misc.make_private_dir, dir_path, 0o077)
+      link_path = os.path.join(parent_dir, 'link')
+      os.symlink(dir_path, link_path)
+      self.assertRaises(PermissionError, misc.make_private_dir, link_path)
+
 
 if __name__ == '__main__':
   unittest.main()
@@ -1,3 +1,4 @@
+import asyncio
 import datetime
 import hashlib
 import time
@@ -17,6 +18,8 @@ from vj4.model import opcount
 from vj4.model import system
 from vj4.model import user
 from vj4.test import base
+from vj4.util import options
+from vj4.util import tools
 
 CONTENT = 'dummy_content'
 CONTENT2 = 'dummy_dummy'
@@ -45,6 +48,34 @@ class SystemTest(base.DatabaseTestCase):
     self.assertEqual(await system.inc_user_counter(), 2)
     self.assertEqual(await system.inc_user_counter(), 3)
 
+  @base.wrap_coro
+  async def test_index_fingerprint(self):
+    fingerprint = await system.get_index_fingerprint()
+    self.assertEqual(fingerprint, tools.get_index_fingerprint(tools._index_modules()))
+    await system.set_index_fingerprint('stale')
+    await tools.ensure_all_indexes_if_changed()
+    self.assertEqual(await system.get_index_fingerprint(), fingerprint)
+
+
+class DbTest(base.DatabaseTestCase):
+  def test_stale_coll_primary(self):
+    if options.db_secondary_host:
+      self.skipTest('Secondary configured.')
+    self.assertIs(db.stale_coll('record'), db.coll('record'))
+
+  @unittest.skipUnless(options.db_secondary_host, 'Requires a secondary, see --db-secondary-host.')
+  @base.wrap_coro
+  async def test_stale_coll_secondary(self):
+    self.assertGreaterEqual(await db.get_secondary_lag(), 0.0)
+    self.assertEqual(db.stale_coll('record') is db._secondary_coll('record'), db._secondary_fresh)
+    rid = (await db.coll('record').insert_one({'hidden': False})).inserted_id
+    for _ in range(options.db_max_staleness_seconds * 10):
+      if await db.stale_coll('record').find_one({'_id': rid}):
+        break
+      await asyncio.sleep(0.1)
+    else:
+      self.fail('Record not replicated within max staleness.')
+
 
 class UserTest(base.DatabaseTestCase):
   @base.wrap_coro
@@ -326,6 +357,16 @@ class DomainTest(base.DatabaseTestCase):
     self.assertTrue(FOO_ROLE not in ddoc['roles'])
     self.assertEqual(ddoc['roles'][BAR_ROLE], 666)
 
+  @base.wrap_coro
+  async def test_get_all_roles(self):
+    await domain.add(DOMAIN_ID, OWNER_UID, name=DOMAIN_NAME)
+    all_roles = domain.get_all_roles(await domain.get(DOMAIN_ID))
+    self.assertIs(domain.get_all_roles(await domain.get(DOMAIN_ID)), all_roles)
+    self.assertEqual(all_roles[builtin.ROLE_ROOT], builtin.PERM_ALL)
+    await domain.set_roles(DOMAIN_ID, {FOO_ROLE: 777})
+    all_roles = domain.get_all_roles(await domain.get(DOMAIN_ID))
+    self.assertEqual(all_roles[FOO_ROLE], 777)
+
 
 class FsTest(base.DatabaseTestCase):
   CONTENT = b'dummy_content'
@@ -0,0 +1,65 @@
+import unittest
+
+from aiohttp import web
+
+from vj4.service import pagecache
+from vj4.test import base
+
+DOMAIN_ID = 'dummy'
+
+
+def _make_response(body):
+  response = web.Response(body=body, content_type='text/html')
+  response.headers['Vary'] = 'Accept-Encoding'
+  return response
+
+
+class OfflineTest(unittest.TestCase):
+  def tearDown(self):
+    pagecache.uninit()
+
+  def test_get_set(self):
+    key = pagecache.get_key(DOMAIN_ID, ('problem',), '/p?page=1', False)
+    self.assertIsNone(pagecache.get(key))
+    pagecache.set(key, _make_response(b'<ul></ul>'))
+    response = pagecache.get(key)
+    self.assertEqual(response.status, 200)
+    self.assertEqual(response.body, b'<ul></ul>')
+    self.assertEqual(response.content_type, 'text/html')
+    self.assertNotIn('Vary', response.headers)
+    self.assertIsNot(pagecache.get(key), response)
+
+  def test_get_key(self):
+    key = pagecache.get_key(DOMAIN_ID, ('problem',), '/p?page=1', False)
+    self.assertEqual(pagecache.get_key(DOMAIN_ID, ('problem',), '/p?page=1', False), key)
+    self.assertNotEqual(pagecache.get_key(DOMAIN_ID, ('problem',), '/p?page=2', False), key)
+    self.assertNotEqual(pagecache.get_key(DOMAIN_ID, ('problem',), '/p?page=1', True), key)
+    self.assertNotEqual(pagecache.get_key('other', ('problem',), '/p?page=1', False), key)
+
+
+class OnlineTest(base.BusTestCase):
+  def setUp(self):
+    super(OnlineTest, self).setUp()
+    pagecache.init()
+
+  def tearDown(self):
+    pagecache.uninit()
+    super(OnlineTest, self).tearDown()
+
+  @base.wrap_coro
+  async def test_invalidate(self):
+    problem_key = pagecache.get_key(DOMAIN_ID, ('problem',), '/p', False)
+    discussion_key = pagecache.get_key(DOMAIN_ID, ('discussion',), '/discuss', False)
+    other_key = pagecache.get_key('other', ('problem',), '/p', False)
+    for key in [problem_key, discussion_key, other_key]:
+      pagecache.set(key, _make_response(b'<ul></ul>'))
+    await pagecache.invalidate(DOMAIN_ID, 'problem')
+    self.assertIsNone(pagecache.get(pagecache.get_key(DOMAIN_ID, ('problem',), '/p', False)))
+    self.assertEqual(pagecache.get(pagecache.get_key(DOMAIN_ID, ('discussion',), '/discuss',
+                                                     False)).body, b'<ul></ul>')
+    self.assertEqual(pagecache.get(pagecache.get_key('other', ('problem',), '/p', False)).body,
+                     b'<ul></ul>')
+
+
+if __name__ == '__main__':
+  unittest.main()
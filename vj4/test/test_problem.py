@@ -13,7 +13,7 @@ CONTENT2 = 'dummy_content2'
 UID2 = 222
 
 
-class ProblemTest(base.DatabaseTestCase):
+class ProblemTest(base.BusTestCase):
   @base.wrap_coro
   async def test_add_get(self):
     pid = await problem.add(DOMAIN_ID, TITLE, CONTENT, UID, PID)
@@ -44,8 +44,20 @@ class ProblemTest(base.DatabaseTestCase):
     psdoc = await problem.get_status(DOMAIN_ID, PID, UID)
     self.assertTrue(psdoc['star'])
 
+  @base.wrap_coro
+  async def test_pin_inc(self):
+    await problem.add(DOMAIN_ID, TITLE, CONTENT, UID, PID)
+    problem.pin(await problem.get(DOMAIN_ID, PID), 60)
+    try:
+      await problem.inc(DOMAIN_ID, PID, 'num_submit', 1)
+      pdoc = await problem.get(DOMAIN_ID, PID)
+      self.assertEqual(pdoc['num_submit'], 1)
+      self.assertEqual(problem.get_pin_stats()['entries'], 1)
+    finally:
+      problem.uninit()
+
 
-class ProblemSolutionTest(base.DatabaseTestCase):
+class ProblemSolutionTest(base.BusTestCase):
   def setUp(self):
     super(ProblemSolutionTest, self).setUp()
     base.wait(problem.add(DOMAIN_ID, TITLE, CONTENT, UID, PID))
@@ -0,0 +1,53 @@
+import unittest
+
+from vj4.model import token
+from vj4.service import sessioncache
+from vj4.test import base
+
+EXPIRE_SECONDS = 3600
+UID = 22
+
+
+class Test(base.BusTestCase):
+  def setUp(self):
+    super(Test, self).setUp()
+    sessioncache.init()
+
+  def tearDown(self):
+    sessioncache.uninit()
+    super(Test, self).tearDown()
+
+  @base.wrap_coro
+  async def test_touch(self):
+    sid, doc = await sessioncache.add(token.TYPE_SAVED_SESSION, EXPIRE_SECONDS, uid=UID,
+                                      update_ip='1.1.1.1')
+    with base.RoundTripCounter() as counter:
+      session = await sessioncache.update(sid, token.TYPE_SAVED_SESSION, EXPIRE_SECONDS,
+                                          update_ip='1.1.1.1')
+      self.assertEqual(session['uid'], UID)
+      self.assertEqual(counter.total, 0)
+      session = await sessioncache.update(sid, token.TYPE_SAVED_SESSION, EXPIRE_SECONDS,
+                                          update_ip='2.2.2.2')
+      self.assertEqual(session['update_ip'], '2.2.2.2')
+      self.assertEqual(counter.total, 0)
+    self.assertEqual((await token.get(sid, token.TYPE_SAVED_SESSION))['update_ip'], '1.1.1.1')
+    await sessioncache.flush()
+    self.assertEqual((await token.get(sid, token.TYPE_SAVED_SESSION))['update_ip'], '2.2.2.2')
+
+  @base.wrap_coro
+  async def test_write_through(self):
+    sid, _ = await sessioncache.add(token.TYPE_UNSAVED_SESSION, EXPIRE_SECONDS, view_lang='en')
+    await sessioncache.update(sid, token.TYPE_UNSAVED_SESSION, EXPIRE_SECONDS, uid=UID)
+    self.assertEqual((await token.get(sid, token.TYPE_UNSAVED_SESSION))['uid'], UID)
+    session = await sessioncache.update(sid, token.TYPE_UNSAVED_SESSION, EXPIRE_SECONDS)
+    self.assertEqual(session['uid'], UID)
+
+  @base.wrap_coro
+  async def test_delete(self):
+    sid, _ = await sessioncache.add(token.TYPE_SAVED_SESSION, EXPIRE_SECONDS, uid=UID)
+    await sessioncache.delete_by_uid(UID)
+    self.assertIsNone(await sessioncache.update(sid, token.TYPE_SAVED_SESSION, EXPIRE_SECONDS))
+
+
+if __name__ == '__main__':
+  unittest.main()
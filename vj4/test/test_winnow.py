@@ -0,0 +1,78 @@
+import random
+import unittest
+
+from vj4.util import winnow
+
+CODE = '''
+#include <stdio.h>
+int main() {
+  int sum = 0;  // accumulate
+  for (int i = 0; i < 10; i++) {
+    sum += i * 2;
+  }
+  printf("%d\\n", sum);
+  return 0;
+}
+'''
+RENAMED_CODE = '''
+#include <stdio.h>
+/* renamed */
+int main()
+{
+  int total = 0;
+  for (int j = 0; j < 100; j++) { total += j * 3; }
+  printf("total %d\\n", total);
+  return 0;
+}
+'''
+OTHER_CODE = '''
+#include <stdio.h>
+int main() {
+  char s[100];
+  while (scanf("%s", s) == 1) puts(s);
+}
+'''
+
+
+class Test(unittest.TestCase):
+  def test_tokenize(self):
+    self.assertEqual(winnow.tokenize('x = 1 # one\ny = "a#b"', 'python'),
+                     ['V', '=', 'N', 'V', '=', 'S'])
+    self.assertEqual(winnow.tokenize('if (a) /* b */ return c;', 'c'),
+                     ['if', '(', 'V', ')', 'return', 'V', ';'])
+
+  def test_winnow(self):
+    hashes = [random.randrange(100) for _ in range(500)]
+    expected = []
+    for i in range(len(hashes) - 4):
+      window = hashes[i:i + 5]
+      position = i + 4 - window[::-1].index(min(window))
+      if not expected or expected[-1][1] != position:
+        expected.append((hashes[position], position))
+    self.assertEqual(winnow.winnow(hashes, 5), expected)
+    self.assertEqual(winnow.winnow([3, 1, 2, 1], 5), [(1, 3)])
+    self.assertEqual(winnow.winnow([], 5), [])
+
+  def test_fingerprint_renamed(self):
+    self.assertEqual(winnow.fingerprint(CODE, 'c'), winnow.fingerprint(RENAMED_CODE, 'c'))
+    self.assertNotEqual(winnow.fingerprint(CODE, 'c'), winnow.fingerprint(OTHER_CODE, 'c'))
+
+  def test_match_all(self):
+    documents = [('a', winnow.fingerprint(CODE, 'c')),
+                 ('b', winnow.fingerprint(OTHER_CODE, 'c')),
+                 ('c', winnow.fingerprint(RENAMED_CODE, 'c'))]
+    pairs, index = winnow.match_all(documents, min_shared=2)
+    self.assertEqual([(a, b) for a, b, _ in pairs], [('a', 'c')])
+    self.assertEqual(index.similarity('a', 'c', pairs[0][2]), (1.0, 1.0))
+
+  def test_ignore_limit(self):
+    index = winnow.Index(ignore_limit=2)
+    self.assertEqual(index.add('a', [1, 2]), {})
+    self.assertEqual(index.add('b', [1, 3]), {'a': 1})
+    self.assertEqual(index.add('c', [1, 2]), {'a': 1})
+    pairs, _ = winnow.match_all([('a', [1, 2]), ('b', [1, 3]), ('c', [1, 2])], ignore_limit=2)
+    self.assertEqual(pairs, [('a', 'c', 1)])
+
+
+if __name__ == '__main__':
+  unittest.main()
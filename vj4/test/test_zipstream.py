@@ -0,0 +1,28 @@
+import io
+import unittest
+import zipfile
+
+from vj4.util import zipstream
+
+
+class Test(unittest.TestCase):
+  def test_stream(self):
+    zip_stream = zipstream.ZipStream()
+    chunks = [zip_stream.write(zipstream.make_info('a/b.txt', create_system=0), 'hello' * 1000),
+              zip_stream.write('c.bin', b'\0' * 10)]
+    self.assertTrue(all(chunks))
+    chunks.append(zip_stream.close())
+    zip_file = zipfile.ZipFile(io.BytesIO(b''.join(chunks)))
+    self.assertIsNone(zip_file.testzip())
+    self.assertListEqual(zip_file.namelist(), ['a/b.txt', 'c.bin'])
+    self.assertEqual(zip_file.read('a/b.txt'), b'hello' * 1000)
+    self.assertEqual(zip_file.getinfo('a/b.txt').create_system, 0)
+    self.assertEqual(zip_file.read('c.bin'), b'\0' * 10)
+
+  def test_empty(self):
+    zip_file = zipfile.ZipFile(io.BytesIO(zipstream.ZipStream().close()))
+    self.assertListEqual(zip_file.namelist(), [])
+
+
+if __name__ == '__main__':
+  unittest.main()
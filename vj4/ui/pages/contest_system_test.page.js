@@ -2,17 +2,22 @@ import { NamedPage } from 'vj/misc/PageLoader';
 import { LANG_MOSS_WILDCARDS } from 'vj/constant/language';
 
 const page = new NamedPage('contest_system_test', async () => {
-  const $language = $('[name="language"]');
-  const $wildcards = $('[name="wildcards"]');
+  $('form').each((i, form) => {
+    const $language = $(form).find('[name="language"]');
+    const $wildcards = $(form).find('[name="wildcards"]');
+    if ($language.length === 0) {
+      return;
+    }
 
-  const changeWildcards = () => {
-    const lang = $language.val();
-    const wildcards = LANG_MOSS_WILDCARDS[lang] || [];
-    $wildcards.val(wildcards.join(', '));
-  };
+    const changeWildcards = () => {
+      const lang = $language.val();
+      const wildcards = LANG_MOSS_WILDCARDS[lang] || [];
+      $wildcards.val(wildcards.join(', '));
+    };
 
-  $language.on('change', changeWildcards);
-  changeWildcards();
+    $language.on('change', changeWildcards);
+    changeWildcards();
+  });
 });
 
 export default page;
@@ -0,0 +1,51 @@
+"""A request-scoped identity map, so a document is read at most once per request.
+
+Documents are keyed by (collection, domain_id, id). Model getters take an optional idmap and read
+through it, concurrent reads of the same key share one database read.
+"""
+import asyncio
+import collections
+
+# Reads of all identity maps in this process, for debugging.
+_stats = collections.Counter()
+
+
+class IdentityMap(object):
+  def __init__(self):
+    self._futures = {}
+    self.reads = 0
+    self.avoided_reads = 0
+
+  def __contains__(self, key):
+    return key in self._futures
+
+  async def get(self, key, load):
+    """Get a copy of the document of key, which is loaded by awaiting load() at most once."""
+    future = self._futures.get(key)
+    if future is None:
+      self.reads += 1
+      _stats['reads'] += 1
+      future = self._futures[key] = asyncio.ensure_future(load())
+    else:
+      self.avoided_reads += 1
+      _stats['avoided_reads'] += 1
+    try:
+      doc = await asyncio.shield(future)
+    except Exception:
+      if self._futures.get(key) is future:
+        del self._futures[key]
+      raise
+    return dict(doc) if doc is not None else None
+
+  def set(self, key, doc):
+    """Remember a document which was just written, so it is not read back."""
+    future = asyncio.get_event_loop().create_future()
+    future.set_result(doc)
+    self._futures[key] = future
+
+  def discard(self, key):
+    self._futures.pop(key, None)
+
+
+def get_stats():
+  return dict(_stats)
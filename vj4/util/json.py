@@ -1,9 +1,30 @@
+import asyncio
 import calendar
 import datetime
 import json
 
 from bson import objectid
 
+try:
+  import orjson
+except ImportError:
+  orjson = None
+
+from vj4.util import options
+
+options.define('json_backend', default='orjson',
+               help='Backend of JSON encoding, orjson or json. Falls back to json if not installed.')
+options.define('json_executor_min_size', default=262144,
+               help='Approximate minimum size of JSON to encode in the executor, in bytes.')
+
+
+def _default(o):
+  if type(o) is objectid.ObjectId:
+    return str(o)
+  if type(o) is datetime.datetime:
+    return calendar.timegm(o.utctimetuple()) * 1000
+  raise TypeError('{0} is not JSON serializable'.format(repr(o)))
+
 
 class Encoder(json.JSONEncoder):
   item_separator = ','
@@ -13,11 +34,7 @@ class Encoder(json.JSONEncoder):
     super(Encoder, self).__init__(ensure_ascii=False, **kwargs)
 
   def default(self, o):
-    if type(o) is objectid.ObjectId:
-      return str(o)
-    if type(o) is datetime.datetime:
-      return calendar.timegm(o.utctimetuple()) * 1000
-    return super(Encoder, self).default(o)
+    return _default(o)
 
 
 class EncoderPretty(Encoder):
@@ -35,6 +52,67 @@ class Decoder(json.JSONDecoder):
   pass
 
 
-encode = Encoder().encode
+_encode_json = Encoder().encode
+
+
+def _encode_bytes_json(obj):
+  return _encode_json(obj).encode()
+
+
+if orjson:
+  # Leave the types which json does not know to _default, and stringify keys like json does.
+  _ORJSON_OPTIONS = (orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME
+                     | orjson.OPT_PASSTHROUGH_DATACLASS)
+
+  def _encode_bytes_orjson(obj):
+    try:
+      return orjson.dumps(obj, default=_default, option=_ORJSON_OPTIONS)
+    except orjson.JSONEncodeError:
+      # For example integers over 64 bits, which json handles, or unsupported types, for which json
+      # raises the same TypeError.
+      return _encode_bytes_json(obj)
+
+  def _encode_orjson(obj):
+    try:
+      return orjson.dumps(obj, default=_default, option=_ORJSON_OPTIONS).decode()
+    except orjson.JSONEncodeError:
+      return _encode_json(obj)
+
+
+if orjson and options.json_backend == 'orjson':
+  encode, encode_bytes = _encode_orjson, _encode_bytes_orjson
+else:
+  encode, encode_bytes = _encode_json, _encode_bytes_json
 encode_pretty = EncoderPretty().encode
 decode = Decoder().decode
+
+
+def is_large(obj, min_size=None):
+  """Whether obj encodes to about min_size bytes or more, which is told without walking all of it."""
+  if min_size is None:
+    min_size = options.json_executor_min_size
+  size = 0
+  stack = [obj]
+  while stack:
+    o = stack.pop()
+    if isinstance(o, str):
+      size += len(o) + 2
+    elif isinstance(o, dict):
+      size += 2 + len(o) * 2
+      stack.extend(o.keys())
+      stack.extend(o.values())
+    elif isinstance(o, (list, tuple)):
+      size += 2 + len(o)
+      stack.extend(o)
+    else:
+      size += 8
+    if size >= min_size:
+      return True
+  return False
+
+
+async def encode_bytes_async(obj):
+  """Encode obj like encode_bytes, in the executor if it is large."""
+  if is_large(obj):
+    return await asyncio.get_event_loop().run_in_executor(None, encode_bytes, obj)
+  return encode_bytes(obj)
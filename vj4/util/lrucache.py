@@ -0,0 +1,60 @@
+"""A bounded in-process LRU cache with optional per-entry time to live."""
+import collections
+import time
+
+_MISSING = object()
+
+
+class LruCache(object):
+  def __init__(self, max_entries, ttl_seconds=None):
+    self.max_entries = max_entries
+    self.ttl_seconds = ttl_seconds
+    self.hits = 0
+    self.misses = 0
+    self._entries = collections.OrderedDict()
+
+  def __len__(self):
+    return len(self._entries)
+
+  def __contains__(self, key):
+    return self.get(key, _MISSING, count=False) is not _MISSING
+
+  def get(self, key, default=None, *, count=True):
+    entry = self._entries.get(key)
+    if entry is not None and (entry[0] is None or entry[0] > time.monotonic()):
+      self._entries.move_to_end(key)
+      if count:
+        self.hits += 1
+      return entry[1]
+    if entry is not None:
+      del self._entries[key]
+    if count:
+      self.misses += 1
+    return default
+
+  def set(self, key, value, ttl_seconds=None):
+    ttl_seconds = ttl_seconds if ttl_seconds is not None else self.ttl_seconds
+    expire_at = time.monotonic() + ttl_seconds if ttl_seconds is not None else None
+    self._entries[key] = (expire_at, value)
+    self._entries.move_to_end(key)
+    while len(self._entries) > self.max_entries:
+      self._entries.popitem(False)
+
+  def values(self):
+    """Iterate over the values which have not expired, without counting or reordering them."""
+    now = time.monotonic()
+    return (value for expire_at, value in self._entries.values() if expire_at is None or expire_at > now)
+
+  def pop(self, key):
+    entry = self._entries.pop(key, None)
+    return entry[1] if entry is not None else None
+
+  def clear(self):
+    self._entries.clear()
+
+  def stats(self):
+    total = self.hits + self.misses
+    return {'entries': len(self._entries),
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / total if total else 0.0}
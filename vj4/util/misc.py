@@ -1,13 +1,18 @@
+import asyncio
 import base64
+import collections
 import hashlib
 import hoedown
 import jinja2
 import mimetypes
 import markupsafe
+import os
 import re
+import stat
 from urllib import parse
 from collections import OrderedDict
 
+from vj4.util import lrucache
 from vj4.util import options
 from vj4 import constant
 from vj4 import error
@@ -25,6 +30,16 @@ MARKDOWN_RENDER_FLAGS = (hoedown.HTML_ESCAPE |  # Escape all HTML.
 
 FS_RE = re.compile(r'\(vijos\:\/\/fs\/([0-9a-f]{40,})\)')
 
+options.define('markdown_cache_max_entries', default=4096,
+               help='Maximum number of rendered markdown texts cached per process.')
+options.define('markdown_pin_max_entries', default=1024,
+               help='Maximum number of rendered markdown texts pinned per process.')
+
+# Rendered markdown keyed by the digest of the text.
+_markdown_cache = lrucache.LruCache(options.markdown_cache_max_entries)
+# Rendered markdown of upcoming contests and their problems, which is not evicted by other texts.
+_pinned_markdown = lrucache.LruCache(options.markdown_pin_max_entries)
+
 
 def nl2br(text):
   markup = jinja2.escape(text)
@@ -36,12 +51,43 @@ def fs_replace(m):
   return '(' + options.cdn_prefix.rstrip('/') + '/fs/' + m.group(1) + ')'
 
 
-def markdown(text):
+def _render_markdown(text):
   text = FS_RE.sub(fs_replace, text)
   return markupsafe.Markup(hoedown.html(
     text, extensions=MARKDOWN_EXTENSIONS, render_flags=MARKDOWN_RENDER_FLAGS))
 
 
+def _markdown_key(text):
+  return hashlib.sha1(text.encode()).digest()
+
+
+def markdown(text):
+  key = _markdown_key(text)
+  html = _pinned_markdown.get(key, count=False)
+  if html is not None:
+    return html
+  html = _markdown_cache.get(key)
+  if html is None:
+    html = _render_markdown(text)
+    _markdown_cache.set(key, html)
+  return html
+
+
+def pin_markdown(text, ttl_seconds):
+  """Render text now and serve the result from memory for ttl_seconds."""
+  key = _markdown_key(text)
+  html = _markdown_cache.get(key, count=False)
+  if html is None:
+    html = _render_markdown(text)
+  _pinned_markdown.set(key, html, ttl_seconds)
+
+
+def get_markdown_stats():
+  return {**_markdown_cache.stats(),
+          'bytes': sum(len(html.encode()) for html in _markdown_cache.values()),
+          'pinned': len(_pinned_markdown)}
+
+
 def gravatar_url(gravatar, size=200):
   # TODO: 'd' should be https://domain/img/avatar.png
   if gravatar:
@@ -141,3 +187,39 @@ def filter_content_type(filename: str, file_types: list):
   if file_type not in file_types:
     raise error.FileTypeNotAllowedError(filename)
   return type, file_type
+
+
+async def prefetch(func, items, window):
+  """Yields the result of awaiting func(item) for each item in order, with at most window calls
+  running concurrently. items can be an iterable or an async iterable."""
+  pending = collections.deque()
+  try:
+    if hasattr(items, '__aiter__'):
+      async for item in items:
+        pending.append(asyncio.ensure_future(func(item)))
+        if len(pending) >= window:
+          yield await pending.popleft()
+    else:
+      for item in items:
+        pending.append(asyncio.ensure_future(func(item)))
+        if len(pending) >= window:
+          yield await pending.popleft()
+    while pending:
+      yield await pending.popleft()
+  finally:
+    for future in pending:
+      future.cancel()
+
+
+def make_private_dir(dir_path, deny_mode=stat.S_IWGRP | stat.S_IWOTH):
+  """Create a directory of mode 0700 if it does not exist, and check that it is private.
+
+  Raises:
+    PermissionError: the directory is a symbolic link, is owned by another user, or has any of the
+        permission bits in deny_mode, which by default means that others may write there.
+  """
+  os.makedirs(dir_path, mode=0o700, exist_ok=True)
+  st = os.lstat(dir_path)
+  if not stat.S_ISDIR(st.st_mode) or st.st_uid != os.getuid() or st.st_mode & deny_mode:
+    raise PermissionError('{0} is not a private directory'.format(dir_path))
+  return dir_path
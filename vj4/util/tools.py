@@ -1,21 +1,55 @@
+import asyncio
+import hashlib
+import importlib
+import inspect
 import logging
 import pkgutil
+import time
 from os import path
 
+from vj4.model import system
 from vj4.util import argmethod
 
 _logger = logging.getLogger(__name__)
 
 
-@argmethod.wrap
-async def ensure_all_indexes():
+def _index_modules():
   model_path = path.join(path.dirname(path.dirname(__file__)), 'model')
+  modules = []
   for module_finder, name, ispkg in pkgutil.iter_modules([model_path]):
     if not ispkg:
-      module = module_finder.find_module(name).load_module()
-      if 'ensure_indexes' in dir(module):
-        _logger.info('Ensuring indexes for "%s".' % name)
-        await module.ensure_indexes()
+      module = importlib.import_module('vj4.model.' + name)
+      if hasattr(module, 'ensure_indexes'):
+        modules.append(module)
+  return modules
+
+
+def get_index_fingerprint(modules):
+  """Hash of the code of ensure_indexes in modules, which changes when any index spec changes."""
+  sha1 = hashlib.sha1()
+  for module in sorted(modules, key=lambda module: module.__name__):
+    sha1.update(module.__name__.encode())
+    sha1.update(inspect.getsource(module.ensure_indexes).encode())
+  return sha1.hexdigest()
+
+
+@argmethod.wrap
+async def ensure_all_indexes():
+  start = time.perf_counter()
+  modules = _index_modules()
+  _logger.info('Ensuring indexes for %s.', ', '.join(module.__name__ for module in modules))
+  await asyncio.gather(*[module.ensure_indexes() for module in modules])
+  await system.set_index_fingerprint(get_index_fingerprint(modules))
+  _logger.info('Ensured indexes in %.3fs.', time.perf_counter() - start)
+
+
+@argmethod.wrap
+async def ensure_all_indexes_if_changed():
+  """Ensure all indexes unless their fingerprint matches the one ensured last time."""
+  if await system.get_index_fingerprint() == get_index_fingerprint(_index_modules()):
+    _logger.info('Indexes unchanged, skipped ensuring them.')
+    return
+  await ensure_all_indexes()
 
 
 if __name__ == '__main__':
@@ -0,0 +1,209 @@
+"""Source code fingerprinting by winnowing k-grams of normalized tokens.
+
+See Schleimer, Wilkerson and Aiken, "Winnowing: Local Algorithms for Document Fingerprinting".
+"""
+import collections
+import re
+import zlib
+
+DEFAULT_K = 12
+DEFAULT_WINDOW = 6
+
+_HASH_BASE = 1000003
+_HASH_MOD = (1 << 61) - 1
+
+_C_COMMENT = r'//[^\n]*|/\*.*?\*/'
+_STRING = r'"(?:\\.|[^"\\\n])*"|\'(?:\\.|[^\'\\\n])*\''
+
+_COMMENTS = {
+    'c': _C_COMMENT,
+    'cc': _C_COMMENT,
+    'java': _C_COMMENT,
+    'ocaml': r'\(\*.*?\*\)',
+    'matlab': r'%\{.*?%\}|%[^\n]*',
+    'python': r'#[^\n]*',
+}
+_STRINGS = {
+    'ocaml': r'"(?:\\.|[^"\\])*"',
+    'matlab': r'"(?:[^"\n]|"")*"',
+    'python': r'[rRbBuUfF]{0,2}(?:"""(?:\\.|.)*?"""|\'\'\'(?:\\.|.)*?\'\'\'|' + _STRING + ')',
+}
+
+_C_KEYWORDS = {
+    'auto', 'break', 'case', 'char', 'const', 'continue', 'default', 'do', 'double', 'else', 'enum',
+    'extern', 'float', 'for', 'goto', 'if', 'int', 'long', 'register', 'return', 'short', 'signed',
+    'sizeof', 'static', 'struct', 'switch', 'typedef', 'union', 'unsigned', 'void', 'volatile',
+    'while', 'bool', 'true', 'false', 'NULL', 'include', 'define',
+}
+_KEYWORDS = {
+    'c': _C_KEYWORDS,
+    'cc': _C_KEYWORDS | {
+        'class', 'public', 'private', 'protected', 'virtual', 'template', 'typename', 'namespace',
+        'using', 'new', 'delete', 'this', 'operator', 'try', 'catch', 'throw', 'const_cast',
+        'static_cast', 'dynamic_cast', 'reinterpret_cast', 'nullptr', 'auto', 'std',
+    },
+    'java': {
+        'abstract', 'boolean', 'break', 'byte', 'case', 'catch', 'char', 'class', 'continue',
+        'default', 'do', 'double', 'else', 'enum', 'extends', 'final', 'finally', 'float', 'for', 'if',
+        'implements', 'import', 'instanceof', 'int', 'interface', 'long', 'new', 'package', 'private',
+        'protected', 'public', 'return', 'short', 'static', 'super', 'switch', 'synchronized', 'this',
+        'throw', 'throws', 'try', 'void', 'while', 'true', 'false', 'null',
+    },
+    'ocaml': {
+        'and', 'as', 'begin', 'do', 'done', 'downto', 'else', 'end', 'exception', 'for', 'fun',
+        'function', 'if', 'in', 'let', 'match', 'module', 'mutable', 'of', 'open', 'rec', 'then', 'to',
+        'try', 'type', 'when', 'while', 'with', 'true', 'false',
+    },
+    'matlab': {
+        'break', 'case', 'catch', 'continue', 'else', 'elseif', 'end', 'for', 'function', 'global',
+        'if', 'otherwise', 'persistent', 'return', 'switch', 'try', 'while',
+    },
+    'python': {
+        'and', 'as', 'assert', 'async', 'await', 'break', 'class', 'continue', 'def', 'del', 'elif',
+        'else', 'except', 'finally', 'for', 'from', 'global', 'if', 'import', 'in', 'is', 'lambda',
+        'nonlocal', 'not', 'or', 'pass', 'raise', 'return', 'try', 'while', 'with', 'yield', 'None',
+        'True', 'False', 'self',
+    },
+}
+
+_TOKEN_PATTERNS = {}
+
+
+def _token_pattern(lang):
+  pattern = _TOKEN_PATTERNS.get(lang)
+  if not pattern:
+    pattern = re.compile(r'(?P<comment>{0})|(?P<string>{1})|(?P<number>\d[\w.]*)|(?P<name>[A-Za-z_]\w*)|'
+                         r'(?P<space>\s+)|(?P<op>.)'.format(_COMMENTS.get(lang, r'(?!)'),
+                                                           _STRINGS.get(lang, _STRING)),
+                         re.DOTALL)
+    _TOKEN_PATTERNS[lang] = pattern
+  return pattern
+
+
+def tokenize(text: str, lang: str):
+  """Normalize source code into tokens.
+
+  Comments and whitespace are dropped, literals collapse into one token per kind and identifiers
+  other than keywords collapse into one token, so renaming does not hide copied code.
+  """
+  keywords = _KEYWORDS.get(lang, frozenset())
+  tokens = []
+  for match in _token_pattern(lang).finditer(text):
+    kind = match.lastgroup
+    if kind == 'name':
+      value = match.group()
+      tokens.append(value if value in keywords else 'V')
+    elif kind == 'number':
+      tokens.append('N')
+    elif kind == 'string':
+      tokens.append('S')
+    elif kind == 'op':
+      tokens.append(match.group())
+  return tokens
+
+
+def _hash_token(token):
+  # Stable across processes, unlike the builtin hash of str.
+  return zlib.crc32(token.encode())
+
+
+def kgram_hashes(tokens: list, k: int = DEFAULT_K):
+  """Rolling hashes of every k consecutive tokens."""
+  if len(tokens) < k:
+    return []
+  values = [_hash_token(token) for token in tokens]
+  top = pow(_HASH_BASE, k - 1, _HASH_MOD)
+  h = 0
+  for value in values[:k]:
+    h = (h * _HASH_BASE + value) % _HASH_MOD
+  hashes = [h]
+  for i in range(k, len(values)):
+    h = ((h - values[i - k] * top) * _HASH_BASE + values[i]) % _HASH_MOD
+    hashes.append(h)
+  return hashes
+
+
+def winnow(hashes: list, window: int = DEFAULT_WINDOW):
+  """Select the rightmost minimum hash of every window, returning (hash, position) in order.
+
+  Any match of at least window + k - 1 tokens is guaranteed to share a selected fingerprint.
+  """
+  if len(hashes) < window:
+    # The whole document is shorter than one window.
+    if not hashes:
+      return []
+    position = len(hashes) - 1 - hashes[::-1].index(min(hashes))
+    return [(hashes[position], position)]
+  fingerprints = []
+  # Monotonic queue of positions with increasing hashes; the front is the rightmost minimum.
+  queue = collections.deque()
+  last = -1
+  for i, h in enumerate(hashes):
+    while queue and hashes[queue[-1]] >= h:
+      queue.pop()
+    queue.append(i)
+    if queue[0] <= i - window:
+      queue.popleft()
+    if i >= window - 1 and queue[0] != last:
+      last = queue[0]
+      fingerprints.append((hashes[last], last))
+  return fingerprints
+
+
+def fingerprint(text: str, lang: str, k: int = DEFAULT_K, window: int = DEFAULT_WINDOW):
+  """Sorted distinct winnowed fingerprints of source code."""
+  return sorted({h for h, _ in winnow(kgram_hashes(tokenize(text, lang), k), window)})
+
+
+class Index(object):
+  """Inverted index from fingerprints to documents for incremental candidate pair search.
+
+  A fingerprint shared by more than ignore_limit documents is treated as boilerplate and no
+  longer matched, like the -m option of MOSS. This also bounds the cost of each query.
+  """
+
+  def __init__(self, ignore_limit: int = 10):
+    self.ignore_limit = ignore_limit
+    self.postings = collections.defaultdict(list)
+    self.sizes = {}
+
+  def __len__(self):
+    return len(self.sizes)
+
+  def query(self, fingerprints):
+    """Count the fingerprints shared with every indexed document, without adding."""
+    shared = collections.Counter()
+    for h in fingerprints:
+      posting = self.postings.get(h)
+      if posting and len(posting) < self.ignore_limit:
+        shared.update(posting)
+    return shared
+
+  def add(self, key, fingerprints):
+    """Add a document and return the number of fingerprints shared with each earlier document."""
+    shared = self.query(fingerprints)
+    for h in fingerprints:
+      self.postings[h].append(key)
+    self.sizes[key] = len(fingerprints)
+    return shared
+
+  def similarity(self, key, other_key, shared):
+    """Fraction of the fingerprints of key and of other_key that are shared."""
+    return shared / (self.sizes[key] or 1), shared / (self.sizes[other_key] or 1)
+
+
+def match_all(documents, ignore_limit: int = 10, min_shared: int = 1):
+  """Find candidate pairs among (key, fingerprints), returning (key_a, key_b, shared) for each.
+
+  Unlike adding to an Index one by one, fingerprints are ignored by their frequency in all documents.
+  """
+  documents = list(documents)
+  frequencies = collections.Counter(h for _, fingerprints in documents for h in fingerprints)
+  index = Index(ignore_limit)
+  pairs = []
+  for key, fingerprints in documents:
+    fingerprints = [h for h in fingerprints if frequencies[h] <= ignore_limit]
+    for other_key, shared in index.add(key, fingerprints).items():
+      if shared >= min_shared:
+        pairs.append((other_key, key, shared))
+  return pairs, index
@@ -0,0 +1,59 @@
+"""A ZIP writer which emits the archive as entries are added.
+
+The archive is never held in memory as a whole: each call returns the bytes produced so far, which
+the caller is expected to send right away.
+"""
+import time
+import zipfile
+
+
+class _Sink(object):
+  """A non-seekable file object which collects the written bytes."""
+
+  def __init__(self):
+    self._chunks = []
+    self._offset = 0
+
+  def write(self, data):
+    self._chunks.append(bytes(data))
+    self._offset += len(data)
+    return len(data)
+
+  def tell(self):
+    return self._offset
+
+  def flush(self):
+    pass
+
+  def pop(self):
+    data = b''.join(self._chunks)
+    self._chunks.clear()
+    return data
+
+
+def make_info(name, compression=zipfile.ZIP_DEFLATED, external_attr=0o600 << 16, create_system=None):
+  """Make a zip info dated now, like ZipFile.writestr does for a name."""
+  zip_info = zipfile.ZipInfo(name, time.localtime(time.time())[:6])
+  zip_info.compress_type = compression
+  zip_info.external_attr = external_attr
+  if create_system is not None:
+    zip_info.create_system = create_system
+  return zip_info
+
+
+class ZipStream(object):
+  def __init__(self, compression=zipfile.ZIP_DEFLATED):
+    self._sink = _Sink()
+    self._zip_file = zipfile.ZipFile(self._sink, 'w', compression)
+
+  def write(self, zip_info_or_name, data):
+    """Add an entry. Returns the bytes of the archive produced by this entry."""
+    if isinstance(data, str):
+      data = data.encode()
+    self._zip_file.writestr(zip_info_or_name, data)
+    return self._sink.pop()
+
+  def close(self):
+    """Finish the archive. Returns the remaining bytes, which contain the central directory."""
+    self._zip_file.close()
+    return self._sink.pop()